@@ -0,0 +1,104 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from .models import CustomUser
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityBuffer:
+    """
+    Per-process write-behind buffer of user activity timestamps.
+
+    last_login (and last_seen) values are kept in memory and written every
+    flush_interval seconds with one bulk UPDATE per field and batch, so
+    repeated activity by the same user collapses into a single write. A
+    crashed process loses at most one interval of timestamps; with a
+    flush_interval of 0 every timestamp is written immediately.
+
+    The flush thread is started by the first record() in each process, so
+    workers forked from a preloaded master (gunicorn --preload) get their own.
+    """
+
+    def __init__(self, flush_interval, batch_size, max_size):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_size = max_size
+        self._pending = defaultdict(dict)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flusher_pid = None
+
+    def record(self, field, user_id, when=None):
+        when = when or timezone.now()
+
+        if self.flush_interval <= 0:
+            CustomUser.objects.filter(pk=user_id).update(**{field: when})
+            return
+
+        if self._flusher_pid != os.getpid():
+            self._start_flusher()
+
+        with self._lock:
+            self._pending[field][user_id] = when
+            full = sum(len(timestamps) for timestamps in self._pending.values()) >= self.max_size
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Write every buffered timestamp; returns the number of rows updated"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, defaultdict(dict)
+
+            written = 0
+            for field, timestamps in pending.items():
+                users = [CustomUser(pk=user_id, **{field: when}) for user_id, when in timestamps.items()]
+                try:
+                    written += CustomUser.objects.bulk_update(users, [field], batch_size=self.batch_size)
+                except Exception as e:
+                    logger.error(f"Activity flush of {len(users)} {field} timestamps failed: {str(e)}")
+                    self._requeue(field, timestamps)
+
+            return written
+
+    def _requeue(self, field, timestamps):
+        # Keep newer timestamps recorded while the flush was running
+        with self._lock:
+            for user_id, when in timestamps.items():
+                self._pending[field].setdefault(user_id, when)
+
+    def _start_flusher(self):
+        """Flush every flush_interval seconds in a daemon thread of this process, and at exit"""
+        with self._lock:
+            pid = os.getpid()
+            if self._flusher_pid == pid:
+                return
+            self._flusher_pid = pid
+
+        atexit.register(self.flush)
+        threading.Thread(target=self._flush_loop, name='activity-flush', daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+
+            close_old_connections()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+
+activity_buffer = ActivityBuffer(
+    flush_interval=settings.ACTIVITY_FLUSH_INTERVAL,
+    batch_size=settings.ACTIVITY_FLUSH_BATCH_SIZE,
+    max_size=settings.ACTIVITY_BUFFER_MAX_SIZE,
+)
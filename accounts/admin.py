@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from .forms import CustomUserCreationForm, CustomUserChangeForm
-from .models import CustomUser, VerifyEmailToken
+from .models import CustomUser, VerifyEmailToken, EmailOutbox, TokenFamily
 
 
 class CustomUserAdmin(UserAdmin):
@@ -18,7 +18,7 @@ class CustomUserAdmin(UserAdmin):
         ('Personal info', {'fields': ('first_name', 'last_name', 'phone')}),
         ('Email verification', {'fields': ('is_email_verified', 'pending_email')}),
         ('Permissions', {'fields': ('is_active', 'is_staff', 'is_superuser', 'groups', 'user_permissions')}),
-        ('Important dates', {'fields': ('last_login', 'date_joined')}),
+        ('Important dates', {'fields': ('last_login', 'last_seen', 'date_joined')}),
     )
 
     add_fieldsets = (
@@ -28,7 +28,7 @@ class CustomUserAdmin(UserAdmin):
          ),
     )
 
-    readonly_fields = ['date_joined', 'last_login']
+    readonly_fields = ['date_joined', 'last_login', 'last_seen']
 
 
 class VerifyEmailTokenAdmin(admin.ModelAdmin):
@@ -46,5 +46,25 @@ class VerifyEmailTokenAdmin(admin.ModelAdmin):
     is_valid_status.short_description = 'Valid'
 
 
+class EmailOutboxAdmin(admin.ModelAdmin):
+    model = EmailOutbox
+    list_display = ['to_email', 'template', 'status', 'attempts', 'created_at', 'sent_at']
+    list_filter = ['status', 'template', 'created_at']
+    search_fields = ['to_email']
+    readonly_fields = ['created_at', 'sent_at', 'last_error']
+    ordering = ['-created_at']
+
+
+class TokenFamilyAdmin(admin.ModelAdmin):
+    model = TokenFamily
+    list_display = ['user', 'generation', 'revoked', 'created_at', 'expires_at']
+    list_filter = ['revoked', 'created_at']
+    search_fields = ['user__email']
+    readonly_fields = ['created_at']
+    ordering = ['-created_at']
+
+
 admin.site.register(CustomUser, CustomUserAdmin)
-admin.site.register(VerifyEmailToken, VerifyEmailTokenAdmin)
\ No newline at end of file
+admin.site.register(VerifyEmailToken, VerifyEmailTokenAdmin)
+admin.site.register(EmailOutbox, EmailOutboxAdmin)
+admin.site.register(TokenFamily, TokenFamilyAdmin)
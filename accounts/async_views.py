@@ -0,0 +1,607 @@
+"""
+Native async versions of the account views, for ASGI deployments.
+
+They mirror accounts.views endpoint for endpoint and return the same
+responses. Queries use Django's async ORM, password hashing is awaited
+through the hashing pool, and the account operations that must share a
+transaction are the ones in accounts.utils, each run as one sync_to_async
+call.
+"""
+import json
+import logging
+import math
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError
+from django.db.models import F
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.settings import api_settings
+from core.email import send_verification_email, send_password_reset_email
+from core.timing import query_budget
+from .hashing import HashingQueueFull, hashing_pool
+from .introspection import introspect_tokens
+from .models import CustomUser
+from .serializers import RegisterUserSerializer, UserProfileSerializer, CustomTokenObtainPairSerializer, \
+    IntrospectionSerializer
+from .throttling import check_throttles
+from .tokens import RefreshToken, revoke_user_tokens
+from .utils import register, send_token_email, verify_email, reset_password, request_email_change, \
+    confirm_email_change, cancel_email_change
+
+logger = logging.getLogger(__name__)
+
+
+def api_view(methods, authenticated=False):
+    """Parse the JSON body, authenticate if required, apply rate limits and turn hashing overload into a 503"""
+    def decorator(view):
+        @csrf_exempt
+        @require_http_methods(methods)
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            try:
+                request.data = json.loads(request.body or b'{}')
+            except ValueError:
+                return JsonResponse({'detail': 'Invalid JSON'}, status=status.HTTP_400_BAD_REQUEST)
+
+            # The views read fields with request.data.get(), so a list or a bare value is as invalid as bad JSON
+            if not isinstance(request.data, dict):
+                return JsonResponse({'detail': 'Expected a JSON object'}, status=status.HTTP_400_BAD_REQUEST)
+
+            if authenticated:
+                try:
+                    result = await sync_to_async(_authenticate)(request)
+                except AuthenticationFailed as e:
+                    detail = e.detail if isinstance(e.detail, dict) else {'detail': e.detail}
+                    return JsonResponse(detail, status=status.HTTP_401_UNAUTHORIZED)
+
+                if result is None:
+                    return JsonResponse(
+                        {'detail': 'Authentication credentials were not provided.'},
+                        status=status.HTTP_401_UNAUTHORIZED
+                    )
+
+                request.user, request.auth = result
+
+            wait = await sync_to_async(check_throttles)(request)
+            if wait is not None:
+                response = JsonResponse(
+                    {'detail': f'Request was throttled. Expected available in {math.ceil(wait)} seconds.'},
+                    status=status.HTTP_429_TOO_MANY_REQUESTS
+                )
+                response['Retry-After'] = str(math.ceil(wait))
+                return response
+
+            try:
+                return await view(request, *args, **kwargs)
+            except HashingQueueFull as e:
+                response = JsonResponse({'detail': e.detail}, status=e.status_code)
+                response['Retry-After'] = str(e.wait)
+                return response
+
+        return wrapper
+    return decorator
+
+
+def _authenticate(request):
+    for authenticator_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        result = authenticator_class().authenticate(request)
+        if result is not None:
+            return result
+    return None
+
+
+async def _load_deferred(user):
+    """Load fields left out of a token-built user before touching them in async code"""
+    deferred_fields = user.get_deferred_fields()
+    if deferred_fields:
+        await user.arefresh_from_db(fields=list(deferred_fields))
+
+
+@query_budget(5)
+@api_view(['POST'])
+async def register_view(request):
+    """Register a new user or resend verification if email exists and unverified"""
+    serializer = RegisterUserSerializer(data=request.data)
+
+    if not serializer.is_valid():
+        return JsonResponse(
+            {'detail': serializer.errors},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    email = serializer.validated_data['email']
+
+    try:
+        # Insert straight away and let the unique constraint on email detect existing accounts. Duplicate
+        # registrations pay for a hash, which the per-email and per-IP register throttles bound
+        try:
+            # Hash in the pool, not on the thread that runs the insert
+            encoded_password = await hashing_pool.amake_password(serializer.validated_data['password'])
+            await sync_to_async(register)(
+                email=email,
+                encoded_password=encoded_password,
+                first_name=serializer.validated_data['first_name'],
+                last_name=serializer.validated_data['last_name'],
+                phone=serializer.validated_data.get('phone', '')
+            )
+
+            return JsonResponse(
+                {'detail': 'Registration successful'},
+                status=status.HTTP_201_CREATED
+            )
+
+        except IntegrityError:
+            existing_user = await CustomUser.objects.aget(email=CustomUser.objects.normalize_email(email))
+
+        # If email already verified, return error
+        if existing_user.is_email_verified:
+            return JsonResponse(
+                {'detail': 'Email already exists'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # If email not verified, resend verification email unless one was just sent
+        if await sync_to_async(send_token_email)(existing_user, 'verify_email', send_verification_email):
+            logger.info(f"Verification email resent: {email}")
+
+        return JsonResponse(
+            {'detail': 'Verification email sent'},
+            status=status.HTTP_200_OK
+        )
+
+    except HashingQueueFull:
+        raise
+    except Exception as e:
+        logger.error(f"Registration failed: {str(e)}")
+        return JsonResponse(
+            {'detail': str(e)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+
+@query_budget(3)
+@api_view(['POST'])
+async def verify_email_view(request):
+    """Verify user email with token"""
+    token_string = request.data.get('token')
+
+    if not token_string:
+        return JsonResponse(
+            {'detail': 'Token is required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        user = await sync_to_async(verify_email)(token_string)
+
+        if user is None:
+            return JsonResponse(
+                {'detail': 'Token expired or used'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        logger.info(f"Email verification successful: {user.email}")
+
+        return JsonResponse(
+            {'detail': 'Email verification successful'},
+            status=status.HTTP_200_OK
+        )
+
+    except Exception as e:
+        logger.error(f"Email verification failed: {str(e)}")
+        return JsonResponse(
+            {'detail': 'Email verification failed'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+
+@query_budget(4)
+@api_view(['POST'])
+async def reset_password_view(request):
+    """Request password reset"""
+    email = request.data.get('email')
+
+    if not email:
+        return JsonResponse(
+            {'detail': 'Email is required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        user = await CustomUser.objects.aget(email=email)
+
+        # Generate reset token unless an email was just sent
+        if await sync_to_async(send_token_email)(user, 'reset_password', send_password_reset_email):
+            logger.info(f"Password reset email sent: {email}")
+
+    except Exception as e:
+        logger.error(f"Password reset request failed: {str(e)}")
+
+    # Don't reveal if email exists or not
+    return JsonResponse(
+        {'detail': 'Password reset email sent'},
+        status=status.HTTP_200_OK
+    )
+
+
+@query_budget(3)
+@api_view(['POST'])
+async def reset_password_confirm_view(request):
+    """Confirm password reset with token"""
+    token_string = request.data.get('token')
+    password = request.data.get('password')
+
+    if not token_string or not password:
+        return JsonResponse(
+            {'detail': 'Token and password are required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        # Validate password strength
+        validate_password(password)
+
+        # Hash before the transaction so the database thread never waits on it
+        encoded_password = await hashing_pool.amake_password(password)
+        user = await sync_to_async(reset_password)(token_string, encoded_password)
+
+        if user is None:
+            return JsonResponse(
+                {'detail': 'Token expired or used'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        logger.info(f"Password reset successful: {user.email}")
+
+        return JsonResponse(
+            {'detail': 'Password reset successful'},
+            status=status.HTTP_200_OK
+        )
+
+    except ValidationError as e:
+        return JsonResponse(
+            {'detail': e.messages},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    except HashingQueueFull:
+        raise
+    except Exception as e:
+        logger.error(f"Password reset confirmation failed: {str(e)}")
+        return JsonResponse(
+            {'detail': 'Password reset failed'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+
+@api_view(['GET', 'PATCH', 'DELETE'], authenticated=True)
+async def profile_view(request):
+    """Get, update, or delete user profile"""
+    user = request.user
+
+    if request.method == 'GET':
+        await _load_deferred(user)
+        serializer = UserProfileSerializer(user)
+        return JsonResponse(serializer.data, status=status.HTTP_200_OK)
+
+    elif request.method == 'PATCH':
+        serializer = UserProfileSerializer(user, data=request.data, partial=True)
+
+        if not serializer.is_valid():
+            return JsonResponse(
+                {'detail': serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        await sync_to_async(serializer.save)()
+
+        logger.info(f"Profile updated: {user.email}")
+
+        return JsonResponse(
+            {'detail': 'Profile updated successfully'},
+            status=status.HTTP_200_OK
+        )
+
+    elif request.method == 'DELETE':
+        password = request.data.get('password')
+
+        if not password:
+            return JsonResponse(
+                {'detail': 'Password is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        await _load_deferred(user)
+
+        # Verify password
+        if not await user.acheck_password(password):
+            return JsonResponse(
+                {'detail': 'Password is incorrect'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        email = user.email
+        await user.adelete()
+
+        logger.info(f"Profile deleted: {email}")
+
+        return JsonResponse(
+            {'detail': 'Profile deleted successfully'},
+            status=status.HTTP_200_OK
+        )
+
+
+@query_budget(5)
+@api_view(['POST'], authenticated=True)
+async def change_password_view(request):
+    """Change password while authenticated"""
+    old_password = request.data.get('old_password')
+    new_password = request.data.get('new_password')
+
+    if not old_password or not new_password:
+        return JsonResponse(
+            {'detail': 'Old password and new password are required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        user = request.user
+        await _load_deferred(user)
+
+        # Verify old password
+        if not await user.acheck_password(old_password):
+            return JsonResponse(
+                {'detail': 'Old password is incorrect'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Validate new password strength
+        validate_password(new_password, user)
+
+        user.password = await hashing_pool.amake_password(new_password)
+        # Revoke every existing session and issue new tokens for this one
+        user.token_version = F('token_version') + 1
+        await user.asave(update_fields=['password', 'token_version'])
+        await user.arefresh_from_db(fields=['token_version', *settings.JWT_USER_CLAIMS])
+
+        # Issuing a refresh token records it with the rotation backend
+        refresh = await sync_to_async(CustomTokenObtainPairSerializer.get_token)(user)
+
+        logger.info(f"Password change successful: {user.email}")
+
+        return JsonResponse(
+            {
+                'detail': 'Password change successful',
+                'refresh': str(refresh),
+                'access': str(refresh.access_token),
+            },
+            status=status.HTTP_200_OK
+        )
+
+    except ValidationError as e:
+        return JsonResponse(
+            {'detail': e.messages},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    except HashingQueueFull:
+        raise
+    except Exception as e:
+        logger.error(f"Password change failed: {str(e)}")
+        return JsonResponse(
+            {'detail': 'Password change failed'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+
+@api_view(['POST'], authenticated=True)
+async def change_email_view(request):
+    """Request email change"""
+    new_email = request.data.get('new_email')
+    password = request.data.get('password')
+
+    if not new_email or not password:
+        return JsonResponse(
+            {'detail': 'New email and password are required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        user = request.user
+        await _load_deferred(user)
+
+        # Verify password
+        if not await user.acheck_password(password):
+            return JsonResponse(
+                {'detail': 'Password is incorrect'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Check if new email already exists
+        if await CustomUser.objects.filter(email=new_email).aexists():
+            return JsonResponse(
+                {'detail': 'Email already in use'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Check if trying to change to same email
+        if user.email == new_email:
+            return JsonResponse(
+                {'detail': 'New email is the same as current email'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if await sync_to_async(request_email_change)(user, new_email):
+            logger.info(f"Email change requested: {user.email} -> {new_email}")
+
+        return JsonResponse(
+            {'detail': 'Verification email sent to new address'},
+            status=status.HTTP_200_OK
+        )
+
+    except HashingQueueFull:
+        raise
+    except Exception as e:
+        logger.error(f"Email change request failed: {str(e)}")
+        return JsonResponse(
+            {'detail': 'Email change request failed'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+
+@query_budget(3)
+@api_view(['POST'])
+async def change_email_confirm_view(request):
+    """Confirm email change with token"""
+    token_string = request.data.get('token')
+
+    if not token_string:
+        return JsonResponse(
+            {'detail': 'Token is required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        user = await sync_to_async(confirm_email_change)(token_string)
+
+        if user is None:
+            return JsonResponse(
+                {'detail': 'Token expired or used'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        logger.info(f"Email change successful: {user.email}")
+
+        return JsonResponse(
+            {'detail': 'Email change successful'},
+            status=status.HTTP_200_OK
+        )
+
+    except Exception as e:
+        logger.error(f"Email change confirmation failed: {str(e)}")
+        return JsonResponse(
+            {'detail': 'Email change confirmation failed'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+
+@api_view(['POST'])
+async def change_email_cancel_view(request):
+    """Cancel email change request"""
+    token_string = request.data.get('token')
+
+    if not token_string:
+        return JsonResponse(
+            {'detail': 'Token is required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        user = await sync_to_async(cancel_email_change)(token_string)
+
+        logger.info(f"Email change cancelled: {user.email}")
+
+        return JsonResponse(
+            {'detail': 'Email change cancelled'},
+            status=status.HTTP_200_OK
+        )
+
+    except Exception as e:
+        logger.error(f"Email change cancellation failed: {str(e)}")
+        return JsonResponse(
+            {'detail': 'Email change cancellation failed'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+
+@api_view(['POST'], authenticated=True)
+async def logout_view(request):
+    """Logout user by blacklisting refresh token"""
+    refresh_token = request.data.get('refresh')
+
+    if not refresh_token:
+        return JsonResponse(
+            {'detail': 'Refresh token is required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        await sync_to_async(_revoke)(refresh_token)
+
+        logger.info(f"Logout successful: {request.user.email}")
+
+        return JsonResponse(
+            {'detail': 'Logout successful'},
+            status=status.HTTP_200_OK
+        )
+
+    except Exception as e:
+        logger.error(f"Logout failed: {str(e)}")
+        return JsonResponse(
+            {'detail': 'Logout failed'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+
+def _revoke(refresh_token):
+    RefreshToken(refresh_token).revoke()
+
+
+@api_view(['POST'], authenticated=True)
+async def logout_all_view(request):
+    """Logout user from every session by revoking all issued tokens"""
+    try:
+        await sync_to_async(revoke_user_tokens)(request.user)
+
+        logger.info(f"Logout from all sessions successful: {request.user.email}")
+
+        return JsonResponse(
+            {'detail': 'Logout successful'},
+            status=status.HTTP_200_OK
+        )
+
+    except Exception as e:
+        logger.error(f"Logout from all sessions failed: {str(e)}")
+        return JsonResponse(
+            {'detail': 'Logout failed'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+
+@api_view(['POST'], authenticated=True)
+async def introspect_view(request):
+    """Report validity, claims, blacklist status and expiry for a batch of access and refresh tokens"""
+    await _load_deferred(request.user)
+    if not request.user.is_staff:
+        return JsonResponse(
+            {'detail': 'You do not have permission to perform this action.'},
+            status=status.HTTP_403_FORBIDDEN
+        )
+
+    serializer = IntrospectionSerializer(data=request.data)
+
+    if not serializer.is_valid():
+        return JsonResponse(
+            {'detail': serializer.errors},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        results = await sync_to_async(introspect_tokens)(serializer.validated_data['tokens'])
+
+        return JsonResponse(
+            {'results': results},
+            status=status.HTTP_200_OK
+        )
+
+    except Exception as e:
+        logger.error(f"Token introspection failed: {str(e)}")
+        return JsonResponse(
+            {'detail': 'Token introspection failed'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
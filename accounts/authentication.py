@@ -0,0 +1,160 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, router
+from django.utils.translation import gettext_lazy as _
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication as BaseJWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+from .activity import activity_buffer
+from .cache import user_cache
+from core.db import pin_for_user
+from core.metrics import TOKEN_VALIDATION_FAILURES
+from .tokens import TOKEN_VERSION_CLAIM, get_token_version, token_error_reason
+
+
+def get_user_claims(user):
+    """Return the configured user fields to embed in issued tokens"""
+    return {field: getattr(user, field) for field in settings.JWT_USER_CLAIMS}
+
+
+class JWTAuthentication(BaseJWTAuthentication):
+    """JWT authentication that rejects access tokens revoked by a token_version bump"""
+
+    # get_user() reads the whole user row on every request
+    loads_user_row = True
+
+    def authenticate(self, request):
+        try:
+            result = super().authenticate(request)
+        except InvalidToken:
+            raise
+        except AuthenticationFailed as e:
+            # Token was valid but the user was rejected (inactive, deleted, password changed)
+            TOKEN_VALIDATION_FAILURES.labels('access', e.get_codes().get('code', 'user')).inc()
+            raise
+
+        if result is None:
+            return None
+
+        user, validated_token = result
+        if request.method not in SAFE_METHODS and settings.JWT_CHECK_TOKEN_VERSION_ON_WRITE:
+            if self.loads_user_row and user._state.db == DEFAULT_DB_ALIAS:
+                # The row was just read from the primary, so its version is current
+                self.check_token_version(validated_token, version=user.token_version)
+            else:
+                self.check_token_version(validated_token, cached=False)
+        elif settings.JWT_CHECK_TOKEN_VERSION_ON_ACCESS:
+            self.check_token_version(validated_token)
+
+        if settings.ACTIVITY_TRACK_LAST_SEEN:
+            activity_buffer.record('last_seen', user.pk)
+        return result
+
+    def check_token_version(self, validated_token, cached=True, version=None):
+        """Reject a token issued before the user's last token_version bump (password change, logout-all)"""
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            return
+
+        if version is None:
+            version = get_token_version(user_id, cached)
+        if validated_token.get(TOKEN_VERSION_CLAIM, 0) != version:
+            TOKEN_VALIDATION_FAILURES.labels('access', 'revoked').inc()
+            raise InvalidToken(_("Token has been revoked"))
+
+    def get_validated_token(self, raw_token):
+        # Same as simplejwt's, but keeps the error type so failures can be counted by reason
+        messages = []
+        reason = 'invalid'
+        for AuthToken in api_settings.AUTH_TOKEN_CLASSES:
+            try:
+                validated_token = AuthToken(raw_token)
+                break
+            except TokenError as e:
+                reason = token_error_reason(e)
+                messages.append({
+                    'token_class': AuthToken.__name__,
+                    'token_type': AuthToken.token_type,
+                    'message': e.args[0],
+                })
+        else:
+            TOKEN_VALIDATION_FAILURES.labels('access', reason).inc()
+            raise InvalidToken({
+                'detail': _("Given token not valid for any token type"),
+                'messages': messages,
+            })
+
+        # Before the user is loaded, so a user who just wrote reads it back from the primary
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is not None:
+            pin_for_user(user_id)
+
+        return validated_token
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    Authenticate from the signed token claims without querying the database.
+
+    request.user is a CustomUser whose fields outside JWT_USER_CLAIMS are
+    deferred, so the row is only loaded (in a single query) if a view
+    touches one of them.
+    """
+
+    loads_user_row = False
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        claims = {api_settings.USER_ID_FIELD: user_id}
+        for field in settings.JWT_USER_CLAIMS:
+            if field in validated_token:
+                claims[field] = validated_token[field]
+
+        field_names = []
+        values = []
+        for field in self.user_model._meta.concrete_fields:
+            if field.attname in claims:
+                field_names.append(field.attname)
+                values.append(field.to_python(claims[field.attname]))
+
+        user = self.user_model.from_db(router.db_for_read(self.user_model), field_names, values)
+
+        if 'is_active' in claims and api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        return user
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWT authentication that reads users through the per-process user cache"""
+
+    # A cached row can predate a revocation made by another worker
+    loads_user_row = False
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        user = user_cache.get_or_load(user_id, lambda: self._load_user(user_id))
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
+
+    def _load_user(self, user_id):
+        try:
+            return self.user_model.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+        except self.user_model.DoesNotExist as e:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found") from e
@@ -0,0 +1,206 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Max, Q
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings"""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = max(capacity, 1)
+        self.size = max(int(-self.capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hash_count = max(int(round(self.size / self.capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def add(self, item):
+        if item in self:
+            return
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+
+class BlacklistIndex:
+    """
+    Per-process Bloom filter of blacklisted refresh token jtis.
+
+    A miss means the token is definitely not blacklisted, so the database is
+    only consulted to confirm hits. Rows blacklisted by other processes are
+    pulled in past a high-water primary key at most every sync_interval
+    seconds, so each row is read once per process and is missed here for up
+    to that long. The filter is rebuilt periodically from unexpired rows so
+    entries age out with their tokens.
+    """
+
+    # Ids skipped by a sync that are tracked as possibly uncommitted
+    MAX_TRACKED_GAPS = 1000
+
+    def __init__(self, capacity, error_rate, sync_interval, gap_timeout, rebuild_interval):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self.gap_timeout = gap_timeout
+        self.rebuild_interval = rebuild_interval
+        self._filter = None
+        self._built_at = 0
+        self._synced_at = 0
+        self._high_water = 0
+        # Rows can commit out of id order, so ids below the high water that were missing when it
+        # moved past them are re-checked (id -> monotonic time first missed) for gap_timeout seconds
+        self._gaps = {}
+        self._lock = threading.Lock()
+        self._rebuilding = False
+
+    def warm(self):
+        """Build the filter now instead of on the first refresh"""
+        try:
+            self._rebuild()
+        except Exception as e:
+            logger.warning(f"Token blacklist index warm-up failed: {str(e)}")
+
+    def is_blacklisted(self, jti):
+        return bool(self.blacklisted([jti]))
+
+    def blacklisted(self, jtis):
+        """Return the subset of jtis that are blacklisted, confirming filter hits in one query"""
+        if not jtis:
+            return set()
+
+        if self._filter is None:
+            self._rebuild()
+        elif time.monotonic() - self._built_at > self.rebuild_interval and not self._rebuilding:
+            threading.Thread(target=self._rebuild_in_background, daemon=True).start()
+
+        if self._filter is None:
+            # Another thread is still building the first filter
+            candidates = set(jtis)
+        else:
+            if time.monotonic() - self._synced_at >= self.sync_interval \
+                    and any(jti not in self._filter for jti in jtis):
+                self._sync()
+            candidates = {jti for jti in jtis if jti in self._filter}
+
+        if not candidates:
+            return set()
+
+        return set(BlacklistedToken.objects.filter(token__jti__in=candidates).values_list('token__jti', flat=True))
+
+    def add(self, jti):
+        """Record a token this process just blacklisted"""
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(jti)
+
+    def _rebuild(self):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+
+        try:
+            started = time.monotonic()
+            max_id = BlacklistedToken.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+            # The most recent ids are read whether expired or not, so the ones missing are real gaps
+            recent_floor = max(max_id - self.MAX_TRACKED_GAPS, 0)
+            live = BlacklistedToken.objects.filter(
+                Q(token__expires_at__gt=timezone.now()) | Q(id__gt=recent_floor),
+                id__lte=max_id,
+            )
+
+            count = live.count()
+            capacity = self.capacity
+            while capacity < count * 2:
+                capacity *= 2
+
+            bloom = BloomFilter(capacity, self.error_rate)
+            recent_ids = set()
+            for row_id, jti in live.values_list('id', 'token__jti').iterator(chunk_size=10000):
+                bloom.add(jti)
+                if row_id > recent_floor:
+                    recent_ids.add(row_id)
+
+            with self._lock:
+                self._filter = bloom
+                self._built_at = self._synced_at = time.monotonic()
+                self._high_water = max_id
+                self._gaps = {row_id: started for row_id in range(recent_floor + 1, max_id + 1)
+                              if row_id not in recent_ids}
+                self.capacity = capacity
+
+            logger.info(f"Token blacklist index built: {bloom.count} tokens in {time.monotonic() - started:.2f}s")
+        finally:
+            with self._lock:
+                self._rebuilding = False
+
+        # Pick up rows blacklisted while the filter was being built
+        self._sync()
+
+    def _rebuild_in_background(self):
+        close_old_connections()
+        try:
+            self._rebuild()
+        except Exception as e:
+            logger.error(f"Token blacklist index rebuild failed: {str(e)}")
+        finally:
+            close_old_connections()
+
+    def _sync(self):
+        now = time.monotonic()
+        with self._lock:
+            self._gaps = {row_id: missed_at for row_id, missed_at in self._gaps.items()
+                          if now - missed_at <= self.gap_timeout}
+            high_water = self._high_water
+            gaps = list(self._gaps)
+
+        query = Q(id__gt=high_water)
+        if gaps:
+            query |= Q(id__in=gaps)
+        rows = list(BlacklistedToken.objects.filter(query).values_list('id', 'token__jti'))
+
+        with self._lock:
+            for row_id, jti in rows:
+                self._filter.add(jti)
+                self._gaps.pop(row_id, None)
+
+            new_ids = {row_id for row_id, _ in rows if row_id > high_water}
+            if new_ids:
+                top = max(new_ids)
+                floor = max(high_water, top - self.MAX_TRACKED_GAPS)
+                for row_id in range(floor + 1, top):
+                    if row_id not in new_ids:
+                        self._gaps.setdefault(row_id, now)
+                self._high_water = max(self._high_water, top)
+
+            self._synced_at = now
+            overfull = self._filter.count > self._filter.capacity
+
+        if overfull:
+            self._built_at = 0
+
+
+blacklist_index = BlacklistIndex(
+    capacity=settings.TOKEN_BLACKLIST_BLOOM_CAPACITY,
+    error_rate=settings.TOKEN_BLACKLIST_BLOOM_ERROR_RATE,
+    sync_interval=settings.TOKEN_BLACKLIST_SYNC_INTERVAL,
+    gap_timeout=settings.TOKEN_BLACKLIST_GAP_TIMEOUT,
+    rebuild_interval=settings.TOKEN_BLACKLIST_REBUILD_INTERVAL,
+)
@@ -0,0 +1,92 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+
+
+class UserCache:
+    """
+    Bounded per-process LRU cache of CustomUser rows with a TTL.
+
+    Each entry remembers the invalidation version stored in the shared Django
+    cache when it was filled, so invalidating a user in one worker makes every
+    other worker drop its copy on the next lookup.
+    """
+
+    def __init__(self, max_size, ttl, cache_alias='default'):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.cache_alias = cache_alias
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """Return a copy of the cached user, or None if missing or stale"""
+        key = str(user_id)
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+        if entry is None:
+            return None
+
+        user, expires_at, version = entry
+        if expires_at < time.monotonic() or version != self._shared_version(key):
+            self._discard(key)
+            return None
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+
+        # Views mutate request.user, so never hand out the cached instance itself
+        return copy.copy(user)
+
+    def get_or_load(self, user_id, loader):
+        """Return the cached user, calling loader() and caching its result on a miss"""
+        user = self.get(user_id)
+        if user is not None:
+            return user
+
+        # Read the version before loading so an invalidation that races the load wins
+        version = self._shared_version(str(user_id))
+        user = loader()
+        self._store(str(user_id), user, version)
+        return user
+
+    def invalidate(self, user_id):
+        """Drop the user locally and tell other workers to drop theirs"""
+        key = str(user_id)
+        self._discard(key)
+        caches[self.cache_alias].set(self._version_key(key), time.time_ns(), self.ttl)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _store(self, key, user, version):
+        with self._lock:
+            self._entries[key] = (copy.copy(user), time.monotonic() + self.ttl, version)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _shared_version(self, key):
+        return caches[self.cache_alias].get(self._version_key(key))
+
+    @staticmethod
+    def _version_key(key):
+        return f"user_cache:version:{key}"
+
+
+user_cache = UserCache(
+    max_size=settings.USER_CACHE_MAX_SIZE,
+    ttl=settings.USER_CACHE_TTL,
+    cache_alias=settings.USER_CACHE_ALIAS,
+)
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher, PBKDF2PasswordHasher, ScryptPasswordHasher
+
+# Cost parameters come from settings (written by `manage.py calibrate_hashers`); 0 keeps Django's default.
+# Algorithm names are unchanged, so existing hashes still verify and are rehashed on login when the cost changes.
+
+
+class CalibratedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """PBKDF2-SHA256 with a calibrated iteration count"""
+    iterations = settings.PBKDF2_ITERATIONS or PBKDF2PasswordHasher.iterations
+
+
+class CalibratedArgon2PasswordHasher(Argon2PasswordHasher):
+    """Argon2id with calibrated time cost, memory cost (KiB) and parallelism"""
+    time_cost = settings.ARGON2_TIME_COST or Argon2PasswordHasher.time_cost
+    memory_cost = settings.ARGON2_MEMORY_COST or Argon2PasswordHasher.memory_cost
+    parallelism = settings.ARGON2_PARALLELISM or Argon2PasswordHasher.parallelism
+
+
+class CalibratedScryptPasswordHasher(ScryptPasswordHasher):
+    """scrypt with a calibrated work factor (a power of 2)"""
+    work_factor = settings.SCRYPT_WORK_FACTOR or ScryptPasswordHasher.work_factor
+    # scrypt needs 128 * n * r * p bytes; OpenSSL refuses anything above 32 MiB unless told otherwise
+    maxmem = 256 * work_factor * ScryptPasswordHasher.block_size * ScryptPasswordHasher.parallelism
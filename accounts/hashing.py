@@ -0,0 +1,131 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from core.metrics import HASHING_CAPACITY, HASHING_IN_FLIGHT, HASHING_SECONDS, HASHING_TASKS
+from core.timing import timed
+
+
+class HashingQueueFull(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Server is busy, please try again shortly'
+    default_code = 'hashing_queue_full'
+    # Sent as Retry-After by DRF's exception handler
+    wait = settings.ADMISSION_CONTROL_RETRY_AFTER
+
+
+class PasswordHashingPool:
+    """
+    Runs password hashing in a pool of worker processes so PBKDF2 and friends
+    don't hold the GIL of the web worker. At most max_pending hashes may be
+    queued or running; beyond that callers get HashingQueueFull immediately
+    rather than waiting. With workers=0 hashing runs inline.
+    """
+
+    def __init__(self, workers, max_pending):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    @timed('hash')
+    def make_password(self, password):
+        if password is None or not self.workers:
+            return hashers.make_password(password)
+        return self._submit(_make_password, password).result()
+
+    @timed('hash')
+    def verify_password(self, password, encoded):
+        """Return (is_correct, must_update) like django.contrib.auth.hashers.verify_password"""
+        if not self._needs_hashing(password, encoded):
+            return hashers.verify_password(password, encoded)
+        return self._submit(_verify_password, password, encoded).result()
+
+    async def amake_password(self, password):
+        with timed('hash'):
+            if password is None or not self.workers:
+                return await sync_to_async(hashers.make_password, thread_sensitive=False)(password)
+            return await asyncio.wrap_future(self._submit(_make_password, password))
+
+    async def averify_password(self, password, encoded):
+        with timed('hash'):
+            if not self._needs_hashing(password, encoded):
+                return await sync_to_async(hashers.verify_password, thread_sensitive=False)(password, encoded)
+            return await asyncio.wrap_future(self._submit(_verify_password, password, encoded))
+
+    def _needs_hashing(self, password, encoded):
+        return (
+            self.workers
+            and password is not None
+            and encoded is not None
+            and hashers.is_password_usable(encoded)
+        )
+
+    def _submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            HASHING_TASKS.labels('rejected').inc()
+            raise HashingQueueFull()
+
+        HASHING_TASKS.labels('submitted').inc()
+        HASHING_IN_FLIGHT.inc()
+        started = time.monotonic()
+
+        def done(_):
+            self._slots.release()
+            HASHING_IN_FLIGHT.dec()
+            HASHING_TASKS.labels('completed').inc()
+            HASHING_SECONDS.observe(time.monotonic() - started)
+
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            done(None)
+            raise
+
+        future.add_done_callback(done)
+        return future
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # spawn, not fork: web workers may hold threads and database connections
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context('spawn'),
+                        initializer=init_django_process,
+                        initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', 'core.settings'),),
+                    )
+        return self._executor
+
+
+def init_django_process(settings_module):
+    """Process pool initializer: set up Django in a freshly spawned worker"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+
+    import django
+    django.setup()
+
+
+def _make_password(password):
+    return hashers.make_password(password)
+
+
+def _verify_password(password, encoded):
+    return hashers.verify_password(password, encoded)
+
+
+hashing_pool = PasswordHashingPool(
+    workers=settings.PASSWORD_HASHING_WORKERS,
+    max_pending=settings.PASSWORD_HASHING_MAX_PENDING,
+)
+HASHING_CAPACITY.labels('workers').set(hashing_pool.workers)
+HASHING_CAPACITY.labels('slots').set(hashing_pool.max_pending if hashing_pool.workers else 0)
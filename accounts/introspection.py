@@ -0,0 +1,109 @@
+"""
+Batch token introspection for API gateways.
+
+Signatures and expiry are checked in memory; blacklist status, rotation
+families and the token owners are then looked up for the whole batch at
+once, so however many tokens a request carries it costs at most four
+queries: a blacklist index sync, a confirmation of the index's hits, the
+token families and the token owners (plus a one-off index build when the
+process introspects for the first time).
+"""
+from datetime import datetime, timezone
+from rest_framework_simplejwt.exceptions import TokenBackendError, TokenBackendExpiredToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+from .blacklist import blacklist_index
+from .keys import token_backend
+from .models import CustomUser, TokenFamily
+from .rotation import FAMILY_CLAIM, GENERATION_CLAIM
+from .tokens import TOKEN_VERSION_CLAIM
+
+TOKEN_TYPES = ('access', 'refresh')
+
+
+def introspect_tokens(raw_tokens):
+    """Return one result dict per token, in the order given"""
+    results = []
+    decoded = []
+
+    for raw_token in raw_tokens:
+        result = {'active': False}
+        results.append(result)
+
+        try:
+            payload = token_backend.decode(raw_token)
+        except TokenBackendExpiredToken:
+            result['reason'] = 'expired'
+            continue
+        except TokenBackendError:
+            result['reason'] = 'invalid'
+            continue
+
+        token_type = payload.get(api_settings.TOKEN_TYPE_CLAIM)
+        if token_type not in TOKEN_TYPES or api_settings.JTI_CLAIM not in payload \
+                or api_settings.USER_ID_CLAIM not in payload:
+            result['reason'] = 'invalid'
+            continue
+
+        result.update(
+            token_type=token_type,
+            claims=payload,
+            expires_at=datetime.fromtimestamp(payload['exp'], tz=timezone.utc).isoformat() if 'exp' in payload else None,
+            blacklisted=False,
+        )
+        decoded.append((result, payload))
+
+    if not decoded:
+        return results
+
+    # Only refresh tokens are ever blacklisted; family tokens are checked against their session instead
+    refresh_payloads = [payload for _, payload in decoded if payload[api_settings.TOKEN_TYPE_CLAIM] == 'refresh']
+    blacklisted = blacklist_index.blacklisted([
+        payload[api_settings.JTI_CLAIM] for payload in refresh_payloads if FAMILY_CLAIM not in payload
+    ])
+    family_ids = {payload[FAMILY_CLAIM] for payload in refresh_payloads if FAMILY_CLAIM in payload}
+    families = {
+        family_id: (generation, revoked)
+        for family_id, generation, revoked in TokenFamily.objects.filter(pk__in=family_ids).values_list(
+            'pk', 'generation', 'revoked',
+        )
+    } if family_ids else {}
+
+    user_fields = ['pk', 'is_active', 'token_version']
+    if api_settings.CHECK_REVOKE_TOKEN:
+        user_fields.append('password')
+    user_ids = {payload[api_settings.USER_ID_CLAIM] for _, payload in decoded}
+    users = {
+        # Tokens carry the user id as a string
+        str(user_id): user
+        for user_id, user in CustomUser.objects.only(*user_fields).in_bulk(
+            user_ids, field_name=api_settings.USER_ID_FIELD,
+        ).items()
+    }
+
+    for result, payload in decoded:
+        user = users.get(str(payload[api_settings.USER_ID_CLAIM]))
+        generation, revoked = None, False
+        if result['token_type'] == 'refresh' and FAMILY_CLAIM in payload:
+            # A missing family was purged after expiring
+            generation, revoked = families.get(payload[FAMILY_CLAIM], (None, True))
+        result['blacklisted'] = payload[api_settings.JTI_CLAIM] in blacklisted or revoked
+
+        if result['blacklisted']:
+            result['reason'] = 'blacklisted'
+        elif generation is not None and generation != payload.get(GENERATION_CLAIM):
+            # Rotated already; presenting it to the refresh endpoint would revoke the session
+            result['reason'] = 'rotated'
+        elif user is None:
+            result['reason'] = 'user_not_found'
+        elif api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            result['reason'] = 'user_inactive'
+        elif payload.get(TOKEN_VERSION_CLAIM, 0) != user.token_version:
+            result['reason'] = 'revoked'
+        elif api_settings.CHECK_REVOKE_TOKEN and \
+                payload.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+            result['reason'] = 'password_changed'
+        else:
+            result['active'] = True
+
+    return results
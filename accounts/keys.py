@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+from functools import cached_property
+import jwt
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.backends import TokenBackend
+from rest_framework_simplejwt.exceptions import TokenBackendError
+from rest_framework_simplejwt.settings import api_settings
+
+
+class KeyRingTokenBackend(TokenBackend):
+    """
+    Token backend for asymmetric algorithms with key rotation.
+
+    Tokens are signed with the current private key and carry its `kid` in
+    the header; they are verified with whichever public key has that kid,
+    so tokens signed by a previous key stay valid while its public key is
+    kept. The public keys are published as a JWKS document.
+    """
+
+    def __init__(self, *args, signing_key_id='', verifying_keys=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.signing_key_id = signing_key_id
+        self.verifying_keys = verifying_keys or {}
+
+    @property
+    def is_symmetric(self):
+        return self.algorithm.startswith('HS')
+
+    @cached_property
+    def prepared_verifying_keys(self):
+        keys = {kid: self._prepare_key(key) for kid, key in self.verifying_keys.items()}
+        if self.signing_key_id and self.signing_key_id not in keys:
+            keys[self.signing_key_id] = self.prepared_signing_key.public_key()
+        return keys
+
+    def get_verifying_key(self, token):
+        if self.is_symmetric or not self.signing_key_id:
+            return super().get_verifying_key(token)
+
+        kid = jwt.get_unverified_header(token).get('kid')
+        try:
+            return self.prepared_verifying_keys[kid]
+        except KeyError:
+            raise TokenBackendError(_('Token is invalid'))
+
+    def encode(self, payload):
+        jwt_payload = payload.copy()
+        if self.audience is not None:
+            jwt_payload['aud'] = self.audience
+        if self.issuer is not None:
+            jwt_payload['iss'] = self.issuer
+
+        headers = {'kid': self.signing_key_id} if self.signing_key_id and not self.is_symmetric else None
+        return jwt.encode(
+            jwt_payload,
+            self.prepared_signing_key,
+            algorithm=self.algorithm,
+            headers=headers,
+            json_encoder=self.json_encoder,
+        )
+
+    @cached_property
+    def jwks(self):
+        """JWKS document (as bytes) with every public key tokens are verified with"""
+        keys = []
+        if not self.is_symmetric and self.signing_key_id:
+            algorithm = jwt.PyJWS().get_algorithm_by_name(self.algorithm)
+            for kid, key in sorted(self.prepared_verifying_keys.items()):
+                jwk = algorithm.to_jwk(key, as_dict=True)
+                jwk.update(kid=kid, use='sig', alg=self.algorithm)
+                keys.append(jwk)
+
+        return json.dumps({'keys': keys}, separators=(',', ':')).encode()
+
+    @cached_property
+    def jwks_etag(self):
+        return f'"{hashlib.sha256(self.jwks).hexdigest()[:32]}"'
+
+
+def load_verifying_keys(directory):
+    """Read every <kid>.pub PEM file in the directory"""
+    keys = {}
+    if directory and os.path.isdir(directory):
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.pub'):
+                with open(os.path.join(directory, name)) as f:
+                    keys[name[:-len('.pub')]] = f.read()
+    return keys
+
+
+token_backend = KeyRingTokenBackend(
+    api_settings.ALGORITHM,
+    api_settings.SIGNING_KEY,
+    api_settings.VERIFYING_KEY,
+    api_settings.AUDIENCE,
+    api_settings.ISSUER,
+    api_settings.JWK_URL,
+    api_settings.LEEWAY,
+    api_settings.JSON_ENCODER,
+    signing_key_id=settings.JWT_SIGNING_KEY_ID,
+    verifying_keys=load_verifying_keys(settings.JWT_KEYS_DIR),
+)
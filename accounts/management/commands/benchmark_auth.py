@@ -0,0 +1,240 @@
+import json
+import logging
+import os
+import platform
+import re
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import Client
+from django.test.utils import override_settings, setup_databases, teardown_databases
+from accounts.blacklist import blacklist_index
+from accounts.models import EmailOutbox
+
+ENDPOINTS = ('register', 'verify_email', 'login', 'profile', 'refresh', 'logout')
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the auth lifecycle (register, verify email, login, profile, refresh, logout) '
+        'in-process against a throwaway database and report latency percentiles and queries per request'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50, help='Number of user lifecycles to run')
+        parser.add_argument('--concurrency', type=int, default=4, help='Lifecycles run in parallel threads')
+        parser.add_argument('--profile-gets', type=int, default=10, help='Profile GETs per lifecycle')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--compare', help='Print the change against a previous JSON result')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        results = Recorder()
+
+        with tempfile.TemporaryDirectory() as tmpdir, override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+            EMAIL_OUTBOX_THREADS=0,
+            SERVER_TIMING_HEADER=True,
+            QUERY_BUDGET=0,
+            THROTTLE_RATES={},
+            ALLOWED_HOSTS=['testserver'],
+        ):
+            old_config = self.setup_databases(tmpdir)
+            # As the WSGI and ASGI entry points do, so the first refresh doesn't build it
+            blacklist_index.warm()
+            logging.disable(logging.INFO)
+            try:
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+                    futures = [
+                        executor.submit(self.run_lifecycle, i, options['profile_gets'], results)
+                        for i in range(options['users'])
+                    ]
+                    for future in futures:
+                        future.result()
+                elapsed = time.perf_counter() - started
+            finally:
+                logging.disable(logging.NOTSET)
+                teardown_databases(old_config, verbosity=0)
+
+        report = {
+            'meta': self.metadata(options),
+            'duration_seconds': round(elapsed, 3),
+            'lifecycles_per_second': round(options['users'] / elapsed, 2),
+            'endpoints': results.summary(elapsed),
+        }
+
+        self.print_report(report, baseline)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def setup_databases(self, tmpdir):
+        for alias in connections:
+            settings_dict = connections[alias].settings_dict
+            if settings_dict['ENGINE'] == 'django.db.backends.sqlite3':
+                # A file database so every thread shares it; IMMEDIATE avoids lock upgrade failures
+                settings_dict['TEST']['NAME'] = os.path.join(tmpdir, f'benchmark_{alias}.sqlite3')
+                settings_dict['OPTIONS'].update(timeout=60, transaction_mode='IMMEDIATE')
+
+        return setup_databases(verbosity=0, interactive=False)
+
+    def run_lifecycle(self, index, profile_gets, results):
+        client = Client()
+        email = f'bench{index}@example.com'
+        password = 'Bench-pass-123!'
+
+        try:
+            results.request(client, 'register', 'post', '/api/auth/register/', {
+                'email': email, 'password': password, 'first_name': 'Bench', 'last_name': str(index),
+            })
+
+            # Taken from the queued email, which carries the token in both VERIFY_TOKEN_MODEs
+            text = EmailOutbox.objects.filter(
+                to_email=email,
+                template='verify_email',
+            ).order_by('-pk').values_list('text_content', flat=True).first()
+            match = re.search(r'[?&]token=([^\s&]+)', text or '')
+            token = match.group(1) if match else None
+            results.request(client, 'verify_email', 'post', '/api/auth/verify-email/', {'token': token})
+
+            tokens = results.request(client, 'login', 'post', '/api/auth/login/', {'email': email, 'password': password})
+            if tokens is None:
+                return
+            headers = {'HTTP_AUTHORIZATION': f"Bearer {tokens['access']}"}
+
+            for _ in range(profile_gets):
+                results.request(client, 'profile', 'get', '/api/auth/profile/', None, **headers)
+
+            refreshed = results.request(client, 'refresh', 'post', '/api/auth/refresh/', {'refresh': tokens['refresh']})
+            if refreshed is None:
+                return
+            headers = {'HTTP_AUTHORIZATION': f"Bearer {refreshed['access']}"}
+
+            results.request(client, 'logout', 'post', '/api/auth/logout/',
+                            {'refresh': refreshed.get('refresh', tokens['refresh'])}, **headers)
+        finally:
+            connections.close_all()
+
+    def metadata(self, options):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                capture_output=True, text=True, cwd=settings.BASE_DIR,
+            ).stdout.strip()
+        except OSError:
+            commit = ''
+
+        return {
+            'commit': commit,
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'users': options['users'],
+            'concurrency': options['concurrency'],
+            'profile_gets': options['profile_gets'],
+            'database': connections['default'].vendor,
+            'jwt_auth_mode': settings.JWT_AUTH_MODE,
+            'password_hasher': settings.PASSWORD_HASHERS[0],
+            'python': platform.python_version(),
+            'django': django.get_version(),
+        }
+
+    def print_report(self, report, baseline):
+        self.stdout.write(
+            f"{report['lifecycles_per_second']} lifecycles/s over {report['duration_seconds']}s "
+            f"({report['meta']['users']} users, concurrency {report['meta']['concurrency']})"
+        )
+        self.stdout.write(
+            f"{'endpoint':<14}{'requests':>9}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}"
+        )
+
+        for name, stats in report['endpoints'].items():
+            line = (
+                f"{name:<14}{stats['requests']:>9}{stats['errors']:>8}{stats['throughput']:>9.1f}"
+                f"{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}{stats['queries_per_request']:>9.1f}"
+            )
+            previous = (baseline or {}).get('endpoints', {}).get(name)
+            if previous and previous['p50_ms']:
+                change = (stats['p50_ms'] - previous['p50_ms']) / previous['p50_ms'] * 100
+                line += f"  p50 {change:+.0f}%, queries {stats['queries_per_request'] - previous['queries_per_request']:+.1f}"
+            self.stdout.write(line)
+
+        errors = sum(stats['errors'] for stats in report['endpoints'].values())
+        if errors:
+            self.stderr.write(self.style.WARNING(f"{errors} requests failed"))
+
+
+class Recorder:
+    """Thread-safe collection of per-endpoint latencies, query counts and errors"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = {name: [] for name in ENDPOINTS}
+        self._queries = {name: 0 for name in ENDPOINTS}
+        self._errors = {name: 0 for name in ENDPOINTS}
+
+    def request(self, client, name, method, path, data, **extra):
+        """Issue a request and record it; returns the JSON body, or None if it failed"""
+        started = time.perf_counter()
+        if method == 'get':
+            response = client.get(path, **extra)
+        else:
+            response = client.post(path, data, content_type='application/json', **extra)
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            self._latencies[name].append(elapsed)
+            self._queries[name] += _query_count(response)
+            if response.status_code >= 400:
+                self._errors[name] += 1
+
+        if response.status_code >= 400:
+            return None
+        return response.json()
+
+    def summary(self, elapsed):
+        summary = {}
+        for name, latencies in self._latencies.items():
+            if not latencies:
+                continue
+            latencies = sorted(latencies)
+            summary[name] = {
+                'requests': len(latencies),
+                'errors': self._errors[name],
+                'throughput': round(len(latencies) / elapsed, 2),
+                'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+                'p50_ms': percentile(latencies, 50),
+                'p95_ms': percentile(latencies, 95),
+                'p99_ms': percentile(latencies, 99),
+                'queries_per_request': round(self._queries[name] / len(latencies), 2),
+            }
+        return summary
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of sorted values, in milliseconds"""
+    index = max(0, -(-len(values) * percent // 100) - 1)
+    return round(values[int(index)] * 1000, 2)
+
+
+def _query_count(response):
+    # Server-Timing carries e.g. db;dur=0.8;desc="5x" (see core.timing)
+    for metric in response.get('Server-Timing', '').split(','):
+        name, *params = metric.strip().split(';')
+        if name == 'db':
+            for param in params:
+                if param.startswith('desc='):
+                    return int(param[len('desc="'):-len('x"')])
+    return 0
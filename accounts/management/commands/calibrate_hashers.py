@@ -0,0 +1,143 @@
+import os
+import statistics
+import time
+from django.contrib.auth.hashers import Argon2PasswordHasher, PBKDF2PasswordHasher, ScryptPasswordHasher
+from django.core.management.base import BaseCommand, CommandError
+
+# Preference order when choosing PASSWORD_HASHER from the calibrated candidates
+HASHERS = ('argon2', 'scrypt', 'pbkdf2')
+
+# OWASP's minimum Argon2id memory; below this, raise time cost instead of lowering memory further
+ARGON2_MIN_MEMORY_COST = 19456
+
+
+class Command(BaseCommand):
+    help = 'Benchmark password hashers on this host and pick cost parameters that hit a latency budget'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target-ms', type=float, default=250, help='Hashing time budget per password')
+        parser.add_argument('--hashers', nargs='+', choices=HASHERS, default=list(HASHERS),
+                            help='Hashers to calibrate; the first available in preference order is selected')
+        parser.add_argument('--samples', type=int, default=5, help='Hashes timed per candidate (median is used)')
+        parser.add_argument('--argon2-memory', type=int, default=65536, help='Argon2 memory cost in KiB')
+        parser.add_argument('--argon2-parallelism', type=int, default=1, help='Argon2 lanes (threads per hash)')
+        parser.add_argument('--env-file', help='Write the selected settings to this env file (e.g. .env)')
+
+    def handle(self, *args, **options):
+        self.samples = options['samples']
+        target = options['target_ms'] / 1000
+        results = {}
+
+        for name in HASHERS:
+            if name not in options['hashers']:
+                continue
+            try:
+                values, seconds = getattr(self, f'calibrate_{name}')(target, options)
+            except ImportError as e:
+                self.stderr.write(f"{name}: skipped ({str(e)})")
+                continue
+
+            results[name] = values
+            if seconds > target:
+                self.stderr.write(self.style.WARNING(f"{name}: over the {options['target_ms']:.0f} ms budget"))
+            params = ', '.join(f"{key}={value}" for key, value in values.items())
+            self.stdout.write(f"{name}: {params} -> {seconds * 1000:.0f} ms ({1 / seconds:.1f} hashes/s per core)")
+
+        if not results:
+            raise CommandError('No hasher could be calibrated')
+
+        settings = {'PASSWORD_HASHER': next(iter(results))}
+        for values in results.values():
+            settings.update(values)
+
+        self.stdout.write('')
+        for key, value in settings.items():
+            self.stdout.write(f"{key}={value}")
+
+        if options['env_file']:
+            write_env_file(options['env_file'], settings)
+            self.stdout.write(self.style.SUCCESS(f"Settings written to {options['env_file']}"))
+
+    def calibrate_pbkdf2(self, target, options):
+        # Cost is linear in the iteration count, so scale from one measurement and check it
+        hasher = PBKDF2PasswordHasher()
+        hasher.iterations = 100000
+        hasher.iterations = _round(hasher.iterations * target / self.measure(hasher), 10000)
+        return {'PBKDF2_ITERATIONS': hasher.iterations}, self.measure(hasher)
+
+    def calibrate_argon2(self, target, options):
+        hasher = Argon2PasswordHasher()
+        hasher._load_library()
+        hasher.parallelism = options['argon2_parallelism']
+        hasher.memory_cost = options['argon2_memory']
+        hasher.time_cost = 1
+
+        # Keep memory as high as the budget allows, then spend the rest on passes
+        seconds = self.measure(hasher)
+        while seconds > target and hasher.memory_cost // 2 >= ARGON2_MIN_MEMORY_COST:
+            hasher.memory_cost //= 2
+            seconds = self.measure(hasher)
+
+        hasher.time_cost = max(1, int(target / seconds))
+        if hasher.time_cost > 1:
+            seconds = self.measure(hasher)
+
+        return {
+            'ARGON2_TIME_COST': hasher.time_cost,
+            'ARGON2_MEMORY_COST': hasher.memory_cost,
+            'ARGON2_PARALLELISM': hasher.parallelism,
+        }, seconds
+
+    def calibrate_scrypt(self, target, options):
+        # The work factor must be a power of 2: take the largest one within budget
+        hasher = ScryptPasswordHasher()
+        hasher.work_factor = 2 ** 14
+        seconds = self.measure(hasher)
+
+        while True:
+            candidate = ScryptPasswordHasher()
+            candidate.work_factor = hasher.work_factor * 2
+            if candidate.work_factor > 2 ** 20:
+                break
+            candidate_seconds = self.measure(candidate)
+            if candidate_seconds > target:
+                break
+            hasher, seconds = candidate, candidate_seconds
+
+        return {'SCRYPT_WORK_FACTOR': hasher.work_factor}, seconds
+
+    def measure(self, hasher):
+        """Median seconds to hash one password with the hasher's current parameters"""
+        if isinstance(hasher, ScryptPasswordHasher):
+            hasher.maxmem = 256 * hasher.work_factor * hasher.block_size * hasher.parallelism
+
+        timings = []
+        for _ in range(self.samples):
+            started = time.perf_counter()
+            hasher.encode('calibration-password', hasher.salt())
+            timings.append(time.perf_counter() - started)
+        return statistics.median(timings)
+
+
+def _round(value, step):
+    return max(step, int(round(value / step)) * step)
+
+
+def write_env_file(path, values):
+    """Replace the given keys in an env file, appending the ones it doesn't have yet"""
+    lines = []
+    if os.path.exists(path):
+        with open(path) as f:
+            lines = f.read().splitlines()
+
+    remaining = dict(values)
+    for i, line in enumerate(lines):
+        key = line.split('=', 1)[0].strip()
+        if key in remaining:
+            lines[i] = f"{key}={remaining.pop(key)}"
+
+    if remaining:
+        lines += ['', '# Password hashers (calibrate_hashers)'] + [f"{key}={value}" for key, value in remaining.items()]
+
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
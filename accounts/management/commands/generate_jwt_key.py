@@ -0,0 +1,59 @@
+import os
+import secrets
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+ALGORITHMS = ('RS256', 'ES256', 'EdDSA')
+
+
+class Command(BaseCommand):
+    help = 'Generate a JWT signing key pair as <kid>.key / <kid>.pub in JWT_KEYS_DIR'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--algorithm', choices=ALGORITHMS, default=settings.JWT_ALGORITHM
+                            if settings.JWT_ALGORITHM in ALGORITHMS else 'RS256')
+        parser.add_argument('--kid', help='Key id (default: date plus random suffix)')
+        parser.add_argument('--keys-dir', default=settings.JWT_KEYS_DIR)
+        parser.add_argument('--rsa-bits', type=int, default=2048)
+
+    def handle(self, *args, **options):
+        try:
+            from cryptography.hazmat.primitives import serialization
+            from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+        except ImportError:
+            raise CommandError('Asymmetric JWT signing requires the cryptography package')
+
+        if options['algorithm'] == 'RS256':
+            private_key = rsa.generate_private_key(public_exponent=65537, key_size=options['rsa_bits'])
+        elif options['algorithm'] == 'ES256':
+            private_key = ec.generate_private_key(ec.SECP256R1())
+        else:
+            private_key = ed25519.Ed25519PrivateKey.generate()
+
+        kid = options['kid'] or f"{timezone.now():%Y%m%d}-{secrets.token_hex(4)}"
+        os.makedirs(options['keys_dir'], exist_ok=True)
+        private_path = os.path.join(options['keys_dir'], f'{kid}.key')
+        public_path = os.path.join(options['keys_dir'], f'{kid}.pub')
+
+        if os.path.exists(private_path) or os.path.exists(public_path):
+            raise CommandError(f"Key {kid} already exists in {options['keys_dir']}")
+
+        private_pem = private_key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+        public_pem = private_key.public_key().public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo,
+        )
+
+        # Private key readable by the owner only
+        with os.fdopen(os.open(private_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'wb') as f:
+            f.write(private_pem)
+        with open(public_path, 'wb') as f:
+            f.write(public_pem)
+
+        self.stdout.write(f"Wrote {private_path} and {public_path}")
+        self.stdout.write(self.style.SUCCESS(f"JWT_ALGORITHM={options['algorithm']}\nJWT_SIGNING_KEY_ID={kid}"))
@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand
+from accounts.outbox import process_outbox
+
+
+class Command(BaseCommand):
+    help = 'Send queued emails from the outbox, retrying failures with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the outbox once and exit')
+        parser.add_argument('--batch-size', type=int, default=100, help='Messages claimed per pass')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds to sleep when the outbox is empty')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = process_outbox(batch_size=options['batch_size'])
+
+            if sent or failed:
+                self.stdout.write(f"Sent {sent}, failed {failed}")
+
+            # A full batch means more may be waiting, so go again without sleeping
+            if sent + failed < options['batch_size']:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
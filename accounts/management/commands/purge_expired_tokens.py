@@ -0,0 +1,32 @@
+import time
+from django.core.management.base import BaseCommand
+from accounts.purge import purge_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete expired or used verification tokens, expired JWTs and old sent emails in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows deleted per transaction')
+        parser.add_argument('--pause', type=float, default=0, help='Seconds to sleep between batches')
+        parser.add_argument('--interval', type=float, default=0, help='Run again every this many seconds (0 = once)')
+
+    def handle(self, *args, **options):
+        while True:
+            self.purge(options)
+
+            if options['interval'] <= 0:
+                break
+            time.sleep(options['interval'])
+
+    def purge(self, options):
+        started = time.monotonic()
+        removed = purge_expired(batch_size=options['batch_size'], pause=options['pause'])
+        elapsed = time.monotonic() - started
+
+        for label, count in sorted(removed.items()):
+            self.stdout.write(f"{label}: {count} rows removed")
+
+        total = sum(removed.values())
+        rate = total / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(f"Removed {total} rows in {elapsed:.2f}s ({rate:.0f} rows/s)"))
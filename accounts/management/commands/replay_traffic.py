@@ -0,0 +1,156 @@
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from core.traffic import REDACTED
+from .benchmark_auth import percentile
+
+
+class Command(BaseCommand):
+    help = 'Replay captured traffic (TRAFFIC_CAPTURE_FILE) against a running server and report latency per endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='JSON lines written by TrafficCaptureMiddleware')
+        parser.add_argument('--base-url', default='http://localhost:8000', help='Server to replay against')
+        parser.add_argument('--speed', type=float, default=1.0,
+                            help='Replay speed relative to the capture (2 = twice as fast, 0 = no pauses)')
+        parser.add_argument('--concurrency', type=int, default=32, help='Maximum requests in flight')
+        parser.add_argument('--email', help='Local account used for requests that were authenticated')
+        parser.add_argument('--password', help="Password of --email, also sent in place of redacted passwords")
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--compare', help='Print latency changes against a previous --output file')
+
+    def handle(self, *args, **options):
+        records = self.load(options['file'])
+        if not records:
+            raise CommandError(f"No requests in {options['file']}")
+
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        self.base_url = options['base_url'].rstrip('/')
+        self.password = options['password']
+        self.access_token = None
+        if options['email']:
+            self.access_token = self.login(options['email'], options['password'])
+
+        results = defaultdict(list)
+        lock = threading.Lock()
+
+        def replay(record):
+            status, seconds = self.send(record)
+            with lock:
+                results[f"{record['method']} {record['path']}"].append((status, seconds, record['duration_ms']))
+
+        self.stdout.write(f"Replaying {len(records)} requests against {self.base_url}")
+        first_ts = records[0]['ts']
+        started = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            for record in records:
+                # Keep the captured inter-arrival times, scaled by --speed
+                if options['speed'] > 0:
+                    delay = (record['ts'] - first_ts) / options['speed'] - (time.monotonic() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+                executor.submit(replay, record)
+
+        elapsed = time.monotonic() - started
+        report = {
+            'base_url': self.base_url,
+            'requests': len(records),
+            'duration_seconds': round(elapsed, 3),
+            'endpoints': self.summarize(results),
+        }
+        self.print_report(report, baseline)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def load(self, path):
+        with open(path) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        return sorted(records, key=lambda record: record['ts'])
+
+    def login(self, email, password):
+        status, body = self.request('POST', '/api/auth/login/', {'email': email, 'password': password})
+        if status != 200:
+            raise CommandError(f"Login as {email} failed with status {status}")
+        return body['access']
+
+    def send(self, record):
+        body = record.get('body')
+        if isinstance(body, dict) and self.password:
+            body = {
+                field: self.password if value == REDACTED and 'password' in field else value
+                for field, value in body.items()
+            }
+
+        path = record['path'] + (f"?{record['query']}" if record.get('query') else '')
+        authorization = self.access_token if record.get('authenticated') else None
+
+        started = time.perf_counter()
+        status, _ = self.request(record['method'], path, body, authorization)
+        return status, time.perf_counter() - started
+
+    def request(self, method, path, body=None, access_token=None):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, method=method)
+        if data is not None:
+            request.add_header('Content-Type', 'application/json')
+        if access_token:
+            request.add_header('Authorization', f'Bearer {access_token}')
+
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                return response.status, json.loads(response.read() or b'null')
+        except urllib.error.HTTPError as e:
+            return e.code, None
+        except (urllib.error.URLError, TimeoutError, ValueError):
+            return 0, None
+
+    def summarize(self, results):
+        summary = {}
+        for endpoint, samples in sorted(results.items()):
+            latencies = sorted(seconds for _, seconds, _ in samples)
+            captured = sorted(duration / 1000 for _, _, duration in samples)
+            statuses = defaultdict(int)
+            for status, _, _ in samples:
+                statuses[str(status)] += 1
+
+            summary[endpoint] = {
+                'requests': len(samples),
+                'statuses': dict(statuses),
+                'p50_ms': percentile(latencies, 50),
+                'p95_ms': percentile(latencies, 95),
+                'p99_ms': percentile(latencies, 99),
+                'captured_p50_ms': percentile(captured, 50),
+                'captured_p99_ms': percentile(captured, 99),
+            }
+        return summary
+
+    def print_report(self, report, baseline):
+        self.stdout.write(f"{report['requests']} requests in {report['duration_seconds']}s")
+        self.stdout.write(f"{'endpoint':<42}{'requests':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}  vs")
+
+        for endpoint, stats in report['endpoints'].items():
+            # Compare with the other build when given, otherwise with the latency seen at capture time
+            previous = (baseline or {}).get('endpoints', {}).get(endpoint)
+            reference = previous['p50_ms'] if previous else stats['captured_p50_ms']
+            change = f"{(stats['p50_ms'] - reference) / reference * 100:+.0f}%" if reference else '-'
+
+            self.stdout.write(
+                f"{endpoint:<42}{stats['requests']:>9}{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}"
+                f"{stats['p99_ms']:>9.1f}  {change} {'baseline' if previous else 'capture'}"
+            )
+            errors = {status: count for status, count in stats['statuses'].items() if not status.startswith('2')}
+            if errors:
+                self.stdout.write(f"{'':<42}statuses: {errors}")
@@ -0,0 +1,164 @@
+import multiprocessing
+import os
+import random
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from accounts.hashing import init_django_process
+from accounts.models import CustomUser, VerifyEmailToken
+from accounts.purge import purge_queryset
+
+# Seeded rows are recognisable by these prefixes so --flush only removes them
+EMAIL_PREFIX = 'seed-'
+JTI_PREFIX = 'seed-'
+
+TOKEN_TYPES = ('verify_email', 'reset_password', 'change_email')
+
+
+class Command(BaseCommand):
+    help = 'Bulk-create synthetic users, verification tokens and JWT blacklist rows for scale testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000, help='Number of users to create')
+        parser.add_argument('--tokens-per-user', type=int, default=2, help='VerifyEmailToken rows per user')
+        parser.add_argument('--sessions-per-user', type=int, default=3, help='OutstandingToken rows per user')
+        parser.add_argument('--blacklisted', type=float, default=0.3, help='Fraction of sessions blacklisted')
+        parser.add_argument('--verified', type=float, default=0.8, help='Fraction of users with a verified email')
+        parser.add_argument('--password', default='Seed-pass-123!', help='Password shared by every seeded user')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed; the same seed and batch size create the same rows')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Users per bulk_create chunk')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Parallel processes (keep 1 on SQLite, which allows a single writer)')
+        parser.add_argument('--flush', action='store_true', help='Delete previously seeded rows first')
+
+    def handle(self, *args, **options):
+        if options['flush']:
+            removed = flush_seeded_rows()
+            self.stdout.write(f"Removed {sum(removed.values())} previously seeded rows")
+
+        params = {
+            key: options[key]
+            for key in ('tokens_per_user', 'sessions_per_user', 'blacklisted', 'verified', 'seed')
+        }
+        # Hash once; running set_password per row would take longer than everything else combined
+        params['password_hash'] = make_password(options['password'])
+        params['now'] = timezone.now()
+
+        chunks = [
+            (start, min(options['batch_size'], options['users'] - start))
+            for start in range(0, options['users'], options['batch_size'])
+        ]
+
+        started = time.monotonic()
+        created = Counter()
+
+        if options['workers'] > 1:
+            # Close inherited connections; each worker opens its own
+            connections.close_all()
+            with ProcessPoolExecutor(
+                max_workers=options['workers'],
+                mp_context=multiprocessing.get_context('spawn'),
+                # Initializer lives outside this module, which can't be imported before django.setup()
+                initializer=init_django_process,
+                initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', 'core.settings'),),
+            ) as executor:
+                results = executor.map(seed_chunk, *zip(*chunks), [params] * len(chunks))
+                for result in results:
+                    created.update(result)
+                    self.report_progress(created, options['users'], started)
+        else:
+            for start, count in chunks:
+                created.update(seed_chunk(start, count, params))
+                self.report_progress(created, options['users'], started)
+
+        elapsed = time.monotonic() - started
+        for label, count in sorted(created.items()):
+            self.stdout.write(f"{label}: {count} rows")
+
+        total = sum(created.values())
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {total} rows in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.0f} rows/s)"
+        ))
+
+    def report_progress(self, created, users, started):
+        done = created['accounts.CustomUser']
+        self.stdout.write(f"{done}/{users} users ({time.monotonic() - started:.1f}s)")
+
+
+def seed_chunk(start, count, params):
+    """Create users start..start+count with their tokens; the rows depend only on the seed and start"""
+    rng = random.Random(f"{params['seed']}:{start}")
+    now = params['now']
+
+    users = [
+        CustomUser(
+            email=f'{EMAIL_PREFIX}{i}@example.com',
+            password=params['password_hash'],
+            first_name='Seed',
+            last_name=str(i),
+            is_email_verified=rng.random() < params['verified'],
+            date_joined=now - timedelta(days=rng.randint(0, 730)),
+        )
+        for i in range(start, start + count)
+    ]
+
+    with transaction.atomic():
+        users = CustomUser.objects.bulk_create(users)
+
+        verify_tokens = []
+        outstanding_tokens = []
+        for user in users:
+            for _ in range(params['tokens_per_user']):
+                token_type = rng.choice(TOKEN_TYPES)
+                verify_tokens.append(VerifyEmailToken(
+                    user=user,
+                    token=f'{rng.getrandbits(256):064x}',
+                    token_type=token_type,
+                    new_email=f'new-{user.email}' if token_type == 'change_email' else None,
+                    # About half are already expired, as in a table that is purged daily
+                    expires_at=now + timedelta(hours=rng.uniform(-24, 24)),
+                    is_used=rng.random() < 0.2,
+                ))
+
+            for _ in range(params['sessions_per_user']):
+                # Spread over two token lifetimes so about half have expired
+                created_at = now - rng.uniform(0, 2) * api_settings.REFRESH_TOKEN_LIFETIME
+                jti = f'{JTI_PREFIX}{rng.getrandbits(128):032x}'
+                outstanding_tokens.append(OutstandingToken(
+                    user=user,
+                    jti=jti,
+                    # Placeholder rather than a signed JWT; nothing reads it back
+                    token=f'seed.{jti}',
+                    created_at=created_at,
+                    expires_at=created_at + api_settings.REFRESH_TOKEN_LIFETIME,
+                ))
+
+        VerifyEmailToken.objects.bulk_create(verify_tokens)
+        outstanding_tokens = OutstandingToken.objects.bulk_create(outstanding_tokens)
+        blacklisted_tokens = BlacklistedToken.objects.bulk_create([
+            BlacklistedToken(token=token)
+            for token in outstanding_tokens
+            if rng.random() < params['blacklisted']
+        ])
+
+    return Counter({
+        'accounts.CustomUser': len(users),
+        'accounts.VerifyEmailToken': len(verify_tokens),
+        'token_blacklist.OutstandingToken': len(outstanding_tokens),
+        'token_blacklist.BlacklistedToken': len(blacklisted_tokens),
+    })
+
+
+def flush_seeded_rows():
+    # Outstanding tokens are only detached (SET_NULL) when their user goes, so remove them first
+    removed = purge_queryset(OutstandingToken.objects.filter(jti__startswith=JTI_PREFIX))
+    removed.update(purge_queryset(CustomUser.objects.filter(email__startswith=EMAIL_PREFIX)))
+    return removed
+
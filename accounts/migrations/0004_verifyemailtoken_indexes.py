@@ -0,0 +1,47 @@
+# Generated by Django 5.2.7 on 2026-10-18 08:43
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_customuser_token_version'),
+        ('token_blacklist', '0013_alter_blacklistedtoken_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='verifyemailtoken',
+            options={'verbose_name': 'Verify Email Token', 'verbose_name_plural': 'Verify Email Tokens'},
+        ),
+        migrations.AlterField(
+            model_name='verifyemailtoken',
+            name='token',
+            field=models.CharField(max_length=64, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='verifyemailtoken',
+            index=models.Index(fields=['user', 'token_type'], name='verify_token_user_type_idx'),
+        ),
+        migrations.AlterField(
+            model_name='verifyemailtoken',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='verify_email_tokens', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='verifyemailtoken',
+            index=models.Index(fields=['expires_at'], name='verify_token_expires_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='verifyemailtoken',
+            index=models.Index(condition=models.Q(('is_used', True)), fields=['id'], name='verify_token_used_idx'),
+        ),
+        # simplejwt does not index expires_at, which the purge of expired tokens filters on
+        migrations.RunSQL(
+            sql='CREATE INDEX IF NOT EXISTS outstanding_token_expires_idx ON token_blacklist_outstandingtoken (expires_at)',
+            reverse_sql='DROP INDEX IF EXISTS outstanding_token_expires_idx',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_customuser_last_seen'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tokenfamily',
+            name='rotated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,8 +1,13 @@
+from django.conf import settings
+from django.core.cache import cache
 from django.db import models
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.utils import timezone
 from datetime import timedelta
+import hashlib
 import secrets
+from .hashing import hashing_pool
+from . import signed_tokens
 
 
 class CustomUserManager(BaseUserManager):
@@ -39,6 +44,9 @@ class CustomUser(AbstractUser):
     phone = models.CharField(max_length=20, blank=True, null=True)
     is_email_verified = models.BooleanField(default=False)
     pending_email = models.EmailField(blank=True, null=True)
+    token_version = models.PositiveIntegerField(default=0)
+    # Last authenticated request, written through accounts.activity when ACTIVITY_TRACK_LAST_SEEN is on
+    last_seen = models.DateTimeField(blank=True, null=True)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
@@ -48,10 +56,39 @@ class CustomUser(AbstractUser):
     def __str__(self):
         return self.email
 
+    def set_password(self, raw_password):
+        self.password = hashing_pool.make_password(raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        """Check the password in the hashing pool, upgrading the stored hash if needed"""
+        is_correct, must_update = hashing_pool.verify_password(raw_password, self.password)
+        if is_correct and must_update:
+            self.set_password(raw_password)
+            # Password hash upgrades shouldn't be considered password changes
+            self._password = None
+            self.save(update_fields=['password'])
+        return is_correct
+
+    async def acheck_password(self, raw_password):
+        is_correct, must_update = await hashing_pool.averify_password(raw_password, self.password)
+        if is_correct and must_update:
+            self.password = await hashing_pool.amake_password(raw_password)
+            await self.asave(update_fields=['password'])
+        return is_correct
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        """Load every deferred field in one query when any of them is first accessed"""
+        deferred_fields = self.get_deferred_fields()
+        if fields is not None and deferred_fields and set(fields) <= deferred_fields:
+            fields = deferred_fields
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+
 
 class VerifyEmailToken(models.Model):
-    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='verify_email_tokens')
-    token = models.CharField(max_length=64, unique=True, db_index=True)
+    # Indexed by the (user, token_type) composite index below
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='verify_email_tokens', db_index=False)
+    token = models.CharField(max_length=64, unique=True)
     token_type = models.CharField(max_length=20, choices=[
         ('verify_email', 'Verify Email'),
         ('change_email', 'Change Email'),
@@ -65,7 +102,14 @@ class VerifyEmailToken(models.Model):
     class Meta:
         verbose_name = 'Verify Email Token'
         verbose_name_plural = 'Verify Email Tokens'
-        ordering = ['-created_at']
+        indexes = [
+            # Per-user lookups, e.g. invalidating a user's change_email tokens
+            models.Index(fields=['user', 'token_type'], name='verify_token_user_type_idx'),
+            # Purge of expired tokens
+            models.Index(fields=['expires_at'], name='verify_token_expires_idx'),
+            # Purge of used tokens, walked in primary key order
+            models.Index(fields=['id'], condition=models.Q(is_used=True), name='verify_token_used_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.email} - {self.get_token_type_display()}"
@@ -74,10 +118,109 @@ class VerifyEmailToken(models.Model):
         return not self.is_used and timezone.now() < self.expires_at
 
     @staticmethod
-    def generate_token(user, token_type, new_email=None, expiry_hours=24):
-        """Generate a new verification token"""
+    def consume_token(token_string, token_type):
+        """
+        Mark a token as used and return it with its user loaded.
+
+        The token is claimed with a conditional UPDATE, so when two requests
+        race for the same token only one gets it back. Returns None if the
+        token is expired or already used, and raises DoesNotExist if there is
+        no such token. Call inside transaction.atomic() together with the
+        user update, and call release_token() if that rolls back.
+
+        With VERIFY_TOKEN_MODE=signed the token is a signed link checked
+        without reading this table (see accounts.signed_tokens).
+        """
+        if settings.VERIFY_TOKEN_MODE == 'signed':
+            try:
+                return signed_tokens.consume(token_string, token_type)
+            except signed_tokens.InvalidToken:
+                raise VerifyEmailToken.DoesNotExist('Invalid signed token')
+
+        tokens = VerifyEmailToken.objects.filter(token=token_string, token_type=token_type)
+
+        if not tokens.filter(is_used=False, expires_at__gt=timezone.now()).update(is_used=True):
+            if not tokens.exists():
+                raise VerifyEmailToken.DoesNotExist
+            return None
+
+        return tokens.select_related('user').get()
+
+    @staticmethod
+    def release_token(token):
+        """
+        Undo consume_token() after its transaction rolled back. A token row
+        needs nothing, its UPDATE rolled back too; a signed token's claim
+        lives in the cache and has to be dropped.
+        """
+        if isinstance(token, signed_tokens.SignedToken):
+            signed_tokens.release(token)
+
+    @staticmethod
+    def get_token(token_string, token_type):
+        """Return a token with its user loaded, used or not; raises DoesNotExist if there is none"""
+        if settings.VERIFY_TOKEN_MODE == 'signed':
+            try:
+                return signed_tokens.load(token_string, token_type)
+            except signed_tokens.InvalidToken:
+                raise VerifyEmailToken.DoesNotExist('Invalid signed token')
+
+        return VerifyEmailToken.objects.select_related('user').get(token=token_string, token_type=token_type)
+
+    @staticmethod
+    def claim_send(user, token_type, new_email=None):
+        """
+        Return True if a token email should be sent now, False if one for the
+        same user, type and address was sent (or is being sent) within the
+        last VERIFY_EMAIL_RESEND_INTERVAL seconds. The claim is an atomic
+        cache.add(), so concurrent duplicate requests collapse into one send.
+        """
+        if settings.VERIFY_EMAIL_RESEND_INTERVAL <= 0:
+            return True
+
+        return cache.add(VerifyEmailToken._send_key(user, token_type, new_email), 1, settings.VERIFY_EMAIL_RESEND_INTERVAL)
+
+    @staticmethod
+    def release_send(user, token_type, new_email=None):
+        """Drop a claim_send() claim whose email was rolled back, so a retry can send at once"""
+        cache.delete(VerifyEmailToken._send_key(user, token_type, new_email))
+
+    @staticmethod
+    def _send_key(user, token_type, new_email=None):
+        key = f"verify_email_send:{token_type}:{user.pk}"
+        if new_email:
+            key += f":{hashlib.sha256(new_email.lower().encode()).hexdigest()[:16]}"
+        return key
+
+    @staticmethod
+    def generate_token(user, token_type, new_email=None, expiry_hours=24, reuse=True):
+        """
+        Return the user's unused token of this type (and new_email) if it is
+        valid for at least VERIFY_TOKEN_REUSE_MIN_REMAINING seconds more,
+        otherwise create a new one. Resent links therefore repeat the earlier
+        link instead of adding a row per request. Pass reuse=False for a
+        user that cannot have tokens yet.
+
+        With VERIFY_TOKEN_MODE=signed nothing is stored: a new signed token
+        is returned each time.
+        """
+        if settings.VERIFY_TOKEN_MODE == 'signed':
+            return signed_tokens.generate(user, token_type, new_email=new_email, expiry_hours=expiry_hours)
+
+        now = timezone.now()
+        if reuse:
+            existing = VerifyEmailToken.objects.filter(
+                user=user,
+                token_type=token_type,
+                new_email=new_email,
+                is_used=False,
+                expires_at__gt=now + timedelta(seconds=settings.VERIFY_TOKEN_REUSE_MIN_REMAINING),
+            ).order_by('-expires_at').first()
+            if existing is not None:
+                return existing
+
         token = secrets.token_urlsafe(32)
-        expires_at = timezone.now() + timedelta(hours=expiry_hours)
+        expires_at = now + timedelta(hours=expiry_hours)
 
         return VerifyEmailToken.objects.create(
             user=user,
@@ -85,4 +228,97 @@ class VerifyEmailToken(models.Model):
             token_type=token_type,
             new_email=new_email,
             expires_at=expires_at
-        )
\ No newline at end of file
+        )
+
+
+class EmailOutbox(models.Model):
+    """Transactional email queued for background delivery"""
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+
+    template = models.CharField(max_length=50)
+    to_email = models.EmailField()
+    subject = models.CharField(max_length=255)
+    text_content = models.TextField()
+    html_content = models.TextField(blank=True)
+    status = models.CharField(max_length=20, default=STATUS_PENDING, choices=[
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENDING, 'Sending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ])
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'Email Outbox'
+        verbose_name_plural = 'Email Outbox'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_status_next_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.to_email} - {self.template} ({self.status})"
+
+
+class TokenFamily(models.Model):
+    """
+    One login session under TOKEN_ROTATION=family.
+
+    Every refresh token issued for the session carries the family id and a
+    generation number; only the token of the current generation can be
+    rotated, so presenting an older one reveals that it was copied.
+    """
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='token_families')
+    generation = models.PositiveIntegerField(default=0)
+    revoked = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    rotated_at = models.DateTimeField(blank=True, null=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Token Family'
+        verbose_name_plural = 'Token Families'
+        indexes = [
+            # Purge of expired sessions
+            models.Index(fields=['expires_at'], name='token_family_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - generation {self.generation}"
+
+    @staticmethod
+    def advance(family_id, generation, expires_at):
+        """
+        Move a live family from `generation` to the next one with a single
+        conditional UPDATE. Returns False if the family is revoked, expired or
+        already past that generation.
+        """
+        now = timezone.now()
+        return bool(TokenFamily.objects.filter(
+            pk=family_id,
+            generation=generation,
+            revoked=False,
+            expires_at__gt=now,
+        ).update(generation=models.F('generation') + 1, rotated_at=now, expires_at=expires_at))
+
+    @staticmethod
+    def advanced_since(family_id, generation, since):
+        """True if the live family moved from `generation` to the next one, and no further, at or after `since`"""
+        return TokenFamily.objects.filter(
+            pk=family_id,
+            generation=generation + 1,
+            revoked=False,
+            rotated_at__gte=since,
+            expires_at__gt=timezone.now(),
+        ).exists()
+
+    @staticmethod
+    def revoke(family_id):
+        """Revoke the family; returns False if it was already revoked or does not exist"""
+        return bool(TokenFamily.objects.filter(pk=family_id, revoked=False).update(revoked=True))
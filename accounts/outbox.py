@@ -0,0 +1,163 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from core.metrics import EMAILS
+from .models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def enqueue_email(template, to_email, subject, text_content, html_content=''):
+    """Write an email to the outbox and dispatch it once the transaction commits"""
+    message = EmailOutbox.objects.create(
+        template=template,
+        to_email=to_email,
+        subject=subject,
+        text_content=text_content,
+        html_content=html_content,
+    )
+
+    if settings.EMAIL_OUTBOX_THREADS > 0:
+        transaction.on_commit(lambda: _get_executor().submit(_deliver_in_thread, message.pk))
+
+    return message
+
+
+def deliver(message_id):
+    """Claim and send a single outbox message, scheduling a retry on failure"""
+    now = timezone.now()
+
+    # Claim the message with a conditional UPDATE so only one dispatcher sends it.
+    # The lease on next_attempt_at lets a worker recover messages from a crashed sender.
+    claimed = EmailOutbox.objects.filter(_claimable(now), pk=message_id).update(
+        status=EmailOutbox.STATUS_SENDING,
+        attempts=F('attempts') + 1,
+        next_attempt_at=now + timedelta(seconds=settings.EMAIL_OUTBOX_LEASE_SECONDS),
+    )
+    if not claimed:
+        return None
+
+    message = EmailOutbox.objects.get(pk=message_id)
+
+    try:
+        send_mail(
+            message.subject,
+            message.text_content,
+            settings.DEFAULT_FROM_EMAIL,
+            [message.to_email],
+            html_message=message.html_content or None,
+        )
+    except Exception as e:
+        if message.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+            message.status = EmailOutbox.STATUS_FAILED
+            EMAILS.labels(message.template, 'failed').inc()
+            logger.error(f"Email delivery failed permanently: {message.to_email} ({message.template}): {str(e)}")
+        else:
+            backoff = settings.EMAIL_OUTBOX_RETRY_BACKOFF * 2 ** (message.attempts - 1)
+            message.status = EmailOutbox.STATUS_PENDING
+            EMAILS.labels(message.template, 'retry').inc()
+            message.next_attempt_at = timezone.now() + timedelta(
+                seconds=min(backoff, settings.EMAIL_OUTBOX_MAX_BACKOFF)
+            )
+            logger.warning(f"Email delivery failed, retrying: {message.to_email} ({message.template}): {str(e)}")
+
+        message.last_error = str(e)
+        message.save(update_fields=['status', 'next_attempt_at', 'last_error'])
+        return False
+
+    message.status = EmailOutbox.STATUS_SENT
+    message.sent_at = timezone.now()
+    message.last_error = ''
+    message.save(update_fields=['status', 'sent_at', 'last_error'])
+    EMAILS.labels(message.template, 'sent').inc()
+
+    logger.info(f"Email sent: {message.to_email} ({message.template})")
+    return True
+
+
+def process_outbox(batch_size=100):
+    """Send every due outbox message, returning (sent, failed) counts"""
+    now = timezone.now()
+    expire_exhausted(now)
+
+    message_ids = list(
+        EmailOutbox.objects
+        .filter(_claimable(now))
+        .order_by('next_attempt_at')
+        .values_list('pk', flat=True)[:batch_size]
+    )
+
+    sent = failed = 0
+    for message_id in message_ids:
+        result = deliver(message_id)
+        if result is True:
+            sent += 1
+        elif result is False:
+            failed += 1
+
+    return sent, failed
+
+
+def expire_exhausted(now=None):
+    """
+    Mark messages whose lease expired on their last allowed attempt as failed.
+
+    A sender that crashed mid-delivery leaves its message in "sending"; once
+    the lease runs out the message is retried, unless it has already used
+    EMAIL_OUTBOX_MAX_ATTEMPTS attempts, in which case it is dead-lettered here.
+    Returns the number of messages marked failed.
+    """
+    now = now or timezone.now()
+    expired = EmailOutbox.objects.filter(
+        status=EmailOutbox.STATUS_SENDING,
+        next_attempt_at__lte=now,
+        attempts__gte=settings.EMAIL_OUTBOX_MAX_ATTEMPTS,
+    ).update(status=EmailOutbox.STATUS_FAILED, last_error='Delivery lease expired on the last attempt')
+
+    if expired:
+        EMAILS.labels('outbox', 'failed').inc(expired)
+        logger.error(f"Email delivery abandoned after lease expiry: {expired} messages")
+    return expired
+
+
+def _claimable(now):
+    # Messages out of attempts are never claimed again, even when recovered from an expired lease
+    return Q(
+        status__in=[EmailOutbox.STATUS_PENDING, EmailOutbox.STATUS_SENDING],
+        next_attempt_at__lte=now,
+        attempts__lt=settings.EMAIL_OUTBOX_MAX_ATTEMPTS,
+    )
+
+
+def _deliver_in_thread(message_id):
+    close_old_connections()
+    try:
+        deliver(message_id)
+    except Exception as e:
+        # Left in the outbox; the worker command will pick it up after the lease expires
+        logger.error(f"Email dispatch failed: {message_id}: {str(e)}")
+    finally:
+        close_old_connections()
+
+
+def _get_executor():
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.EMAIL_OUTBOX_THREADS,
+                    thread_name_prefix='email-outbox',
+                )
+
+    return _executor
@@ -0,0 +1,60 @@
+import time
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+from .models import EmailOutbox, TokenFamily, VerifyEmailToken
+
+
+def purge_queryset(queryset, key='pk', batch_size=1000, pause=0):
+    """
+    Delete the rows matching queryset in chunks walked in `key` order (an
+    indexed column), one chunk per short transaction, and return the number
+    of rows removed per model (including cascades).
+    """
+    removed = Counter()
+    last_key = None
+
+    while True:
+        # Rows up to last_key were deleted, so >= only revisits ties on a non-unique key
+        chunk = queryset if last_key is None else queryset.filter(**{f'{key}__gte': last_key})
+        rows = list(chunk.order_by(key).values_list('pk', key)[:batch_size])
+        if not rows:
+            break
+
+        with transaction.atomic():
+            _, per_model = queryset.model.objects.filter(pk__in=[pk for pk, _ in rows]).delete()
+        removed.update(per_model)
+
+        last_key = rows[-1][1]
+        if len(rows) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+
+    return removed
+
+
+def purge_expired(batch_size=1000, pause=0):
+    """Delete expired or used verification tokens, expired JWTs and sessions and old sent emails"""
+    now = timezone.now()
+    targets = [
+        (VerifyEmailToken.objects.filter(expires_at__lt=now), 'expires_at'),
+        (VerifyEmailToken.objects.filter(is_used=True), 'pk'),
+        # Blacklist rows go with their outstanding token through the cascade
+        (OutstandingToken.objects.filter(expires_at__lt=now), 'expires_at'),
+        (TokenFamily.objects.filter(expires_at__lt=now), 'expires_at'),
+        # next_attempt_at holds the time of the last (successful) delivery attempt
+        (EmailOutbox.objects.filter(
+            status=EmailOutbox.STATUS_SENT,
+            next_attempt_at__lt=now - timedelta(days=settings.EMAIL_OUTBOX_RETENTION_DAYS),
+        ), 'next_attempt_at'),
+    ]
+
+    removed = Counter()
+    for queryset, key in targets:
+        removed.update(purge_queryset(queryset, key=key, batch_size=batch_size, pause=pause))
+
+    return removed
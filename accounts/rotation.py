@@ -0,0 +1,128 @@
+"""
+Refresh token rotation backends, selected with TOKEN_ROTATION.
+
+BlacklistRotation is simplejwt's scheme: an OutstandingToken row per issued
+refresh token and a BlacklistedToken row per rotated or revoked one.
+FamilyRotation keeps one TokenFamily row per session and rotates it with a
+single conditional UPDATE of its generation counter.
+
+Tokens are handled by the backend that issued them (family tokens carry a
+`fam` claim), so tokens issued before a TOKEN_ROTATION change keep working.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+from .blacklist import blacklist_index
+from .models import TokenFamily
+from core.metrics import TOKENS_BLACKLISTED
+
+FAMILY_CLAIM = 'fam'
+GENERATION_CLAIM = 'gen'
+
+
+class BlacklistedTokenError(TokenError):
+    pass
+
+
+class ReusedTokenError(BlacklistedTokenError):
+    pass
+
+
+class BlacklistRotation:
+    """Track every refresh token in the simplejwt outstanding and blacklist tables"""
+
+    def issue(self, token):
+        OutstandingToken.objects.create(
+            user_id=token[api_settings.USER_ID_CLAIM],
+            jti=token[api_settings.JTI_CLAIM],
+            token=str(token),
+            created_at=token.current_time,
+            expires_at=datetime_from_epoch(token['exp']),
+        )
+
+    def check(self, token):
+        if blacklist_index.is_blacklisted(token[api_settings.JTI_CLAIM]):
+            raise BlacklistedTokenError(_("Token is blacklisted"))
+
+    def rotate(self, token):
+        if api_settings.BLACKLIST_AFTER_ROTATION:
+            self.revoke(token)
+
+        token.renew()
+        token.outstand()
+
+    def revoke(self, token):
+        token.blacklist()
+
+
+class FamilyRotation:
+    """
+    Track sessions rather than tokens, and catch refresh token reuse.
+
+    Rotation advances the family's generation; a refresh token from an
+    older generation has already been used once, so presenting it revokes
+    the whole session for both the legitimate holder and whoever copied it.
+    The exception is the generation just rotated away from, within
+    TOKEN_FAMILY_REUSE_GRACE seconds of the rotation: that is how two
+    refreshes sent at once by the same client (two tabs, a retried request)
+    look, so the later one is given a token of the current generation.
+    """
+
+    def issue(self, token):
+        family = TokenFamily.objects.create(
+            user_id=token[api_settings.USER_ID_CLAIM],
+            expires_at=datetime_from_epoch(token['exp']),
+        )
+        token[FAMILY_CLAIM] = family.pk
+        token[GENERATION_CLAIM] = family.generation
+
+    def check(self, token):
+        # With rotation on, the conditional UPDATE in rotate() is the check
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            return
+
+        if not TokenFamily.objects.filter(
+            pk=token[FAMILY_CLAIM],
+            generation=token[GENERATION_CLAIM],
+            revoked=False,
+        ).exists():
+            raise BlacklistedTokenError(_("Token is blacklisted"))
+
+    def rotate(self, token):
+        family_id, generation = token[FAMILY_CLAIM], token[GENERATION_CLAIM]
+        token.renew()
+
+        if not TokenFamily.advance(family_id, generation, datetime_from_epoch(token['exp'])):
+            grace = settings.TOKEN_FAMILY_REUSE_GRACE
+            if grace and TokenFamily.advanced_since(family_id, generation, timezone.now() - timedelta(seconds=grace)):
+                token[GENERATION_CLAIM] = generation + 1
+                return
+
+            if TokenFamily.revoke(family_id):
+                # The session was live, so this token was superseded by a newer one
+                TOKENS_BLACKLISTED.inc()
+                raise ReusedTokenError(_("Token has already been used"))
+            raise BlacklistedTokenError(_("Token is blacklisted"))
+
+        token[GENERATION_CLAIM] = generation + 1
+
+    def revoke(self, token):
+        if TokenFamily.revoke(token[FAMILY_CLAIM]):
+            TOKENS_BLACKLISTED.inc()
+
+
+BACKENDS = {name: import_string(path)() for name, path in settings.TOKEN_ROTATION_BACKENDS.items()}
+
+# Backend that issues new refresh tokens
+rotation_backend = BACKENDS[settings.TOKEN_ROTATION]
+
+
+def backend_for(token):
+    """Backend that issued the token"""
+    return BACKENDS['family' if FAMILY_CLAIM in token else 'blacklist']
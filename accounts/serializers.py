@@ -1,5 +1,17 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from core.metrics import LOGINS, TOKEN_REFRESHES, TOKEN_VALIDATION_FAILURES
+from .activity import activity_buffer
+from .authentication import get_user_claims
 from .models import CustomUser
+from .tokens import TOKEN_VERSION_CLAIM, RefreshToken, token_error_reason
 
 
 class RegisterUserSerializer(serializers.ModelSerializer):
@@ -9,6 +21,8 @@ class RegisterUserSerializer(serializers.ModelSerializer):
     class Meta:
         model = CustomUser
         fields = ('email', 'password', 'first_name', 'last_name', 'phone')
+        # Duplicates are detected by the unique constraint when the user is inserted
+        extra_kwargs = {'email': {'validators': []}}
 
 
 class UserProfileSerializer(serializers.ModelSerializer):
@@ -17,4 +31,92 @@ class UserProfileSerializer(serializers.ModelSerializer):
     class Meta:
         model = CustomUser
         fields = ('id', 'email', 'first_name', 'last_name', 'phone', 'is_email_verified', 'date_joined')
-        read_only_fields = ('id', 'email', 'is_email_verified', 'date_joined')
\ No newline at end of file
+        read_only_fields = ('id', 'email', 'is_email_verified', 'date_joined')
+
+    def update(self, instance, validated_data):
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        # Write only the edited fields: under stateless auth the other fields hold token claims, not the row
+        instance.save(update_fields=list(validated_data))
+        return instance
+
+
+class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """Login serializer that embeds JWT_USER_CLAIMS in the issued tokens"""
+    token_class = RefreshToken
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        for claim, value in get_user_claims(user).items():
+            token[claim] = value
+        token[TOKEN_VERSION_CLAIM] = user.token_version
+        return token
+
+    def validate(self, attrs):
+        try:
+            data = super().validate(attrs)
+        except AuthenticationFailed:
+            LOGINS.labels('failure').inc()
+            raise
+
+        LOGINS.labels('success').inc()
+        activity_buffer.record('last_login', self.user.pk)
+        return data
+
+
+class CustomTokenRefreshSerializer(TokenRefreshSerializer):
+    """Refresh serializer that re-stamps JWT_USER_CLAIMS from the current user row"""
+    token_class = RefreshToken
+
+    def validate(self, attrs):
+        try:
+            refresh = self.token_class(attrs['refresh'])
+        except TokenError as e:
+            TOKEN_VALIDATION_FAILURES.labels('refresh', token_error_reason(e)).inc()
+            raise
+
+        user_id = refresh.payload.get(api_settings.USER_ID_CLAIM, None)
+        if user_id:
+            User = get_user_model()
+            try:
+                # From the primary: the token_version check must see a logout-all or password change at once
+                user = User.objects.using(DEFAULT_DB_ALIAS).get(**{api_settings.USER_ID_FIELD: user_id})
+            except User.DoesNotExist:
+                user = None
+
+            if not api_settings.USER_AUTHENTICATION_RULE(user):
+                raise AuthenticationFailed(
+                    self.error_messages['no_active_account'],
+                    'no_active_account',
+                )
+
+            if refresh.get(TOKEN_VERSION_CLAIM, 0) != user.token_version:
+                TOKEN_VALIDATION_FAILURES.labels('refresh', 'revoked').inc()
+                raise TokenError(_('Token has been revoked'))
+
+            # Claims copied from the refresh token may be stale (e.g. after an email change)
+            for claim, value in get_user_claims(user).items():
+                refresh[claim] = value
+
+        data = {'access': str(refresh.access_token)}
+
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            try:
+                refresh.rotate()
+            except TokenError as e:
+                TOKEN_VALIDATION_FAILURES.labels('refresh', token_error_reason(e)).inc()
+                raise
+
+            data['refresh'] = str(refresh)
+
+        TOKEN_REFRESHES.labels(str(api_settings.ROTATE_REFRESH_TOKENS).lower()).inc()
+        return data
+
+
+class IntrospectionSerializer(serializers.Serializer):
+    tokens = serializers.ListField(
+        child=serializers.CharField(trim_whitespace=True),
+        allow_empty=False,
+        max_length=settings.INTROSPECTION_MAX_TOKENS,
+    )
@@ -0,0 +1,13 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .cache import user_cache
+from .models import CustomUser
+from .tokens import forget_token_version
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Drop a changed or deleted user from the user cache in every worker"""
+    user_cache.invalidate(instance.pk)
+    forget_token_version(instance.pk)
@@ -0,0 +1,116 @@
+"""
+Stateless verification tokens, used when VERIFY_TOKEN_MODE=signed.
+
+The link carries a signed payload (user id, new email, expiry and a
+fingerprint of the user fields the token acts on) instead of a key into
+the VerifyEmailToken table, so issuing a token writes nothing and redeeming
+one reads only the user. The fingerprint makes a token stop working once it
+has done its job (email verified, password reset or changed, email changed);
+the ids of redeemed tokens are also kept in the cache until they expire, so
+two concurrent requests cannot both redeem the same link (an id is dropped
+again if its redemption rolls back). That cache has to
+be shared between workers, which settings enforce.
+"""
+import secrets
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+
+SALT = 'accounts.verify_token'
+
+# User fields whose change invalidates a token of each type
+FINGERPRINT_FIELDS = {
+    'verify_email': ('email', 'is_email_verified'),
+    # token_version rather than the password hash, which is rewritten (new salt) when a login upgrades it
+    'reset_password': ('email', 'token_version'),
+    'change_email': ('email', 'pending_email'),
+}
+
+
+class InvalidToken(Exception):
+    """Bad signature, wrong token type or unknown user"""
+
+
+class SignedToken:
+    """Stands in for a VerifyEmailToken row, with the attributes views and emails use"""
+    is_used = False
+
+    def __init__(self, token, token_type, user, new_email, expires_at, token_id, fingerprint):
+        self.token = token
+        self.token_type = token_type
+        self.user = user
+        self.new_email = new_email
+        self.expires_at = expires_at
+        self.token_id = token_id
+        self.fingerprint = fingerprint
+
+    def is_valid(self):
+        return timezone.now() < self.expires_at
+
+
+def fingerprint(user, token_type):
+    value = '|'.join(str(getattr(user, field)) for field in FINGERPRINT_FIELDS[token_type])
+    return salted_hmac(SALT, value).hexdigest()[:16]
+
+
+def generate(user, token_type, new_email=None, expiry_hours=24):
+    expires_at = timezone.now() + timedelta(hours=expiry_hours)
+    payload = {
+        'u': user.pk,
+        'e': int(expires_at.timestamp()),
+        'j': secrets.token_urlsafe(9),
+        'f': fingerprint(user, token_type),
+    }
+    if new_email:
+        payload['n'] = new_email
+
+    # The token type is part of the salt, so a token only verifies for its own purpose
+    token = signing.dumps(payload, salt=f'{SALT}:{token_type}', compress=True)
+    return SignedToken(token, token_type, user, new_email, expires_at, payload['j'], payload['f'])
+
+
+def load(token_string, token_type):
+    """Return the token with its user loaded, whether or not it is still usable"""
+    try:
+        payload = signing.loads(token_string, salt=f'{SALT}:{token_type}')
+        user = get_user_model().objects.get(pk=payload['u'])
+    except (signing.BadSignature, KeyError, TypeError, ObjectDoesNotExist):
+        raise InvalidToken()
+
+    return SignedToken(
+        token_string,
+        token_type,
+        user,
+        payload.get('n'),
+        datetime.fromtimestamp(payload['e'], tz=dt_timezone.utc),
+        payload.get('j'),
+        payload.get('f'),
+    )
+
+
+def consume(token_string, token_type):
+    """Same contract as VerifyEmailToken.consume_token, but raises InvalidToken for unknown tokens"""
+    token = load(token_string, token_type)
+
+    if not token.is_valid() or token.fingerprint != fingerprint(token.user, token_type):
+        return None
+
+    # Atomic claim of the token id, held until the token would have expired anyway
+    remaining = int((token.expires_at - timezone.now()).total_seconds()) + 1
+    if not cache.add(_used_key(token), 1, remaining):
+        return None
+
+    return token
+
+
+def release(token):
+    """Make a consumed token usable again, for when the update it was redeemed for rolled back"""
+    cache.delete(_used_key(token))
+
+
+def _used_key(token):
+    return f'verify_token_used:{token.token_id}'
@@ -1,3 +1,1666 @@
-from django.test import TestCase
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+import jwt
+from asgiref.sync import sync_to_async
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.db.models import F
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, resolve
+from django.utils import timezone
+from prometheus_client import REGISTRY, generate_latest
+from prometheus_client.parser import text_string_to_metric_families
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, TokenBackendError
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from core.admission import AdmissionControlMiddleware
+from core.db import PrimaryPinningMiddleware, ReplicaRouter, pin_for_user, pinned_to_primary, reset_pin
+from core.traffic import REDACTED, TrafficCaptureMiddleware
+from .activity import ActivityBuffer, activity_buffer
+from .authentication import CachedJWTAuthentication, JWTAuthentication, StatelessJWTAuthentication
+from .blacklist import BlacklistIndex, blacklist_index
+from .cache import UserCache, user_cache
+from .hashers import CalibratedPBKDF2PasswordHasher
+from .hashing import HashingQueueFull, PasswordHashingPool, hashing_pool
+from .introspection import introspect_tokens
+from .keys import KeyRingTokenBackend
+from .management.commands.benchmark_auth import Command as BenchmarkCommand, Recorder, percentile
+from .management.commands.calibrate_hashers import write_env_file
+from .models import CustomUser, EmailOutbox, TokenFamily, VerifyEmailToken
+from .outbox import deliver, enqueue_email, process_outbox
+from .purge import purge_expired, purge_queryset
+from .rotation import BACKENDS, FAMILY_CLAIM, GENERATION_CLAIM, BlacklistedTokenError, ReusedTokenError
+from .serializers import CustomTokenObtainPairSerializer
+from .tokens import AccessToken, RefreshToken, get_token_version, revoke_user_tokens
+from .utils import reset_password, send_token_email
+from .views import change_email_view, change_password_view, profile_view, verify_email_view
 
-# Create your tests here.
+
+class AsyncURLConf:
+    urlpatterns = [path('api/auth/', include('accounts.async_urls'))]
+
+
+class QueryPlanTests(TestCase):
+    """Fail when a hot query on the token tables needs a full table scan"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email='plan@example.com', password='S3cure-pass!')
+
+    def assertIndexed(self, queryset):
+        if connection.vendor == 'postgresql':
+            # Tiny test tables make a sequential scan the cheapest plan, so rule it out
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            pattern = r'Seq Scan on'
+        elif connection.vendor == 'sqlite':
+            pattern = r'\bSCAN \w+\s*$'
+        else:
+            self.skipTest(f'No query plan check for {connection.vendor}')
+
+        plan = queryset.explain()
+        full_scans = [line for line in plan.splitlines() if re.search(pattern, line)]
+        self.assertFalse(full_scans, f'Full table scan in plan:\n{plan}')
+
+    def test_token_lookup(self):
+        self.assertIndexed(VerifyEmailToken.objects.filter(token='abc', token_type='verify_email'))
+
+    def test_user_tokens_by_type(self):
+        self.assertIndexed(VerifyEmailToken.objects.filter(user=self.user, token_type='change_email'))
+
+    def test_purge_expired_verify_tokens(self):
+        now = timezone.now()
+        queryset = VerifyEmailToken.objects.filter(expires_at__lt=now)
+        self.assertIndexed(queryset.order_by('expires_at').values_list('pk', 'expires_at')[:1000])
+        self.assertIndexed(queryset.filter(expires_at__gte=now).order_by('expires_at').values_list('pk')[:1000])
+
+    def test_purge_used_verify_tokens(self):
+        queryset = VerifyEmailToken.objects.filter(is_used=True)
+        self.assertIndexed(queryset.order_by('pk').values_list('pk')[:1000])
+        self.assertIndexed(queryset.filter(pk__gte=100).order_by('pk').values_list('pk')[:1000])
+
+    def test_purge_expired_outstanding_tokens(self):
+        queryset = OutstandingToken.objects.filter(expires_at__lt=timezone.now())
+        self.assertIndexed(queryset.order_by('expires_at').values_list('pk', 'expires_at')[:1000])
+
+    def test_blacklist_lookup(self):
+        self.assertIndexed(BlacklistedToken.objects.filter(token__jti='abc'))
+
+    def test_due_outbox_messages(self):
+        queryset = EmailOutbox.objects.filter(
+            status__in=[EmailOutbox.STATUS_PENDING, EmailOutbox.STATUS_SENDING],
+            next_attempt_at__lte=timezone.now(),
+            attempts__lt=5,
+        )
+        self.assertIndexed(queryset.order_by('next_attempt_at').values_list('pk')[:100])
+
+    def test_no_default_ordering(self):
+        self.assertNotIn('ORDER BY', str(VerifyEmailToken.objects.filter(user=self.user).query))
+
+
+class PurgeTests(TestCase):
+    """Purges delete only dead rows, in chunks, and report what they removed"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email='purge@example.com', password='S3cure-pass!')
+
+    def verify_token(self, name, expires_at, **kwargs):
+        return VerifyEmailToken.objects.create(
+            user=self.user, token=name, token_type='verify_email', expires_at=expires_at, **kwargs,
+        )
+
+    def outstanding_token(self, jti, expires_at):
+        return OutstandingToken.objects.create(jti=jti, token=jti, expires_at=expires_at)
+
+    def test_chunks_walk_ties_on_key(self):
+        expired = timezone.now() - timedelta(days=1)
+        for n in range(5):
+            self.verify_token(f'tie-{n}', expired)
+
+        removed = purge_queryset(VerifyEmailToken.objects.filter(expires_at__lt=timezone.now()),
+                                 key='expires_at', batch_size=2)
+
+        self.assertEqual(removed, {'accounts.VerifyEmailToken': 5})
+        self.assertFalse(VerifyEmailToken.objects.exists())
+
+    def test_counts_include_cascades(self):
+        expired = self.outstanding_token('expired', timezone.now() - timedelta(days=1))
+        BlacklistedToken.objects.create(token=expired)
+        self.verify_token('used', timezone.now() + timedelta(days=1), is_used=True)
+
+        removed = purge_expired(batch_size=10)
+
+        self.assertEqual(removed, {
+            'token_blacklist.OutstandingToken': 1,
+            'token_blacklist.BlacklistedToken': 1,
+            'accounts.VerifyEmailToken': 1,
+        })
+
+    def test_live_rows_are_kept(self):
+        tomorrow = timezone.now() + timedelta(days=1)
+        self.verify_token('live', tomorrow)
+        BlacklistedToken.objects.create(token=self.outstanding_token('live', tomorrow))
+        TokenFamily.objects.create(user=self.user, expires_at=tomorrow)
+        EmailOutbox.objects.create(template='verify_email', to_email='purge@example.com', subject='Verify',
+                                   text_content='Body', status=EmailOutbox.STATUS_SENT)
+
+        self.assertEqual(purge_expired(batch_size=10), {})
+
+        self.assertTrue(VerifyEmailToken.objects.filter(token='live').exists())
+        self.assertEqual(BlacklistedToken.objects.count(), 1)
+        self.assertEqual(TokenFamily.objects.count(), 1)
+        self.assertEqual(EmailOutbox.objects.count(), 1)
+
+    def test_command_repeats_every_interval(self):
+        self.verify_token('expired', timezone.now() - timedelta(days=1))
+        stdout = StringIO()
+
+        with mock.patch('accounts.management.commands.purge_expired_tokens.time') as command_time:
+            command_time.monotonic = time.monotonic
+            # Stop the loop at its second sleep
+            command_time.sleep.side_effect = [None, KeyboardInterrupt]
+            with self.assertRaises(KeyboardInterrupt):
+                call_command('purge_expired_tokens', interval=30, stdout=stdout)
+
+        self.assertEqual(command_time.sleep.call_args_list, [mock.call(30), mock.call(30)])
+        output = stdout.getvalue()
+        self.assertIn('accounts.VerifyEmailToken: 1 rows removed', output)
+        runs = re.findall(r'Removed (\d+) rows in', output)
+        self.assertEqual(runs, ['1', '0'])
+
+
+class SeedDataTests(TestCase):
+    """seed_data creates the same rows for the same seed, and --flush removes only seeded rows"""
+
+    def seed(self, **options):
+        options = {'users': 4, 'tokens_per_user': 2, 'sessions_per_user': 2, 'batch_size': 3, 'seed': 7, **options}
+        call_command('seed_data', stdout=StringIO(), **options)
+
+    def snapshot(self):
+        return {
+            'users': list(CustomUser.objects.filter(email__startswith='seed-').order_by('email').values_list(
+                'email', 'is_email_verified',
+            )),
+            'tokens': sorted(VerifyEmailToken.objects.filter(user__email__startswith='seed-').values_list(
+                'token', 'token_type', 'is_used',
+            )),
+            'sessions': sorted(OutstandingToken.objects.filter(jti__startswith='seed-').values_list('jti', flat=True)),
+            'blacklisted': sorted(BlacklistedToken.objects.filter(token__jti__startswith='seed-').values_list(
+                'token__jti', flat=True,
+            )),
+        }
+
+    def test_same_seed_creates_same_rows(self):
+        self.seed()
+        first = self.snapshot()
+
+        self.seed(flush=True)
+
+        self.assertEqual(self.snapshot(), first)
+        self.assertEqual((len(first['users']), len(first['tokens']), len(first['sessions'])), (4, 8, 8))
+
+        self.seed(flush=True, seed=8)
+        self.assertNotEqual(self.snapshot()['tokens'], first['tokens'])
+
+    def test_flush_removes_only_seeded_rows(self):
+        self.seed()
+        user = CustomUser.objects.create_user(email='real@example.com', password='S3cure-pass!')
+        VerifyEmailToken.generate_token(user, 'verify_email')
+        session = OutstandingToken.objects.create(
+            user=user, jti='real', token='real', expires_at=timezone.now() + timedelta(days=1),
+        )
+        BlacklistedToken.objects.create(token=session)
+
+        self.seed(flush=True, users=0)
+
+        self.assertEqual(self.snapshot(), {'users': [], 'tokens': [], 'sessions': [], 'blacklisted': []})
+        self.assertEqual(list(CustomUser.objects.values_list('email', flat=True)), ['real@example.com'])
+        self.assertEqual(VerifyEmailToken.objects.get().user, user)
+        self.assertEqual(BlacklistedToken.objects.get().token, session)
+
+
+class TokenFlowTests(TestCase):
+    """Token-consuming flows run as a few statements in one transaction and use each token once"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email='flow@example.com', password='S3cure-pass!')
+
+    def post(self, url, data):
+        return self.client.post(url, data, content_type='application/json')
+
+    # Each flow: conditional UPDATE of the token, SELECT of token and user, UPDATE of the user,
+    # plus the SAVEPOINT/RELEASE pair that transaction.atomic() issues inside a test case
+    def test_verify_email_queries(self):
+        token = VerifyEmailToken.generate_token(self.user, 'verify_email')
+
+        with self.assertNumQueries(5):
+            response = self.post('/api/auth/verify-email/', {'token': token.token})
+
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_email_verified)
+
+    def test_reset_password_confirm_queries(self):
+        token = VerifyEmailToken.generate_token(self.user, 'reset_password')
+
+        with self.assertNumQueries(5):
+            response = self.post('/api/auth/reset-password-confirm/', {'token': token.token, 'password': 'N3w-secure-pass!'})
+
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('N3w-secure-pass!'))
+        self.assertEqual(self.user.token_version, 1)
+
+    def test_change_email_confirm_queries(self):
+        token = VerifyEmailToken.generate_token(self.user, 'change_email', new_email='new@example.com')
+
+        with self.assertNumQueries(5):
+            response = self.post('/api/auth/change-email-confirm/', {'token': token.token})
+
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.email, 'new@example.com')
+        self.assertIsNone(self.user.pending_email)
+
+    def test_query_budget_warning(self):
+        token = VerifyEmailToken.generate_token(self.user, 'verify_email')
+
+        with mock.patch.object(verify_email_view, 'query_budget', 2), self.assertLogs('core.timing', 'WARNING') as logs:
+            self.post('/api/auth/verify-email/', {'token': token.token})
+
+        self.assertIn('Query budget exceeded: verify_email ran 3 queries (budget 2)', logs.output[0])
+
+    def test_token_is_single_use(self):
+        token = VerifyEmailToken.generate_token(self.user, 'verify_email')
+
+        self.assertEqual(self.post('/api/auth/verify-email/', {'token': token.token}).status_code, 200)
+        response = self.post('/api/auth/verify-email/', {'token': token.token})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['detail'], 'Token expired or used')
+
+    def test_expired_token_is_rejected(self):
+        token = VerifyEmailToken.generate_token(self.user, 'reset_password', expiry_hours=-1)
+
+        response = self.post('/api/auth/reset-password-confirm/', {'token': token.token, 'password': 'N3w-secure-pass!'})
+
+        self.assertEqual(response.status_code, 400)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('S3cure-pass!'))
+
+    def test_consume_token_claims_once(self):
+        token = VerifyEmailToken.generate_token(self.user, 'verify_email')
+
+        self.assertEqual(VerifyEmailToken.consume_token(token.token, 'verify_email').user, self.user)
+        self.assertIsNone(VerifyEmailToken.consume_token(token.token, 'verify_email'))
+        with self.assertRaises(VerifyEmailToken.DoesNotExist):
+            VerifyEmailToken.consume_token(token.token, 'reset_password')
+
+
+class QueryBudgetTests(TestCase):
+    """Each view with a query budget stays within it in the default configuration, on its slowest path"""
+
+    password = 'S3cure-pass!'
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email='budget@example.com', password=self.password)
+
+    def request(self, method, url, data=None, client=None, **extra):
+        client = client or self.client
+        return getattr(client, method)(url, data, content_type='application/json', **extra)
+
+    def assertWithinBudget(self, method, url, data=None, **extra):
+        with self.assertNoLogs('core.timing', 'WARNING'):
+            response = self.request(method, url, data, **extra)
+        self.assertIn(response.status_code, (200, 201), response.content)
+        return response
+
+    async def assertWithinBudgetAsync(self, method, url, data=None, **extra):
+        with self.assertNoLogs('core.timing', 'WARNING'):
+            response = await self.request(method, url, data, client=self.async_client, **extra)
+        self.assertIn(response.status_code, (200, 201), response.content)
+        return response
+
+    def test_sync_views(self):
+        self.assertWithinBudget('post', '/api/auth/register/', {
+            'email': 'new@example.com', 'password': self.password, 'first_name': 'New', 'last_name': 'User',
+        })
+        # An unverified duplicate fails the insert, then issues and sends a new token
+        self.assertWithinBudget('post', '/api/auth/register/', {
+            'email': 'budget@example.com', 'password': self.password, 'first_name': 'A', 'last_name': 'B',
+        })
+
+        token = VerifyEmailToken.generate_token(self.user, 'verify_email')
+        self.assertWithinBudget('post', '/api/auth/verify-email/', {'token': token.token})
+        self.assertWithinBudget('post', '/api/auth/reset-password/', {'email': 'budget@example.com'})
+        token = VerifyEmailToken.objects.get(user=self.user, token_type='reset_password')
+        self.assertWithinBudget('post', '/api/auth/reset-password-confirm/', {'token': token.token, 'password': self.password})
+
+        # A login that upgrades the stored hash writes it back as well. last_login is buffered, so keep
+        # the flush thread, which would outlive the test database, from starting
+        iterations = CalibratedPBKDF2PasswordHasher.iterations + 10000
+        with mock.patch.object(CalibratedPBKDF2PasswordHasher, 'iterations', iterations), \
+                mock.patch.object(activity_buffer, 'record'):
+            tokens = self.assertWithinBudget('post', '/api/auth/login/', {
+                'email': 'budget@example.com', 'password': self.password,
+            }).data
+
+        blacklist_index.warm()
+        tokens = self.assertWithinBudget('post', '/api/auth/refresh/', {'refresh': tokens['refresh']}).data
+        # Including the periodic pull of tokens blacklisted by other workers
+        with mock.patch.object(blacklist_index, 'sync_interval', 0):
+            tokens = self.assertWithinBudget('post', '/api/auth/refresh/', {'refresh': tokens['refresh']}).data
+
+        tokens = self.assertWithinBudget('post', '/api/auth/change-password/', {
+            'old_password': self.password, 'new_password': 'N3w-secure-pass!',
+        }, HTTP_AUTHORIZATION=f"Bearer {tokens['access']}").data
+        token = VerifyEmailToken.generate_token(self.user, 'change_email', new_email='next@example.com')
+        self.assertWithinBudget('post', '/api/auth/change-email-confirm/', {'token': token.token})
+
+    @override_settings(ROOT_URLCONF=AsyncURLConf)
+    async def test_async_views(self):
+        await self.assertWithinBudgetAsync('post', '/api/auth/register/', {
+            'email': 'new@example.com', 'password': self.password, 'first_name': 'New', 'last_name': 'User',
+        })
+        await self.assertWithinBudgetAsync('post', '/api/auth/register/', {
+            'email': 'budget@example.com', 'password': self.password, 'first_name': 'A', 'last_name': 'B',
+        })
+
+        generate_token = sync_to_async(VerifyEmailToken.generate_token)
+        token = await generate_token(self.user, 'verify_email')
+        await self.assertWithinBudgetAsync('post', '/api/auth/verify-email/', {'token': token.token})
+        await self.assertWithinBudgetAsync('post', '/api/auth/reset-password/', {'email': 'budget@example.com'})
+        token = await VerifyEmailToken.objects.aget(user=self.user, token_type='reset_password')
+        await self.assertWithinBudgetAsync('post', '/api/auth/reset-password-confirm/', {
+            'token': token.token, 'password': self.password,
+        })
+
+        await self.user.arefresh_from_db()
+        refresh = await sync_to_async(CustomTokenObtainPairSerializer.get_token)(self.user)
+        access = str(refresh.access_token)
+        await self.assertWithinBudgetAsync('post', '/api/auth/change-password/', {
+            'old_password': self.password, 'new_password': 'N3w-secure-pass!',
+        }, headers={'Authorization': f'Bearer {access}'})
+        token = await generate_token(self.user, 'change_email', new_email='next@example.com')
+        await self.assertWithinBudgetAsync('post', '/api/auth/change-email-confirm/', {'token': token.token})
+
+
+@override_settings(SERVER_TIMING_HEADER=True, THROTTLE_RATES={})
+class BenchmarkTests(TestCase):
+    """benchmark_auth drives every lifecycle step and reports latency and queries per endpoint"""
+
+    def test_lifecycle_records_every_endpoint(self):
+        recorder = Recorder()
+        blacklist_index.warm()
+
+        with mock.patch.object(activity_buffer, 'record'):
+            BenchmarkCommand().run_lifecycle(0, 3, recorder)
+
+        summary = recorder.summary(elapsed=1)
+        self.assertEqual(list(summary), ['register', 'verify_email', 'login', 'profile', 'refresh', 'logout'])
+        self.assertEqual({name: stats['errors'] for name, stats in summary.items()}, dict.fromkeys(summary, 0))
+        self.assertEqual(summary['profile']['requests'], 3)
+        # Read from the Server-Timing header: the profile GET only loads the user
+        self.assertEqual(summary['profile']['queries_per_request'], 1)
+        self.assertTrue(CustomUser.objects.get(email='bench0@example.com').is_email_verified)
+
+    def test_percentiles(self):
+        latencies = [n / 1000 for n in range(1, 101)]
+
+        self.assertEqual([percentile(latencies, p) for p in (50, 95, 99, 100)], [50, 95, 99, 100])
+        self.assertEqual(percentile([0.004], 99), 4)
+
+    def test_report_compares_with_baseline(self):
+        stats = {'requests': 10, 'errors': 0, 'throughput': 5.0, 'p50_ms': 20.0, 'p95_ms': 30.0, 'p99_ms': 40.0,
+                 'queries_per_request': 3.0}
+        report = {
+            'meta': {'users': 10, 'concurrency': 2},
+            'duration_seconds': 2.0,
+            'lifecycles_per_second': 5.0,
+            'endpoints': {'login': stats},
+        }
+        baseline = {'endpoints': {'login': {**stats, 'p50_ms': 10.0, 'queries_per_request': 4.0}}}
+        command = BenchmarkCommand(stdout=StringIO())
+
+        command.print_report(report, baseline)
+
+        self.assertIn('p50 +100%, queries -1.0', command.stdout.getvalue())
+
+
+class RegistrationTests(TestCase):
+    """Registration inserts directly and relies on the unique constraint to find existing accounts"""
+
+    data = {'email': 'new@example.com', 'password': 'S3cure-pass!', 'first_name': 'New', 'last_name': 'User'}
+
+    def setUp(self):
+        # Resend claims are kept in the cache, which outlives each test's transaction
+        cache.clear()
+
+    def register(self, **overrides):
+        return self.client.post('/api/auth/register/', {**self.data, **overrides}, content_type='application/json')
+
+    def test_register_queries(self):
+        # INSERT user, token and outbox email, plus the SAVEPOINT/RELEASE pair
+        with self.assertNumQueries(5):
+            response = self.register()
+
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(CustomUser.objects.filter(email='new@example.com').exists())
+
+    def test_register_unverified_email_resends_verification(self):
+        CustomUser.objects.create_user(email='new@example.com', password='S3cure-pass!')
+
+        response = self.register()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['detail'], 'Verification email sent')
+        self.assertEqual(EmailOutbox.objects.filter(to_email='new@example.com').count(), 1)
+
+    def test_register_resend_is_coalesced(self):
+        user = CustomUser.objects.create_user(email='new@example.com', password='S3cure-pass!')
+
+        self.assertEqual(self.register().status_code, 200)
+        self.assertEqual(self.register().status_code, 200)
+
+        self.assertEqual(EmailOutbox.objects.filter(to_email='new@example.com').count(), 1)
+        self.assertEqual(VerifyEmailToken.objects.filter(user=user).count(), 1)
+
+    def test_failed_resend_releases_claim(self):
+        user = CustomUser.objects.create_user(email='new@example.com', password='S3cure-pass!')
+
+        with self.assertRaises(OperationalError):
+            send_token_email(user, 'verify_email', mock.Mock(side_effect=OperationalError))
+
+        # The rolled back send must not hold off the next one for the resend interval
+        self.assertTrue(send_token_email(user, 'verify_email', mock.Mock()))
+
+    def test_generate_token_reuses_valid_token(self):
+        user = CustomUser.objects.create_user(email='new@example.com', password='S3cure-pass!')
+        token = VerifyEmailToken.generate_token(user, 'reset_password')
+
+        self.assertEqual(VerifyEmailToken.generate_token(user, 'reset_password'), token)
+        self.assertNotEqual(VerifyEmailToken.generate_token(user, 'verify_email'), token)
+
+    def test_register_verified_email_is_rejected(self):
+        CustomUser.objects.create_user(email='new@example.com', password='S3cure-pass!', is_email_verified=True)
+
+        response = self.register()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['detail'], 'Email already exists')
+        self.assertFalse(EmailOutbox.objects.exists())
+
+
+@override_settings(THROTTLE_RATES={'register.email': '2/hour', 'reset_password.ip': '2/hour'})
+class ThrottleTests(TestCase):
+    """Views with a configured rate are limited per email address and per client IP"""
+
+    def setUp(self):
+        cache.clear()
+
+    def post(self, url, data, ip='10.0.0.1'):
+        return self.client.post(url, data, content_type='application/json', REMOTE_ADDR=ip)
+
+    def test_email_rate(self):
+        data = {'email': 'new@example.com', 'password': 'S3cure-pass!', 'first_name': 'New', 'last_name': 'User'}
+        for ip in ('10.0.0.1', '10.0.0.2'):
+            self.assertNotEqual(self.post('/api/auth/register/', data, ip).status_code, 429)
+
+        # Same address from a third IP
+        response = self.post('/api/auth/register/', {**data, 'email': 'NEW@example.com '}, '10.0.0.3')
+
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertNotEqual(self.post('/api/auth/register/', {**data, 'email': 'other@example.com'}).status_code, 429)
+
+    def test_ip_rate(self):
+        for n in range(2):
+            self.assertEqual(self.post('/api/auth/reset-password/', {'email': f'{n}@example.com'}).status_code, 200)
+
+        self.assertEqual(self.post('/api/auth/reset-password/', {'email': 'x@example.com'}).status_code, 429)
+        self.assertEqual(self.post('/api/auth/reset-password/', {'email': 'x@example.com'}, '10.0.0.2').status_code, 200)
+
+    def test_views_without_rate_are_not_throttled(self):
+        for _ in range(5):
+            self.assertNotEqual(self.post('/api/auth/verify-email/', {'token': 'abc'}).status_code, 429)
+
+
+@override_settings(ADMISSION_CONTROL_MAX_CONCURRENT=1)
+class AdmissionControlTests(SimpleTestCase):
+    """Only requests that hash a password take a slot, and requests beyond the limit are shed with 503"""
+
+    def setUp(self):
+        self.middleware = AdmissionControlMiddleware(lambda request: HttpResponse())
+
+    def admit(self, method, path):
+        request = getattr(RequestFactory(), method)(path)
+        request.resolver_match = resolve(path)
+        return request, self.middleware.process_view(request, None, (), {})
+
+    def test_sheds_beyond_limit(self):
+        first, response = self.admit('post', '/api/auth/login/')
+        self.assertIsNone(response)
+
+        _, response = self.admit('post', '/api/auth/change-password/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+        self.middleware.release(first)
+        self.assertIsNone(self.admit('post', '/api/auth/change-password/')[1])
+
+    def test_only_password_methods_take_a_slot(self):
+        self.admit('post', '/api/auth/register/')
+
+        for method, path in (('get', '/api/auth/profile/'), ('patch', '/api/auth/profile/'),
+                             ('post', '/api/auth/reset-password/'), ('post', '/api/auth/refresh/')):
+            self.assertIsNone(self.admit(method, path)[1], f'{method} {path}')
+
+        self.assertEqual(self.admit('delete', '/api/auth/profile/')[1].status_code, 503)
+
+
+@override_settings(VERIFY_TOKEN_MODE='signed')
+class SignedTokenTests(TestCase):
+    """Signed links work without token rows, once each, and only until the account changes under them"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email='signed@example.com', password='S3cure-pass!')
+
+    def setUp(self):
+        # Redeemed token ids are kept in the cache
+        cache.clear()
+
+    def post(self, url, data):
+        return self.client.post(url, data, content_type='application/json')
+
+    def test_verify_email(self):
+        token = VerifyEmailToken.generate_token(self.user, 'verify_email')
+
+        self.assertEqual(self.post('/api/auth/verify-email/', {'token': token.token}).status_code, 200)
+        self.assertEqual(self.post('/api/auth/verify-email/', {'token': token.token}).status_code, 400)
+        self.assertFalse(VerifyEmailToken.objects.exists())
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_email_verified)
+
+    def test_reset_link_is_single_use(self):
+        token = VerifyEmailToken.generate_token(self.user, 'reset_password')
+
+        response = self.post('/api/auth/reset-password-confirm/', {'token': token.token, 'password': 'N3w-secure-pass!'})
+        self.assertEqual(response.status_code, 200)
+
+        cache.clear()
+        # Still rejected without the cache entry: the reset moved token_version on
+        response = self.post('/api/auth/reset-password-confirm/', {'token': token.token, 'password': 'Th1rd-secure-pass!'})
+        self.assertEqual(response.status_code, 400)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('N3w-secure-pass!'))
+
+    def test_rolled_back_reset_keeps_link_usable(self):
+        token = VerifyEmailToken.generate_token(self.user, 'reset_password')
+
+        with mock.patch.object(CustomUser, 'save', side_effect=OperationalError):
+            with self.assertRaises(OperationalError):
+                reset_password(token.token, 'unused')
+
+        self.assertIsNotNone(reset_password(token.token, 'unused'))
+
+    def test_reset_link_survives_password_rehash(self):
+        token = VerifyEmailToken.generate_token(self.user, 'reset_password')
+
+        # What a login does when the hasher parameters changed: same password, new hash
+        self.user.set_password('S3cure-pass!')
+        self.user.save(update_fields=['password'])
+
+        response = self.post('/api/auth/reset-password-confirm/', {'token': token.token, 'password': 'N3w-secure-pass!'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_password_change_invalidates_reset_link(self):
+        token = VerifyEmailToken.generate_token(self.user, 'reset_password')
+        revoke_user_tokens(self.user)
+
+        response = self.post('/api/auth/reset-password-confirm/', {'token': token.token, 'password': 'N3w-secure-pass!'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_token_is_bound_to_its_type(self):
+        token = VerifyEmailToken.generate_token(self.user, 'verify_email')
+
+        response = self.post('/api/auth/reset-password-confirm/', {'token': token.token, 'password': 'N3w-secure-pass!'})
+        self.assertEqual(response.status_code, 400)
+
+
+class BlacklistIndexTests(TestCase):
+    """Misses cost one range query returning only unseen rows; hits are confirmed in the database"""
+
+    def setUp(self):
+        self.index = BlacklistIndex(
+            capacity=1000, error_rate=0.001, sync_interval=0, gap_timeout=60, rebuild_interval=3600,
+        )
+
+    def blacklist(self, jti, **kwargs):
+        token = OutstandingToken.objects.create(
+            jti=jti, token=jti, expires_at=timezone.now() + timedelta(days=1),
+        )
+        return BlacklistedToken.objects.create(token=token, **kwargs)
+
+    def test_hit(self):
+        self.blacklist('revoked')
+        self.index.warm()
+
+        self.assertTrue(self.index.is_blacklisted('revoked'))
+
+    def test_miss_reads_only_new_rows(self):
+        for n in range(50):
+            self.blacklist(f'revoked-{n}')
+        self.index.warm()
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertFalse(self.index.is_blacklisted('clean'))
+            self.assertFalse(self.index.is_blacklisted('clean-2'))
+
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(self.index._high_water, BlacklistedToken.objects.latest('id').id)
+
+    def test_miss_within_sync_interval_skips_database(self):
+        self.index.sync_interval = 2
+        self.index.warm()
+        self.blacklist('elsewhere')
+
+        with self.assertNumQueries(0):
+            self.assertFalse(self.index.is_blacklisted('elsewhere'))
+
+        with mock.patch('accounts.blacklist.time.monotonic', return_value=time.monotonic() + 3):
+            self.assertTrue(self.index.is_blacklisted('elsewhere'))
+
+    def test_blacklisted_by_another_process(self):
+        self.index.warm()
+        self.assertFalse(self.index.is_blacklisted('elsewhere'))
+
+        # Written by another worker, so this index was never told about it
+        self.blacklist('elsewhere')
+
+        self.assertTrue(self.index.is_blacklisted('elsewhere'))
+
+    def test_row_committed_out_of_id_order(self):
+        first = self.blacklist('first')
+        self.index.warm()
+
+        # The row with the higher id is seen first; the lower one commits afterwards
+        self.blacklist('late-high', id=first.id + 2)
+        self.assertFalse(self.index.is_blacklisted('clean'))
+        self.blacklist('late-low', id=first.id + 1)
+
+        self.assertTrue(self.index.is_blacklisted('late-low'))
+        self.assertEqual(self.index._gaps, {})
+
+
+class IntrospectionTests(TestCase):
+    """Introspection costs a fixed number of queries per batch and is limited to staff"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user(email='admin@example.com', password='S3cure-pass!', is_staff=True)
+        cls.user = CustomUser.objects.create_user(email='member@example.com', password='S3cure-pass!')
+
+    def setUp(self):
+        cache.clear()
+        self.index = BlacklistIndex(
+            capacity=1000, error_rate=0.001, sync_interval=0, gap_timeout=60, rebuild_interval=3600,
+        )
+        patcher = mock.patch('accounts.introspection.blacklist_index', self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def introspect(self, user, tokens):
+        access = str(RefreshToken.for_user(user).access_token)
+        return self.client.post(
+            '/api/auth/introspect/', {'tokens': tokens}, content_type='application/json',
+            headers={'Authorization': f'Bearer {access}'},
+        )
+
+    def test_batch_queries(self):
+        revoked = RefreshToken.for_user(self.user)
+        revoked.revoke()
+        live = RefreshToken.for_user(self.user)
+        with mock.patch('accounts.tokens.rotation_backend', BACKENDS['family']):
+            family = RefreshToken.for_user(self.admin)
+        access = [str(RefreshToken.for_user(user).access_token) for user in (self.user, self.admin) * 10]
+        self.index.warm()
+
+        # Index sync, confirmation of the revoked token, families, users
+        with self.assertNumQueries(4):
+            results = introspect_tokens([str(revoked), str(live), str(family), *access, 'garbage'])
+
+        self.assertEqual(results[0]['reason'], 'blacklisted')
+        self.assertTrue(all(result['active'] for result in results[1:-1]))
+        self.assertEqual(results[-1], {'active': False, 'reason': 'invalid'})
+
+    def test_staff_only(self):
+        token = str(RefreshToken.for_user(self.user))
+
+        self.assertEqual(self.introspect(self.user, [token]).status_code, 403)
+
+        response = self.introspect(self.admin, [token])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['results'][0]['active'])
+
+
+class FamilyRotationTests(TestCase):
+    """A family rotates one generation per refresh and is revoked when an already rotated token comes back"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email='family@example.com', password='S3cure-pass!')
+
+    def setUp(self):
+        patcher = mock.patch('accounts.tokens.rotation_backend', BACKENDS['family'])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.token = str(RefreshToken.for_user(self.user))
+
+    def rotate(self, raw_token):
+        token = RefreshToken(raw_token)
+        token.rotate()
+        return token
+
+    def family(self):
+        return TokenFamily.objects.get(pk=RefreshToken(self.token)[FAMILY_CLAIM])
+
+    def test_rotation(self):
+        rotated = self.rotate(self.token)
+
+        self.assertEqual(rotated[GENERATION_CLAIM], 1)
+        self.assertEqual(rotated[FAMILY_CLAIM], RefreshToken(self.token)[FAMILY_CLAIM])
+        self.assertEqual(self.rotate(str(rotated))[GENERATION_CLAIM], 2)
+        self.assertEqual(self.family().generation, 2)
+
+    def test_concurrent_refresh_within_grace(self):
+        first = self.rotate(self.token)
+        second = self.rotate(self.token)
+
+        self.assertEqual(second[GENERATION_CLAIM], first[GENERATION_CLAIM])
+        self.assertFalse(self.family().revoked)
+        # Either resulting token carries the session on
+        self.assertEqual(self.rotate(str(second))[GENERATION_CLAIM], 2)
+
+    def test_refresh_endpoint_within_grace(self):
+        for _ in range(2):
+            response = self.client.post('/api/auth/refresh/', {'refresh': self.token}, content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+
+    def test_reuse_after_grace_revokes(self):
+        self.rotate(self.token)
+        TokenFamily.objects.update(rotated_at=timezone.now() - timedelta(minutes=1))
+
+        with self.assertRaises(ReusedTokenError):
+            self.rotate(self.token)
+        self.assertTrue(self.family().revoked)
+
+    def test_reuse_of_older_generation_revokes(self):
+        self.rotate(str(self.rotate(self.token)))
+
+        with self.assertRaises(ReusedTokenError):
+            self.rotate(self.token)
+        self.assertTrue(self.family().revoked)
+
+    @override_settings(TOKEN_FAMILY_REUSE_GRACE=0)
+    def test_reuse_without_grace_revokes(self):
+        self.rotate(self.token)
+
+        with self.assertRaises(ReusedTokenError):
+            self.rotate(self.token)
+
+    def test_revoke(self):
+        RefreshToken(self.token).revoke()
+
+        self.assertTrue(self.family().revoked)
+        with self.assertRaises(BlacklistedTokenError) as raised:
+            self.rotate(self.token)
+        self.assertNotIsInstance(raised.exception, ReusedTokenError)
+
+
+class TokenVersionTests(TestCase):
+    """Tokens issued before a token_version bump stop working straight away"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email='version@example.com', password='S3cure-pass!')
+        self.refresh = CustomTokenObtainPairSerializer.get_token(self.user)
+        self.access = str(self.refresh.access_token)
+
+    def request(self, method, url, data=None, token=None):
+        return getattr(self.client, method)(
+            url, data, content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {token or self.access}',
+        )
+
+    def test_change_password_revokes_old_tokens(self):
+        response = self.request('post', '/api/auth/change-password/', {
+            'old_password': 'S3cure-pass!', 'new_password': 'N3w-secure-pass!',
+        })
+        self.assertEqual(response.status_code, 200)
+
+        refresh = self.client.post('/api/auth/refresh/', {'refresh': str(self.refresh)}, content_type='application/json')
+        self.assertEqual(refresh.status_code, 401)
+        self.assertEqual(self.request('post', '/api/auth/logout-all/').status_code, 401)
+
+        # The tokens issued with the change keep working
+        self.assertEqual(self.request('post', '/api/auth/logout-all/', token=response.data['access']).status_code, 200)
+
+    def test_write_checks_primary_not_cache(self):
+        # Cached by this process, then revoked by another one whose invalidation never arrives here
+        with override_settings(TOKEN_VERSION_CACHE_TTL=300):
+            self.assertEqual(get_token_version(self.user.pk), 0)
+            CustomUser.objects.filter(pk=self.user.pk).update(token_version=F('token_version') + 1)
+
+            self.assertEqual(self.request('patch', '/api/auth/profile/', {'first_name': 'X'}).status_code, 401)
+
+    def test_write_checks_version_of_loaded_row(self):
+        # SELECT of the user, whose token_version is checked without another query, and UPDATE
+        with self.assertNumQueries(2):
+            response = self.request('patch', '/api/auth/profile/', {'first_name': 'X'})
+
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(JWT_CHECK_TOKEN_VERSION_ON_ACCESS=True, TOKEN_VERSION_CACHE_TTL=0)
+    def test_read_rejected_when_checking_access(self):
+        self.assertEqual(self.request('get', '/api/auth/profile/').status_code, 200)
+
+        revoke_user_tokens(self.user)
+
+        self.assertEqual(self.request('get', '/api/auth/profile/').status_code, 401)
+
+
+class PasswordHashingPoolTests(SimpleTestCase):
+    """Hashes run in worker processes, overload is rejected, and the pool reports to /metrics"""
+
+    def sample(self, name, labels=None):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_inline_without_workers(self):
+        pool = PasswordHashingPool(workers=0, max_pending=1)
+
+        encoded = pool.make_password('S3cure-pass!')
+
+        self.assertEqual(pool.verify_password('S3cure-pass!', encoded), (True, False))
+        self.assertIsNone(pool._executor)
+
+    def test_hashes_in_worker_process(self):
+        pool = PasswordHashingPool(workers=1, max_pending=4)
+        completed = self.sample('auth_password_hashing_tasks_total', {'result': 'completed'})
+
+        encoded = pool.make_password('S3cure-pass!')
+        self.assertEqual(pool.verify_password('S3cure-pass!', encoded), (True, False))
+        self.assertEqual(pool.verify_password('wrong', encoded), (False, False))
+        pool._executor.shutdown()
+
+        self.assertEqual(self.sample('auth_password_hashing_tasks_total', {'result': 'completed'}), completed + 3)
+
+    def test_rejects_when_full(self):
+        pool = PasswordHashingPool(workers=1, max_pending=1)
+        executor = ThreadPoolExecutor(max_workers=1)
+        release = threading.Event()
+        rejected = self.sample('auth_password_hashing_tasks_total', {'result': 'rejected'})
+        in_flight = self.sample('auth_password_hashing_in_flight')
+
+        with mock.patch.object(pool, '_get_executor', return_value=executor):
+            running = pool._submit(release.wait)
+            self.assertEqual(self.sample('auth_password_hashing_in_flight'), in_flight + 1)
+
+            with self.assertRaises(HashingQueueFull):
+                pool.make_password('S3cure-pass!')
+
+            release.set()
+            running.result()
+            executor.shutdown()
+
+        self.assertEqual(self.sample('auth_password_hashing_tasks_total', {'result': 'rejected'}), rejected + 1)
+        self.assertEqual(self.sample('auth_password_hashing_in_flight'), in_flight)
+        self.assertIn(b'auth_password_hashing_seconds_count', generate_latest(REGISTRY))
+
+
+class PasswordHasherTests(TestCase):
+    """A changed hashing cost is applied on the next login, and calibrate_hashers edits env files in place"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.env_file = os.path.join(directory.name, '.env')
+
+    def read_env_file(self):
+        with open(self.env_file) as f:
+            return f.read()
+
+    def test_changed_iterations_rehash_on_login(self):
+        user = CustomUser.objects.create_user(email='hasher@example.com', password='S3cure-pass!')
+        iterations = CalibratedPBKDF2PasswordHasher.iterations + 10000
+
+        # As if the server restarted with a new PBKDF2_ITERATIONS
+        with mock.patch.object(CalibratedPBKDF2PasswordHasher, 'iterations', iterations):
+            self.assertTrue(CustomUser.objects.get(pk=user.pk).check_password('S3cure-pass!'))
+
+        user.refresh_from_db()
+        self.assertEqual(user.password.split('$')[:2], ['pbkdf2_sha256', str(iterations)])
+        self.assertTrue(user.check_password('S3cure-pass!'))
+
+    def test_write_env_file_replaces_existing_key(self):
+        with open(self.env_file, 'w') as f:
+            f.write('SECRET_KEY=abc\nPBKDF2_ITERATIONS=100000\nDEBUG=False\n')
+
+        write_env_file(self.env_file, {'PBKDF2_ITERATIONS': 600000})
+
+        self.assertEqual(self.read_env_file(), 'SECRET_KEY=abc\nPBKDF2_ITERATIONS=600000\nDEBUG=False\n')
+
+    def test_write_env_file_appends_missing_key(self):
+        with open(self.env_file, 'w') as f:
+            f.write('SECRET_KEY=abc\n')
+
+        write_env_file(self.env_file, {'PASSWORD_HASHER': 'scrypt', 'SCRYPT_WORK_FACTOR': 32768})
+
+        self.assertEqual(
+            self.read_env_file(),
+            'SECRET_KEY=abc\n\n# Password hashers (calibrate_hashers)\nPASSWORD_HASHER=scrypt\nSCRYPT_WORK_FACTOR=32768\n',
+        )
+
+    def test_calibrate_writes_env_file(self):
+        call_command('calibrate_hashers', hashers=['pbkdf2'], target_ms=20, samples=1,
+                     env_file=self.env_file, stdout=StringIO())
+
+        env = dict(line.split('=', 1) for line in self.read_env_file().splitlines() if '=' in line)
+        self.assertEqual(env['PASSWORD_HASHER'], 'pbkdf2')
+        self.assertGreaterEqual(int(env['PBKDF2_ITERATIONS']), 10000)
+
+
+class StatelessAuthTests(TestCase):
+    """Writes made with a user built from token claims leave the fields they don't change alone"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email='old@example.com', password='S3cure-pass!')
+        self.access = str(CustomTokenObtainPairSerializer.get_token(self.user).access_token)
+
+        # Changed after the token was issued, so its claims are now stale
+        CustomUser.objects.filter(pk=self.user.pk).update(email='current@example.com', is_email_verified=True)
+
+        for view in (profile_view, change_password_view, change_email_view):
+            patcher = mock.patch.object(view.cls, 'authentication_classes', [StatelessJWTAuthentication])
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def request(self, method, url, data):
+        return getattr(self.client, method)(
+            url, data, content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {self.access}',
+        )
+
+    def assertRowKept(self):
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.email, 'current@example.com')
+        self.assertTrue(self.user.is_email_verified)
+        self.assertTrue(self.user.is_active)
+
+    def test_profile_update(self):
+        response = self.request('patch', '/api/auth/profile/', {'first_name': 'New'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertRowKept()
+        self.assertEqual(self.user.first_name, 'New')
+
+    def test_change_password(self):
+        response = self.request('post', '/api/auth/change-password/', {
+            'old_password': 'S3cure-pass!', 'new_password': 'N3w-secure-pass!',
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertRowKept()
+        self.assertTrue(self.user.check_password('N3w-secure-pass!'))
+        # New tokens carry the current claims, not the ones from the old token
+        self.assertEqual(RefreshToken(response.data['refresh'])['email'], 'current@example.com')
+
+    def test_change_email(self):
+        response = self.request('post', '/api/auth/change-email/', {
+            'new_email': 'next@example.com', 'password': 'S3cure-pass!',
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertRowKept()
+        self.assertEqual(self.user.pending_email, 'next@example.com')
+
+
+class ActivityBufferTests(TestCase):
+    """Activity timestamps are merged per user and written in bulk, and survive a failed flush"""
+
+    def setUp(self):
+        self.users = [
+            CustomUser.objects.create_user(email=f'active{n}@example.com', password='S3cure-pass!') for n in range(2)
+        ]
+        self.buffer = ActivityBuffer(flush_interval=60, batch_size=500, max_size=1000)
+        # Flushed by hand here instead of from a thread
+        patcher = mock.patch.object(ActivityBuffer, '_start_flusher')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def last_login(self, user):
+        user.refresh_from_db(fields=['last_login'])
+        return user.last_login
+
+    def test_updates_to_one_user_are_merged(self):
+        first, second = self.users
+        earlier = timezone.now() - timedelta(minutes=1)
+        later = timezone.now()
+        self.buffer.record('last_login', first.pk, earlier)
+        self.buffer.record('last_login', first.pk, later)
+        self.buffer.record('last_login', second.pk, earlier)
+
+        with mock.patch.object(CustomUser.objects, 'bulk_update', wraps=CustomUser.objects.bulk_update) as bulk_update:
+            self.assertEqual(self.buffer.flush(), 2)
+
+        bulk_update.assert_called_once()
+        self.assertEqual(len(bulk_update.call_args.args[0]), 2)
+        self.assertEqual(self.last_login(first), later)
+        self.assertEqual(self.last_login(second), earlier)
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_failed_flush_requeues_without_replacing_newer(self):
+        first, second = self.users
+        earlier = timezone.now() - timedelta(minutes=1)
+        later = timezone.now()
+        self.buffer.record('last_login', first.pk, earlier)
+        self.buffer.record('last_login', second.pk, earlier)
+
+        def fail(*args, **kwargs):
+            # A request records newer activity while the failing flush runs
+            self.buffer.record('last_login', first.pk, later)
+            raise OperationalError('database is locked')
+
+        with mock.patch.object(CustomUser.objects, 'bulk_update', side_effect=fail), \
+                self.assertLogs('accounts.activity', 'ERROR'):
+            self.assertEqual(self.buffer.flush(), 0)
+
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(self.last_login(first), later)
+        self.assertEqual(self.last_login(second), earlier)
+
+    def test_zero_interval_writes_immediately(self):
+        buffer = ActivityBuffer(flush_interval=0, batch_size=500, max_size=1000)
+        now = timezone.now()
+
+        with self.assertNumQueries(1):
+            buffer.record('last_login', self.users[0].pk, now)
+
+        self.assertEqual(self.last_login(self.users[0]), now)
+        ActivityBuffer._start_flusher.assert_not_called()
+        self.assertEqual(buffer.flush(), 0)
+
+    def test_login_records_last_login(self):
+        with mock.patch('accounts.serializers.activity_buffer', self.buffer):
+            response = self.client.post('/api/auth/login/', {
+                'email': 'active0@example.com', 'password': 'S3cure-pass!',
+            }, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(self.last_login(self.users[0]))
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertIsNotNone(self.last_login(self.users[0]))
+
+
+class UserCacheTests(TestCase):
+    """Cached authentication reads a user once per process until any worker saves or deletes it"""
+
+    def setUp(self):
+        cache.clear()
+        user_cache.clear()
+        self.addCleanup(user_cache.clear)
+        self.user = CustomUser.objects.create_user(email='cached@example.com', password='S3cure-pass!')
+        self.access = str(CustomTokenObtainPairSerializer.get_token(self.user).access_token)
+
+    def authenticate(self):
+        request = RequestFactory().get('/api/auth/profile/', HTTP_AUTHORIZATION=f'Bearer {self.access}')
+        return CachedJWTAuthentication().authenticate(request)[0]
+
+    def test_hit_skips_database(self):
+        with self.assertNumQueries(1):
+            self.authenticate()
+        with self.assertNumQueries(0):
+            user = self.authenticate()
+
+        self.assertEqual(user.pk, self.user.pk)
+
+    def test_save_invalidates(self):
+        self.authenticate()
+
+        self.user.first_name = 'Changed'
+        self.user.save()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.authenticate().first_name, 'Changed')
+
+    def test_delete_invalidates(self):
+        self.authenticate()
+
+        self.user.delete()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_other_worker_entry_is_dropped(self):
+        other_worker = UserCache(max_size=10, ttl=300)
+        other_worker.get_or_load(self.user.pk, lambda: self.user)
+        self.assertIsNotNone(other_worker.get(self.user.pk))
+
+        # Only the shared version key changes, as when another process saves the user
+        user_cache.invalidate(self.user.pk)
+
+        self.assertIsNone(other_worker.get(self.user.pk))
+
+    def test_entry_expires_after_ttl(self):
+        local_cache = UserCache(max_size=10, ttl=60)
+        local_cache.get_or_load(self.user.pk, lambda: self.user)
+
+        with mock.patch('accounts.cache.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(local_cache.get(self.user.pk))
+
+    def test_least_recently_used_is_evicted(self):
+        local_cache = UserCache(max_size=2, ttl=300)
+        for user_id in (1, 2):
+            local_cache.get_or_load(user_id, lambda: CustomUser(pk=user_id))
+
+        local_cache.get(1)
+        local_cache.get_or_load(3, lambda: CustomUser(pk=3))
+
+        self.assertIsNone(local_cache.get(2))
+        self.assertEqual(local_cache.get(1).pk, 1)
+        self.assertEqual(local_cache.get(3).pk, 3)
+
+    def test_callers_get_a_copy(self):
+        user = self.authenticate()
+        user.first_name = 'Mutated'
+
+        cached = self.authenticate()
+
+        self.assertIsNot(cached, user)
+        self.assertEqual(cached.first_name, self.user.first_name)
+
+
+@override_settings(ROOT_URLCONF=AsyncURLConf)
+class AsyncViewTests(TestCase):
+    """The async views share the account operations with the sync views and hash off the database thread"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email='async@example.com', password='S3cure-pass!')
+        cls.access = str(CustomTokenObtainPairSerializer.get_token(cls.user).access_token)
+
+    def setUp(self):
+        cache.clear()
+
+    def post(self, url, data, **extra):
+        return self.async_client.post(url, data, content_type='application/json', **extra)
+
+    async def test_register_hashes_in_pool(self):
+        data = {'email': 'new@example.com', 'password': 'N3w-secure-pass!', 'first_name': 'New', 'last_name': 'User'}
+
+        # The blocking make_password would run on the thread that holds the database connection
+        with mock.patch.object(hashing_pool, 'make_password', side_effect=AssertionError('hashed on the sync thread')):
+            response = await self.post('/api/auth/register/', data)
+
+        self.assertEqual(response.status_code, 201)
+        user = await CustomUser.objects.aget(email='new@example.com')
+        self.assertTrue(await user.acheck_password('N3w-secure-pass!'))
+        self.assertTrue(await EmailOutbox.objects.filter(to_email='new@example.com').aexists())
+
+    async def test_register_verified_email_is_rejected(self):
+        await CustomUser.objects.filter(pk=self.user.pk).aupdate(is_email_verified=True)
+
+        response = await self.post('/api/auth/register/', {
+            'email': 'async@example.com', 'password': 'N3w-secure-pass!', 'first_name': 'A', 'last_name': 'B',
+        })
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['detail'], 'Email already exists')
+
+    async def test_non_object_body_is_rejected(self):
+        for body in ([], '"x"', '1'):
+            response = await self.post('/api/auth/verify-email/', body)
+
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['detail'], 'Expected a JSON object')
+
+    async def test_verify_email(self):
+        token = await sync_to_async(VerifyEmailToken.generate_token)(self.user, 'verify_email')
+
+        self.assertEqual((await self.post('/api/auth/verify-email/', {'token': token.token})).status_code, 200)
+        response = await self.post('/api/auth/verify-email/', {'token': token.token})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['detail'], 'Token expired or used')
+        await self.user.arefresh_from_db()
+        self.assertTrue(self.user.is_email_verified)
+
+    async def test_reset_password_confirm(self):
+        token = await sync_to_async(VerifyEmailToken.generate_token)(self.user, 'reset_password')
+
+        response = await self.post('/api/auth/reset-password-confirm/', {'token': token.token, 'password': 'N3w-secure-pass!'})
+
+        self.assertEqual(response.status_code, 200)
+        await self.user.arefresh_from_db()
+        self.assertTrue(await self.user.acheck_password('N3w-secure-pass!'))
+        self.assertEqual(self.user.token_version, 1)
+
+    async def test_change_email_confirm(self):
+        response = await self.post(
+            '/api/auth/change-email/', {'new_email': 'next@example.com', 'password': 'S3cure-pass!'},
+            headers={'Authorization': f'Bearer {self.access}'},
+        )
+        self.assertEqual(response.status_code, 200)
+
+        token = await VerifyEmailToken.objects.aget(user=self.user, token_type='change_email')
+        response = await self.post('/api/auth/change-email-confirm/', {'token': token.token})
+
+        self.assertEqual(response.status_code, 200)
+        await self.user.arefresh_from_db()
+        self.assertEqual(self.user.email, 'next@example.com')
+        self.assertIsNone(self.user.pending_email)
+
+    async def test_profile_requires_authentication(self):
+        response = await self.async_client.get('/api/auth/profile/')
+
+        self.assertEqual(response.status_code, 401)
+
+    async def test_profile(self):
+        response = await self.async_client.get('/api/auth/profile/', headers={'Authorization': f'Bearer {self.access}'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['email'], 'async@example.com')
+
+    async def test_invalid_json(self):
+        response = await self.async_client.post('/api/auth/verify-email/', b'{', content_type='application/json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['detail'], 'Invalid JSON')
+
+
+@override_settings(METRICS_AUTH_TOKEN='scrape-token')
+class MetricsTests(TestCase):
+    """The auth flows update their metrics, and /metrics serves them only to an authorized scraper"""
+
+    def setUp(self):
+        # Clears the cached token table counts as well
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email='metrics@example.com', password='S3cure-pass!')
+
+    def post(self, url, data, **extra):
+        return self.client.post(url, data, content_type='application/json', **extra)
+
+    def scrape(self):
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-token')
+        self.assertEqual(response.status_code, 200)
+        return {
+            (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+            for family in text_string_to_metric_families(response.content.decode())
+            for sample in family.samples
+        }
+
+    def test_requires_scraper_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+
+    @override_settings(METRICS_AUTH_TOKEN='')
+    def test_served_without_token_only_in_debug(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+        with self.settings(DEBUG=True):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_auth_flow_counters(self):
+        keys = {
+            'login_success': ('auth_logins_total', (('result', 'success'),)),
+            'login_failure': ('auth_logins_total', (('result', 'failure'),)),
+            'refresh': ('auth_token_refreshes_total', (('rotated', 'true'),)),
+            'blacklisted': ('auth_tokens_blacklisted_total', ()),
+            'invalid_access': ('auth_token_validation_failures_total', (('reason', 'invalid'), ('token', 'access'))),
+            'email_sent': ('auth_emails_total', (('result', 'sent'), ('template', 'verify_email'))),
+        }
+        blacklist_index.warm()
+        before = self.scrape()
+
+        with mock.patch.object(activity_buffer, 'record'):
+            self.assertEqual(self.post('/api/auth/login/', {'email': 'metrics@example.com', 'password': 'wrong'}).status_code, 401)
+            tokens = self.post('/api/auth/login/', {'email': 'metrics@example.com', 'password': 'S3cure-pass!'}).data
+        self.assertEqual(self.post('/api/auth/refresh/', {'refresh': tokens['refresh']}).status_code, 200)
+        self.assertEqual(self.client.get('/api/auth/profile/', HTTP_AUTHORIZATION='Bearer not-a-token').status_code, 401)
+        self.assertIs(deliver(enqueue_email('verify_email', 'metrics@example.com', 'Subject', 'Body').pk), True)
+
+        after = self.scrape()
+        changes = {name: after.get(key, 0) - before.get(key, 0) for name, key in keys.items()}
+        self.assertEqual(changes, {name: 1 for name in keys})
+
+    def test_token_table_gauge(self):
+        now = timezone.now()
+        for n, (expires_at, is_used) in enumerate([
+            (now + timedelta(hours=1), False),
+            (now + timedelta(hours=1), False),
+            (now - timedelta(hours=1), False),
+            (now + timedelta(hours=1), True),
+        ]):
+            VerifyEmailToken.objects.create(
+                user=self.user, token=f'gauge-{n}', token_type='verify_email', expires_at=expires_at, is_used=is_used,
+            )
+
+        samples = self.scrape()
+
+        self.assertEqual(
+            {state: samples[('auth_verify_email_tokens', (('state', state),))] for state in ('active', 'expired', 'used')},
+            {'active': 2, 'expired': 1, 'used': 1},
+        )
+
+
+@override_settings(DEFAULT_FROM_EMAIL='noreply@example.com', EMAIL_OUTBOX_MAX_ATTEMPTS=3)
+class OutboxTests(TestCase):
+    """Outbox messages are claimed once, retried with backoff and dead-lettered after the last attempt"""
+
+    def setUp(self):
+        self.message = enqueue_email('verify_email', 'to@example.com', 'Subject', 'Body')
+
+    def test_deliver_sends_once(self):
+        self.assertIs(deliver(self.message.pk), True)
+        self.assertIsNone(deliver(self.message.pk))
+
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, EmailOutbox.STATUS_SENT)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_leased_message_is_not_claimed(self):
+        EmailOutbox.objects.filter(pk=self.message.pk).update(
+            status=EmailOutbox.STATUS_SENDING,
+            attempts=1,
+            next_attempt_at=timezone.now() + timedelta(minutes=5),
+        )
+
+        self.assertIsNone(deliver(self.message.pk))
+        self.assertEqual(len(mail.outbox), 0)
+
+    @mock.patch('accounts.outbox.send_mail', side_effect=OSError('SMTP down'))
+    def test_failure_backs_off_then_dead_letters(self, send_mail):
+        with override_settings(EMAIL_OUTBOX_RETRY_BACKOFF=30):
+            self.assertIs(deliver(self.message.pk), False)
+
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, EmailOutbox.STATUS_PENDING)
+        self.assertGreater(self.message.next_attempt_at, timezone.now() + timedelta(seconds=25))
+        self.assertEqual(self.message.last_error, 'SMTP down')
+
+        # Not due yet
+        self.assertIsNone(deliver(self.message.pk))
+
+        for _ in range(2):
+            EmailOutbox.objects.filter(pk=self.message.pk).update(next_attempt_at=timezone.now())
+            self.assertIs(deliver(self.message.pk), False)
+
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, EmailOutbox.STATUS_FAILED)
+        self.assertEqual(self.message.attempts, 3)
+        self.assertEqual(send_mail.call_count, 3)
+
+    def test_expired_lease_is_recovered(self):
+        EmailOutbox.objects.filter(pk=self.message.pk).update(
+            status=EmailOutbox.STATUS_SENDING,
+            attempts=1,
+            next_attempt_at=timezone.now() - timedelta(seconds=1),
+        )
+
+        self.assertEqual(process_outbox(), (1, 0))
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, EmailOutbox.STATUS_SENT)
+        self.assertEqual(self.message.attempts, 2)
+
+    def test_expired_lease_on_last_attempt_is_dead_lettered(self):
+        EmailOutbox.objects.filter(pk=self.message.pk).update(
+            status=EmailOutbox.STATUS_SENDING,
+            attempts=3,
+            next_attempt_at=timezone.now() - timedelta(seconds=1),
+        )
+
+        self.assertIsNone(deliver(self.message.pk))
+        self.assertEqual(process_outbox(), (0, 0))
+
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, EmailOutbox.STATUS_FAILED)
+        self.assertEqual(self.message.attempts, 3)
+        self.assertEqual(len(mail.outbox), 0)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaRouterTests(SimpleTestCase):
+    databases = {'default'}
+
+    def setUp(self):
+        cache.clear()
+        reset_pin()
+        self.addCleanup(reset_pin)
+        self.router = ReplicaRouter()
+
+    def test_read_goes_to_replica(self):
+        self.assertEqual(self.router.db_for_read(CustomUser), 'replica1')
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_read_without_replicas_goes_to_primary(self):
+        self.assertEqual(self.router.db_for_read(CustomUser), 'default')
+
+    def test_read_after_write_is_pinned_to_primary(self):
+        self.assertEqual(self.router.db_for_write(CustomUser), 'default')
+
+        self.assertEqual(self.router.db_for_read(CustomUser), 'default')
+
+    def test_token_state_reads_from_primary(self):
+        self.assertEqual(self.router.db_for_read(TokenFamily), 'default')
+        self.assertEqual(self.router.db_for_read(OutstandingToken), 'default')
+
+    def test_read_in_transaction_goes_to_primary(self):
+        with transaction.atomic():
+            self.assertEqual(self.router.db_for_read(CustomUser), 'default')
+
+    def test_replicas_are_not_migrated(self):
+        self.assertFalse(self.router.allow_migrate('replica1', 'accounts'))
+        self.assertIsNone(self.router.allow_migrate('default', 'accounts'))
+
+    def test_pin_is_reset_per_request(self):
+        def view(request):
+            self.router.db_for_write(CustomUser)
+            return self.router.db_for_read(CustomUser)
+
+        middleware = PrimaryPinningMiddleware(view)
+        request = RequestFactory().get('/')
+
+        self.assertEqual(middleware(request), 'default')
+        self.assertFalse(pinned_to_primary.get())
+        self.assertEqual(self.router.db_for_read(CustomUser), 'replica1')
+
+    def request_as(self, user_id, write=False):
+        def view(request):
+            pin_for_user(user_id)
+            read = self.router.db_for_read(CustomUser)
+            if write:
+                self.router.db_for_write(CustomUser)
+            return read
+
+        return PrimaryPinningMiddleware(view)(RequestFactory().get('/'))
+
+    def test_user_reads_own_write_on_next_request(self):
+        self.assertEqual(self.request_as(1, write=True), 'replica1')
+
+        self.assertEqual(self.request_as(1), 'default')
+        # Other users are not affected
+        self.assertEqual(self.request_as(2), 'replica1')
+
+    def test_read_only_request_is_not_remembered(self):
+        self.request_as(1)
+
+        self.assertEqual(self.request_as(1), 'replica1')
+
+    @override_settings(DATABASE_PRIMARY_PIN_SECONDS=0)
+    def test_pin_window_disabled(self):
+        self.request_as(1, write=True)
+
+        self.assertEqual(self.request_as(1), 'replica1')
+
+    def test_authentication_pins_recent_writer(self):
+        self.request_as('1', write=True)
+        token = AccessToken()
+        token['user_id'] = '1'
+
+        JWTAuthentication().get_validated_token(str(token).encode())
+
+        self.assertTrue(pinned_to_primary.get())
+
+    async def test_async_request_remembers_write(self):
+        async def view(request):
+            pin_for_user(1)
+            self.router.db_for_write(CustomUser)
+            return None
+
+        await PrimaryPinningMiddleware(view)(AsyncRequestFactory().get('/'))
+
+        self.assertEqual(self.request_as(1), 'default')
+
+
+class TrafficCaptureTests(SimpleTestCase):
+    """Captured requests keep their shape for replay but none of the personal data"""
+
+    body = {
+        'email': 'jane@example.org', 'password': 'S3cure-pass!', 'first_name': 'Jane', 'last_name': 'Doe',
+        'phone': '+15551234567', 'tokens': ['abc.def.ghi'],
+    }
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.jsonl')
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+        patcher = override_settings(TRAFFIC_CAPTURE_RATE=1, TRAFFIC_CAPTURE_FILE=self.path)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+
+    def captured(self):
+        with open(self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def assertRedacted(self, record):
+        raw = json.dumps(record)
+        for value in ('jane', 'Jane', 'Doe', '5551234567', 'S3cure-pass!', 'abc.def.ghi', 'secret-ref'):
+            self.assertNotIn(value, raw)
+
+        body = record['body']
+        self.assertEqual(body['password'], REDACTED)
+        self.assertEqual(body['tokens'], [REDACTED])
+        self.assertTrue(body['email'].endswith('@example.com'))
+        self.assertLessEqual(len(body['phone']), 20)
+        self.assertEqual(record['query'].split('=')[0], 'ref')
+
+    def test_sync_capture(self):
+        middleware = TrafficCaptureMiddleware(lambda request: HttpResponse(status=201))
+        request = RequestFactory().post('/api/auth/register/?ref=secret-ref', self.body, content_type='application/json')
+
+        self.assertEqual(middleware(request).status_code, 201)
+
+        [record] = self.captured()
+        self.assertRedacted(record)
+        self.assertEqual(record['status'], 201)
+
+    async def test_async_capture(self):
+        async def get_response(request):
+            return HttpResponse(status=201)
+
+        middleware = TrafficCaptureMiddleware(get_response)
+        request = AsyncRequestFactory().post('/api/auth/register/?ref=secret-ref', self.body, content_type='application/json')
+
+        self.assertEqual((await middleware(request)).status_code, 201)
+
+        [record] = self.captured()
+        self.assertRedacted(record)
+
+    def test_pseudonyms_are_stable(self):
+        middleware = TrafficCaptureMiddleware(lambda request: HttpResponse())
+        for _ in range(2):
+            middleware(RequestFactory().post('/api/auth/register/', self.body, content_type='application/json'))
+
+        first, second = self.captured()
+        self.assertEqual(first['body'], second['body'])
+
+
+def generate_pem_key_pair():
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+
+    private_key = ec.generate_private_key(ec.SECP256R1())
+    private_pem = private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption(),
+    ).decode()
+    public_pem = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo,
+    ).decode()
+    return private_pem, public_pem
+
+
+class KeyRingTests(SimpleTestCase):
+    """Tokens are verified with the public key named by their kid, and every such key is published"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.old_private, cls.old_public = generate_pem_key_pair()
+        cls.new_private, cls.new_public = generate_pem_key_pair()
+
+    def backend(self, private_key, kid, verifying_keys):
+        return KeyRingTokenBackend('ES256', private_key, signing_key_id=kid, verifying_keys=verifying_keys)
+
+    def test_verifies_by_kid(self):
+        old = self.backend(self.old_private, 'old', {})
+        current = self.backend(self.new_private, 'new', {'old': self.old_public, 'new': self.new_public})
+
+        token = old.encode({'user_id': '1'})
+
+        self.assertEqual(jwt.get_unverified_header(token)['kid'], 'old')
+        self.assertEqual(current.decode(token)['user_id'], '1')
+        self.assertEqual(current.decode(current.encode({'user_id': '2'}))['user_id'], '2')
+
+    def test_rejects_retired_and_unknown_kid(self):
+        old = self.backend(self.old_private, 'old', {})
+        current = self.backend(self.new_private, 'new', {'new': self.new_public})
+
+        with self.assertRaises(TokenBackendError):
+            current.decode(old.encode({'user_id': '1'}))
+
+        # A token claiming a known kid but signed with another key
+        forged = jwt.encode({'user_id': '1'}, self.old_private, algorithm='ES256', headers={'kid': 'new'})
+        with self.assertRaises(TokenBackendError):
+            current.decode(forged)
+
+    def test_jwks_endpoint(self):
+        backend = self.backend(self.new_private, 'new', {'old': self.old_public, 'new': self.new_public})
+
+        with mock.patch('accounts.views.token_backend', backend):
+            response = self.client.get('/.well-known/jwks.json')
+            not_modified = self.client.get('/.well-known/jwks.json', headers={'If-None-Match': response['ETag']})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+        keys = json.loads(response.content)['keys']
+        self.assertEqual([key['kid'] for key in keys], ['new', 'old'])
+        self.assertTrue(all(key['alg'] == 'ES256' and 'd' not in key for key in keys))
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_jwks_is_empty_for_symmetric_signing(self):
+        response = self.client.get('/.well-known/jwks.json')
+
+        self.assertEqual(json.loads(response.content), {'keys': []})
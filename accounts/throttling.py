@@ -0,0 +1,68 @@
+"""
+Per-view rate limits keyed by client IP and by target email address.
+
+Both throttles are installed globally and look up their rate under
+"<url name>.ip" / "<url name>.email" in THROTTLE_RATES, so views without
+a configured rate are not throttled. History is kept in Django's cache
+(DRF's sliding window), which must be shared between workers in production.
+"""
+import hashlib
+from django.conf import settings
+from rest_framework.throttling import SimpleRateThrottle
+
+EMAIL_FIELDS = ('email', 'new_email')
+
+
+class ViewRateThrottle(SimpleRateThrottle):
+    """Sliding-window throttle whose scope is the view's URL name plus a key kind"""
+    kind = None
+
+    def __init__(self):
+        # The rate depends on the view, so it is looked up in allow_request()
+        pass
+
+    def get_rate(self):
+        return settings.THROTTLE_RATES.get(self.scope)
+
+    def allow_request(self, request, view):
+        match = request.resolver_match
+        self.scope = f'{match.url_name}.{self.kind}' if match else None
+        self.rate = self.get_rate()
+        if self.rate is None:
+            return True
+
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        return super().allow_request(request, view)
+
+    def cache_key(self, ident):
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+
+class IPRateThrottle(ViewRateThrottle):
+    kind = 'ip'
+
+    def get_cache_key(self, request, view):
+        return self.cache_key(self.get_ident(request))
+
+
+class EmailRateThrottle(ViewRateThrottle):
+    """Limits requests naming the same email address, whichever IPs they come from"""
+    kind = 'email'
+
+    def get_cache_key(self, request, view):
+        data = getattr(request, 'data', None)
+        if not isinstance(data, dict):
+            return None
+
+        for field in EMAIL_FIELDS:
+            email = data.get(field)
+            if email and isinstance(email, str):
+                return self.cache_key(hashlib.sha256(email.strip().lower().encode()).hexdigest())
+        return None
+
+
+def check_throttles(request):
+    """Apply the throttles outside DRF (async views); returns the seconds to wait, or None if allowed"""
+    throttles = (IPRateThrottle(), EmailRateThrottle())
+    waits = [throttle.wait() or 0 for throttle in throttles if not throttle.allow_request(request, None)]
+    return max(waits) if waits else None
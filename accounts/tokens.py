@@ -0,0 +1,125 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import ExpiredTokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken as BaseAccessToken, BlacklistMixin, \
+    RefreshToken as BaseRefreshToken
+from .blacklist import blacklist_index
+from .cache import user_cache
+from .keys import token_backend
+from .models import CustomUser
+from .rotation import FAMILY_CLAIM, GENERATION_CLAIM, BlacklistedTokenError, ReusedTokenError, backend_for, \
+    rotation_backend
+from core.metrics import TOKENS_BLACKLISTED
+
+TOKEN_VERSION_CLAIM = 'token_version'
+
+
+class AccessToken(BaseAccessToken):
+    """Access token signed and verified with the key ring backend"""
+    _token_backend = token_backend
+
+
+class RefreshToken(BaseRefreshToken):
+    """Refresh token issued, checked, rotated and revoked through the rotation backends"""
+    access_token_class = AccessToken
+    _token_backend = token_backend
+    no_copy_claims = BaseRefreshToken.no_copy_claims + (FAMILY_CLAIM, GENERATION_CLAIM)
+
+    @classmethod
+    def for_user(cls, user):
+        # Skip BlacklistMixin.for_user, the rotation backend records the token
+        token = super(BlacklistMixin, cls).for_user(user)
+        rotation_backend.issue(token)
+        return token
+
+    def check_blacklist(self):
+        backend_for(self).check(self)
+
+    def rotate(self):
+        """Replace this token with the next one of its session, retiring this one"""
+        backend = backend_for(self)
+        if backend is rotation_backend:
+            backend.rotate(self)
+        else:
+            # Issued before a TOKEN_ROTATION change: retire it and carry on under the current backend
+            backend.revoke(self)
+            self.payload.pop(FAMILY_CLAIM, None)
+            self.payload.pop(GENERATION_CLAIM, None)
+            self.renew()
+            rotation_backend.issue(self)
+
+    def revoke(self):
+        """End the session this token belongs to (logout)"""
+        backend_for(self).revoke(self)
+
+    def renew(self):
+        self.set_jti()
+        self.set_exp()
+        self.set_iat()
+
+    def blacklist(self):
+        result = super().blacklist()
+        blacklist_index.add(self.payload[api_settings.JTI_CLAIM])
+
+        _, created = result
+        if created:
+            TOKENS_BLACKLISTED.inc()
+        return result
+
+
+def token_error_reason(error):
+    """Short reason for a TokenError, used as a metrics label"""
+    if isinstance(error, ExpiredTokenError):
+        return 'expired'
+    if isinstance(error, ReusedTokenError):
+        return 'reused'
+    if isinstance(error, BlacklistedTokenError):
+        return 'blacklisted'
+    return 'invalid'
+
+
+def get_token_version(user_id, cached=True):
+    """Return the user's current token_version, or None if the user does not exist"""
+    key = _token_version_key(user_id)
+    use_cache = cached and settings.TOKEN_VERSION_CACHE_TTL > 0
+
+    if use_cache:
+        version = cache.get(key)
+        if version is not None:
+            return version
+
+    # Read from the primary: a lagging replica would still return the version before a revocation
+    version = CustomUser.objects.using(DEFAULT_DB_ALIAS).filter(pk=user_id).values_list(
+        'token_version', flat=True,
+    ).first()
+
+    if use_cache and version is not None:
+        # add() rather than set(), so a version read before a revocation never replaces a newer entry
+        cache.add(key, version, settings.TOKEN_VERSION_CACHE_TTL)
+
+    return version
+
+
+def forget_token_version(user_id):
+    key = _token_version_key(user_id)
+    cache.delete(key)
+    # A lookup racing the revoking transaction may have cached the old version again
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def revoke_user_tokens(user):
+    """Invalidate every access and refresh token issued to the user with a single UPDATE"""
+    CustomUser.objects.filter(pk=user.pk).update(token_version=F('token_version') + 1)
+    user.refresh_from_db(fields=['token_version'])
+
+    # update() skips post_save, so clear the cached copies here
+    user_cache.invalidate(user.pk)
+    forget_token_version(user.pk)
+
+
+def _token_version_key(user_id):
+    return f"token_version:{user_id}"
@@ -17,4 +17,8 @@ urlpatterns = [
     path('change-email-confirm/', views.change_email_confirm_view, name='change_email_confirm'),
     path('change-email-cancel/', views.change_email_cancel_view, name='change_email_cancel'),
     path('logout/', views.logout_view, name='logout'),
+    path('logout-all/', views.logout_all_view, name='logout_all'),
+
+    # Batch token introspection (staff only)
+    path('introspect/', views.introspect_view, name='introspect'),
 ]
\ No newline at end of file
@@ -1,27 +1,164 @@
+"""
+Account operations shared by the sync views and the async views.
+
+Each function is one unit of database work and runs in its own transaction.
+Password hashing is left to the caller, so async callers can await it in
+the hashing pool instead of blocking the thread that runs these.
+"""
 import logging
+from contextlib import contextmanager
+from django.db import transaction
+from django.db.models import F
 from .models import CustomUser, VerifyEmailToken
-from core.email import send_verification_email
+from core.email import send_verification_email, send_email_change_verification, send_email_change_notification
 
 logger = logging.getLogger(__name__)
 
 
-def register(email, password, first_name, last_name, phone=''):
-    """Create new user account"""
-    if CustomUser.objects.filter(email=email).exists():
-        raise Exception("Email already exists")
-
-    user = CustomUser.objects.create_user(
-        email=email,
-        password=password,
+def register(email, encoded_password, first_name, last_name, phone=''):
+    """Create new user account with an already hashed password, raising IntegrityError if the email is taken"""
+    user = CustomUser(
+        email=CustomUser.objects.normalize_email(email),
+        password=encoded_password,
         first_name=first_name,
         last_name=last_name,
         phone=phone,
         is_active=True,
         is_email_verified=False
     )
+    claimed = False
 
-    token = VerifyEmailToken.generate_token(user, 'verify_email')
-    send_verification_email(user, token)
+    try:
+        with transaction.atomic():
+            user.save()
+
+            # Claim the resend interval so an immediate retry of the registration sends nothing more
+            claimed = VerifyEmailToken.claim_send(user, 'verify_email')
+            token = VerifyEmailToken.generate_token(user, 'verify_email', reuse=False)
+            send_verification_email(user, token)
+    except Exception:
+        # The cache is not part of the transaction, so undo the claim by hand
+        if claimed:
+            VerifyEmailToken.release_send(user, 'verify_email')
+        raise
 
     logger.info(f"Registration successful: {email}")
-    return user
\ No newline at end of file
+    return user
+
+
+def send_token_email(user, token_type, send_email):
+    """Generate a token and email it unless one was just sent, returning whether an email went out"""
+    if not VerifyEmailToken.claim_send(user, token_type):
+        return False
+
+    try:
+        with transaction.atomic():
+            token = VerifyEmailToken.generate_token(user, token_type)
+            send_email(user, token)
+    except Exception:
+        # Nothing was sent, so don't hold off a retry for the resend interval
+        VerifyEmailToken.release_send(user, token_type)
+        raise
+    return True
+
+
+@contextmanager
+def _consumed_token(token_string, token_type):
+    """Consume a token in a new transaction, handing it back if the transaction rolls back"""
+    token = None
+    try:
+        with transaction.atomic():
+            token = VerifyEmailToken.consume_token(token_string, token_type)
+            yield token
+    except Exception:
+        # A failed update must not burn the link
+        if token is not None:
+            VerifyEmailToken.release_token(token)
+        raise
+
+
+def verify_email(token_string):
+    """Mark the token's user as verified, returning None if the token is expired or used"""
+    with _consumed_token(token_string, 'verify_email') as token:
+        if token is None:
+            return None
+
+        user = token.user
+        user.is_email_verified = True
+        user.save(update_fields=['is_email_verified'])
+        return user
+
+
+def reset_password(token_string, encoded_password):
+    """Set an already hashed password from a reset token, returning None if the token is expired or used"""
+    with _consumed_token(token_string, 'reset_password') as token:
+        if token is None:
+            return None
+
+        user = token.user
+        user.password = encoded_password
+        # Revoke every token issued before the reset
+        user.token_version = F('token_version') + 1
+        user.save(update_fields=['password', 'token_version'])
+        return user
+
+
+def request_email_change(user, new_email):
+    """Record the pending email and send the change emails, returning False for a repeat of a recent request"""
+    # A repeat of a request just made for the same address has nothing left to do
+    if not VerifyEmailToken.claim_send(user, 'change_email', new_email):
+        return False
+
+    try:
+        with transaction.atomic():
+            # Invalidate change_email tokens for other addresses; one for this address is reused
+            VerifyEmailToken.objects.filter(
+                user=user,
+                token_type='change_email'
+            ).exclude(new_email=new_email).update(is_used=True)
+
+            # Update pending email
+            user.pending_email = new_email
+            user.save(update_fields=['pending_email'])
+
+            token = VerifyEmailToken.generate_token(user, 'change_email', new_email=new_email)
+
+            # Send verification email to NEW address and notification to OLD address
+            send_email_change_verification(user, token, new_email)
+            send_email_change_notification(user, new_email, token)
+    except Exception:
+        # Nothing was sent, so don't hold off a retry for the resend interval
+        VerifyEmailToken.release_send(user, 'change_email', new_email)
+        raise
+    return True
+
+
+def confirm_email_change(token_string):
+    """Switch the token's user to the new email, returning None if the token is expired or used"""
+    with _consumed_token(token_string, 'change_email') as token:
+        if token is None:
+            return None
+
+        user = token.user
+        user.email = token.new_email
+        user.pending_email = None
+        user.save(update_fields=['email', 'pending_email'])
+        return user
+
+
+def cancel_email_change(token_string):
+    """Invalidate every pending email change of the token's user, raising if the token is invalid"""
+    user = VerifyEmailToken.get_token(token_string, 'change_email').user
+
+    with transaction.atomic():
+        # Invalidate all change_email tokens for this user
+        VerifyEmailToken.objects.filter(
+            user=user,
+            token_type='change_email'
+        ).update(is_used=True)
+
+        # Clear pending email
+        user.pending_email = None
+        user.save(update_fields=['pending_email'])
+
+    return user
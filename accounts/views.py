@@ -1,20 +1,30 @@
-from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework_simplejwt.tokens import RefreshToken
+from django.conf import settings
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
-from .models import CustomUser, VerifyEmailToken
-from .utils import register
-from .serializers import RegisterUserSerializer, UserProfileSerializer
-from core.email import send_verification_email, send_password_reset_email, send_email_change_verification, \
-    send_email_change_notification
+from django.db import IntegrityError
+from django.db.models import F
+from django.http import HttpResponse, HttpResponseNotModified
+from .hashing import HashingQueueFull, hashing_pool
+from .introspection import introspect_tokens
+from .keys import token_backend
+from .models import CustomUser
+from .tokens import RefreshToken, revoke_user_tokens
+from .utils import register, send_token_email, verify_email, reset_password, request_email_change, \
+    confirm_email_change, cancel_email_change
+from .serializers import RegisterUserSerializer, UserProfileSerializer, CustomTokenObtainPairSerializer, \
+    IntrospectionSerializer
+from core.email import send_verification_email, send_password_reset_email
+from core.timing import query_budget
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+@query_budget(5)
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def register_view(request):
@@ -30,42 +40,44 @@ def register_view(request):
     email = serializer.validated_data['email']
 
     try:
-        # Check if user already exists
-        existing_user = CustomUser.objects.filter(email=email).first()
-
-        if existing_user:
-            # If email already verified, return error
-            if existing_user.is_email_verified:
-                return Response(
-                    {'detail': 'Email already exists'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+        # Insert straight away and let the unique constraint on email detect existing accounts. Duplicate
+        # registrations pay for a hash, which the per-email and per-IP register throttles bound
+        try:
+            register(
+                email=email,
+                encoded_password=hashing_pool.make_password(serializer.validated_data['password']),
+                first_name=serializer.validated_data['first_name'],
+                last_name=serializer.validated_data['last_name'],
+                phone=serializer.validated_data.get('phone', '')
+            )
 
-            # If email not verified, resend verification email
-            token = VerifyEmailToken.generate_token(existing_user, 'verify_email')
-            send_verification_email(existing_user, token)
+            return Response(
+                {'detail': 'Registration successful'},
+                status=status.HTTP_201_CREATED
+            )
 
-            logger.info(f"Verification email resent: {email}")
+        except IntegrityError:
+            existing_user = CustomUser.objects.get(email=CustomUser.objects.normalize_email(email))
 
+        # If email already verified, return error
+        if existing_user.is_email_verified:
             return Response(
-                {'detail': 'Verification email sent'},
-                status=status.HTTP_200_OK
+                {'detail': 'Email already exists'},
+                status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Create new user
-        user = register(
-            email=email,
-            password=serializer.validated_data['password'],
-            first_name=serializer.validated_data['first_name'],
-            last_name=serializer.validated_data['last_name'],
-            phone=serializer.validated_data.get('phone', '')
-        )
+        # If email not verified, resend verification email unless one was just sent
+        if send_token_email(existing_user, 'verify_email', send_verification_email):
+            logger.info(f"Verification email resent: {email}")
 
         return Response(
-            {'detail': 'Registration successful'},
-            status=status.HTTP_201_CREATED
+            {'detail': 'Verification email sent'},
+            status=status.HTTP_200_OK
         )
 
+    except HashingQueueFull:
+        # Let DRF answer 503 instead of reporting a failed request
+        raise
     except Exception as e:
         logger.error(f"Registration failed: {str(e)}")
         return Response(
@@ -74,6 +86,7 @@ def register_view(request):
         )
 
 
+@query_budget(3)
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def verify_email_view(request):
@@ -87,21 +100,14 @@ def verify_email_view(request):
         )
 
     try:
-        token = VerifyEmailToken.objects.get(token=token_string, token_type='verify_email')
+        user = verify_email(token_string)
 
-        if not token.is_valid():
+        if user is None:
             return Response(
                 {'detail': 'Token expired or used'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        user = token.user
-        user.is_email_verified = True
-        user.save()
-
-        token.is_used = True
-        token.save()
-
         logger.info(f"Email verification successful: {user.email}")
 
         return Response(
@@ -117,6 +123,7 @@ def verify_email_view(request):
         )
 
 
+@query_budget(4)
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def reset_password_view(request):
@@ -132,11 +139,9 @@ def reset_password_view(request):
     try:
         user = CustomUser.objects.get(email=email)
 
-        # Generate reset token
-        token = VerifyEmailToken.generate_token(user, 'reset_password')
-        send_password_reset_email(user, token)
-
-        logger.info(f"Password reset email sent: {email}")
+        # Generate reset token unless an email was just sent
+        if send_token_email(user, 'reset_password', send_password_reset_email):
+            logger.info(f"Password reset email sent: {email}")
 
         return Response(
             {'detail': 'Password reset email sent'},
@@ -152,6 +157,7 @@ def reset_password_view(request):
         )
 
 
+@query_budget(3)
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def reset_password_confirm_view(request):
@@ -169,21 +175,15 @@ def reset_password_confirm_view(request):
         # Validate password strength
         validate_password(password)
 
-        token = VerifyEmailToken.objects.get(token=token_string, token_type='reset_password')
+        # Hash before the transaction so it isn't held open for the hash
+        user = reset_password(token_string, hashing_pool.make_password(password))
 
-        if not token.is_valid():
+        if user is None:
             return Response(
                 {'detail': 'Token expired or used'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        user = token.user
-        user.set_password(password)
-        user.save()
-
-        token.is_used = True
-        token.save()
-
         logger.info(f"Password reset successful: {user.email}")
 
         return Response(
@@ -196,6 +196,8 @@ def reset_password_confirm_view(request):
             {'detail': e.messages},
             status=status.HTTP_400_BAD_REQUEST
         )
+    except HashingQueueFull:
+        raise
     except Exception as e:
         logger.error(f"Password reset confirmation failed: {str(e)}")
         return Response(
@@ -259,6 +261,7 @@ def profile_view(request):
         )
 
 
+@query_budget(5)
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def change_password_view(request):
@@ -286,12 +289,22 @@ def change_password_view(request):
         validate_password(new_password, user)
 
         user.set_password(new_password)
-        user.save()
+        # Revoke every existing session and issue new tokens for this one
+        user.token_version = F('token_version') + 1
+        user.save(update_fields=['password', 'token_version'])
+        # The new tokens embed the user claims, which may be stale when request.user came from a token
+        user.refresh_from_db(fields=['token_version', *settings.JWT_USER_CLAIMS])
+
+        refresh = CustomTokenObtainPairSerializer.get_token(user)
 
         logger.info(f"Password change successful: {user.email}")
 
         return Response(
-            {'detail': 'Password change successful'},
+            {
+                'detail': 'Password change successful',
+                'refresh': str(refresh),
+                'access': str(refresh.access_token),
+            },
             status=status.HTTP_200_OK
         )
 
@@ -300,6 +313,8 @@ def change_password_view(request):
             {'detail': e.messages},
             status=status.HTTP_400_BAD_REQUEST
         )
+    except HashingQueueFull:
+        raise
     except Exception as e:
         logger.error(f"Password change failed: {str(e)}")
         return Response(
@@ -345,32 +360,17 @@ def change_email_view(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Invalidate all existing change_email tokens for this user
-        VerifyEmailToken.objects.filter(
-            user=user,
-            token_type='change_email'
-        ).update(is_used=True)
-
-        # Update pending email
-        user.pending_email = new_email
-        user.save()
-
-        # Generate new token
-        token = VerifyEmailToken.generate_token(user, 'change_email', new_email=new_email)
-
-        # Send verification email to NEW address
-        send_email_change_verification(user, token, new_email)
-
-        # Send notification to OLD address
-        send_email_change_notification(user, new_email, token)
-
-        logger.info(f"Email change requested: {user.email} -> {new_email}")
+        # A repeat of a request just made for the same address has nothing left to do
+        if request_email_change(user, new_email):
+            logger.info(f"Email change requested: {user.email} -> {new_email}")
 
         return Response(
             {'detail': 'Verification email sent to new address'},
             status=status.HTTP_200_OK
         )
 
+    except HashingQueueFull:
+        raise
     except Exception as e:
         logger.error(f"Email change request failed: {str(e)}")
         return Response(
@@ -379,6 +379,7 @@ def change_email_view(request):
         )
 
 
+@query_budget(3)
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def change_email_confirm_view(request):
@@ -392,27 +393,15 @@ def change_email_confirm_view(request):
         )
 
     try:
-        token = VerifyEmailToken.objects.get(token=token_string, token_type='change_email')
+        user = confirm_email_change(token_string)
 
-        if not token.is_valid():
+        if user is None:
             return Response(
                 {'detail': 'Token expired or used'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        user = token.user
-        new_email = token.new_email
-
-        # Update email
-        user.email = new_email
-        user.pending_email = None
-        user.save()
-
-        # Mark token as used
-        token.is_used = True
-        token.save()
-
-        logger.info(f"Email change successful: {new_email}")
+        logger.info(f"Email change successful: {user.email}")
 
         return Response(
             {'detail': 'Email change successful'},
@@ -440,19 +429,7 @@ def change_email_cancel_view(request):
         )
 
     try:
-        token = VerifyEmailToken.objects.get(token=token_string, token_type='change_email')
-
-        user = token.user
-
-        # Invalidate all change_email tokens for this user
-        VerifyEmailToken.objects.filter(
-            user=user,
-            token_type='change_email'
-        ).update(is_used=True)
-
-        # Clear pending email
-        user.pending_email = None
-        user.save()
+        user = cancel_email_change(token_string)
 
         logger.info(f"Email change cancelled: {user.email}")
 
@@ -483,7 +460,7 @@ def logout_view(request):
 
     try:
         token = RefreshToken(refresh_token)
-        token.blacklist()
+        token.revoke()
 
         logger.info(f"Logout successful: {request.user.email}")
 
@@ -497,4 +474,70 @@ def logout_view(request):
         return Response(
             {'detail': 'Logout failed'},
             status=status.HTTP_400_BAD_REQUEST
-        )
\ No newline at end of file
+        )
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def logout_all_view(request):
+    """Logout user from every session by revoking all issued tokens"""
+    try:
+        revoke_user_tokens(request.user)
+
+        logger.info(f"Logout from all sessions successful: {request.user.email}")
+
+        return Response(
+            {'detail': 'Logout successful'},
+            status=status.HTTP_200_OK
+        )
+
+    except Exception as e:
+        logger.error(f"Logout from all sessions failed: {str(e)}")
+        return Response(
+            {'detail': 'Logout failed'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def introspect_view(request):
+    """Report validity, claims, blacklist status and expiry for a batch of access and refresh tokens"""
+    serializer = IntrospectionSerializer(data=request.data)
+
+    if not serializer.is_valid():
+        return Response(
+            {'detail': serializer.errors},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        results = introspect_tokens(serializer.validated_data['tokens'])
+
+        return Response(
+            {'results': results},
+            status=status.HTTP_200_OK
+        )
+
+    except Exception as e:
+        logger.error(f"Token introspection failed: {str(e)}")
+        return Response(
+            {'detail': 'Token introspection failed'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+
+@api_view(['GET'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def jwks_view(request):
+    """Publish the public keys tokens are verified with, for offline verification by other services"""
+    etag = token_backend.jwks_etag
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(token_backend.jwks, content_type='application/json')
+
+    response['ETag'] = etag
+    response['Cache-Control'] = f'public, max-age={settings.JWKS_MAX_AGE}'
+    return response
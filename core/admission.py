@@ -0,0 +1,62 @@
+"""
+Admission control for expensive endpoints.
+
+AdmissionControlMiddleware caps how many requests to the views and methods
+named in ADMISSION_CONTROL_VIEWS (the password hashing ones) run at once in
+this process. Requests beyond ADMISSION_CONTROL_MAX_CONCURRENT are answered
+straight away with 503 and a Retry-After header instead of queueing behind
+the hashes until the client or proxy times out.
+"""
+import threading
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import JsonResponse
+
+
+class AdmissionControlMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if settings.ADMISSION_CONTROL_MAX_CONCURRENT <= 0:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.slots = threading.BoundedSemaphore(settings.ADMISSION_CONTROL_MAX_CONCURRENT)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        try:
+            return self.get_response(request)
+        finally:
+            self.release(request)
+
+    async def __acall__(self, request):
+        try:
+            return await self.get_response(request)
+        finally:
+            self.release(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method not in settings.ADMISSION_CONTROL_VIEWS.get(request.resolver_match.url_name, ()):
+            return None
+
+        if not self.slots.acquire(blocking=False):
+            response = JsonResponse(
+                {'detail': 'Server is busy, please try again shortly'},
+                status=503,
+            )
+            response['Retry-After'] = str(settings.ADMISSION_CONTROL_RETRY_AFTER)
+            return response
+
+        request.admission_slot = True
+        return None
+
+    def release(self, request):
+        if getattr(request, 'admission_slot', False):
+            request.admission_slot = False
+            self.slots.release()
@@ -14,3 +14,10 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 application = get_asgi_application()
+
+# Build per-process indexes before serving, then close the connection in case the server forks workers
+from django.db import connections  # noqa: E402
+from accounts.blacklist import blacklist_index  # noqa: E402
+
+blacklist_index.warm()
+connections.close_all()
@@ -0,0 +1,127 @@
+"""
+Read-replica routing.
+
+ReplicaRouter sends reads to a random alias in DATABASE_REPLICAS and all
+writes to "default". Once a request (or any other context) has written,
+its later reads are pinned to the primary too, so a client never reads
+its own write back from a replica that has not caught up yet. Reads in a
+transaction and reads of the models in DATABASE_PRIMARY_MODELS (token
+state that has to be current) always go to the primary.
+
+PrimaryPinningMiddleware clears the pin at the start of each request. When
+a request authenticated as a user has written, the user is remembered in
+the default cache for DATABASE_PRIMARY_PIN_SECONDS, and that user's
+following requests are pinned from the moment they are authenticated, so
+the next request reads the write back from the primary as well. This
+needs a cache shared by the workers to follow a client across them.
+
+Outside requests nothing clears the pin: a background thread (the email
+outbox dispatcher, the activity flusher) reads from the primary for the
+rest of its life once it has written.
+"""
+import random
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections
+
+pinned_to_primary = ContextVar('pinned_to_primary', default=False)
+# Id of the user the current request is authenticated as, if any
+pinning_user_id = ContextVar('pinning_user_id', default=None)
+
+
+def pin_to_primary():
+    pinned_to_primary.set(True)
+
+
+def reset_pin():
+    pinned_to_primary.set(False)
+    pinning_user_id.set(None)
+
+
+def pin_for_user(user_id):
+    """Record the request's user, pinning it to the primary if that user wrote in the last few seconds"""
+    if not settings.DATABASE_REPLICAS:
+        return
+
+    pinning_user_id.set(user_id)
+    if not pinned_to_primary.get() and cache.get(_user_pin_key(user_id)):
+        pin_to_primary()
+
+
+def _written_user_id():
+    # The user whose next requests must read this request's writes back
+    if pinned_to_primary.get() and settings.DATABASE_PRIMARY_PIN_SECONDS > 0:
+        return pinning_user_id.get()
+    return None
+
+
+def _user_pin_key(user_id):
+    return f'db_primary_pin:{user_id}'
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas or pinned_to_primary.get():
+            return DEFAULT_DB_ALIAS
+        if model._meta.label_lower in settings.DATABASE_PRIMARY_MODELS:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class PrimaryPinningMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        # Worker threads serve many requests, so a pin must not outlive its request
+        reset_pin()
+        try:
+            return self.get_response(request)
+        finally:
+            user_id = _written_user_id()
+            if user_id is not None:
+                cache.set(_user_pin_key(user_id), True, settings.DATABASE_PRIMARY_PIN_SECONDS)
+            reset_pin()
+
+    async def __acall__(self, request):
+        reset_pin()
+        try:
+            return await self.get_response(request)
+        finally:
+            user_id = _written_user_id()
+            if user_id is not None:
+                await cache.aset(_user_pin_key(user_id), True, settings.DATABASE_PRIMARY_PIN_SECONDS)
+            reset_pin()
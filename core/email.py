@@ -1,6 +1,7 @@
 import logging
-from django.core.mail import send_mail
 from django.conf import settings
+from accounts.outbox import enqueue_email
+from .timing import timed
 from .email_templates import (
     email_verification_template,
     password_reset_template,
@@ -11,6 +12,7 @@ from .email_templates import (
 logger = logging.getLogger(__name__)
 
 
+@timed('email')
 def send_verification_email(user, token):
     """Send email verification to user"""
     verification_url = f"{settings.FRONTEND_URL}/verify-email?token={token.token}"
@@ -19,11 +21,11 @@ def send_verification_email(user, token):
     text_content = f"Please verify your email: {verification_url}"
     html_content = email_verification_template(user, verification_url)
 
-    from_email = settings.DEFAULT_FROM_EMAIL
-    send_mail(subject, text_content, from_email, [user.email], html_message=html_content)
-    logger.info(f"Verification email sent: {user.email}")
+    enqueue_email('verify_email', user.email, subject, text_content, html_content)
+    logger.info(f"Verification email queued: {user.email}")
 
 
+@timed('email')
 def send_password_reset_email(user, token):
     """Send password reset email to user"""
     reset_url = f"{settings.FRONTEND_URL}/reset-password?token={token.token}"
@@ -32,11 +34,11 @@ def send_password_reset_email(user, token):
     text_content = f"Reset your password: {reset_url}"
     html_content = password_reset_template(user, reset_url)
 
-    from_email = settings.DEFAULT_FROM_EMAIL
-    send_mail(subject, text_content, from_email, [user.email], html_message=html_content)
-    logger.info(f"Password reset email sent: {user.email}")
+    enqueue_email('reset_password', user.email, subject, text_content, html_content)
+    logger.info(f"Password reset email queued: {user.email}")
 
 
+@timed('email')
 def send_email_change_verification(user, token, new_email):
     """Send email change verification to NEW email address"""
     verification_url = f"{settings.FRONTEND_URL}/change-email-confirm?token={token.token}"
@@ -45,11 +47,11 @@ def send_email_change_verification(user, token, new_email):
     text_content = f"Confirm your email change: {verification_url}"
     html_content = email_change_verification_template(user, new_email, verification_url)
 
-    from_email = settings.DEFAULT_FROM_EMAIL
-    send_mail(subject, text_content, from_email, [new_email], html_message=html_content)
-    logger.info(f"Email change verification sent: {new_email}")
+    enqueue_email('change_email_verification', new_email, subject, text_content, html_content)
+    logger.info(f"Email change verification queued: {new_email}")
 
 
+@timed('email')
 def send_email_change_notification(user, new_email, token):
     """Send email change notification to OLD email address"""
     cancel_url = f"{settings.FRONTEND_URL}/change-email-cancel?token={token.token}"
@@ -58,6 +60,5 @@ def send_email_change_notification(user, new_email, token):
     text_content = f"Email change requested to {new_email}. Cancel here: {cancel_url}"
     html_content = email_change_notification_template(user, new_email, cancel_url)
 
-    from_email = settings.DEFAULT_FROM_EMAIL
-    send_mail(subject, text_content, from_email, [user.email], html_message=html_content)
-    logger.info(f"Email change notification sent: {user.email}")
\ No newline at end of file
+    enqueue_email('change_email_notification', user.email, subject, text_content, html_content)
+    logger.info(f"Email change notification queued: {user.email}")
\ No newline at end of file
@@ -0,0 +1,138 @@
+"""
+Prometheus metrics for the auth flows, served at /metrics.
+
+Each process records into prometheus_client's registry. Under gunicorn,
+set PROMETHEUS_MULTIPROC_DIR to a shared, empty directory before the
+workers start; the endpoint then aggregates the values of every worker.
+"""
+import logging
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.http import HttpResponse
+from django.utils import timezone
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, \
+    generate_latest
+from prometheus_client import multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds',
+    'Request latency by URL name',
+    ['view', 'method', 'status'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+LOGINS = Counter('auth_logins_total', 'Login attempts', ['result'])
+TOKEN_REFRESHES = Counter('auth_token_refreshes_total', 'Successful token refreshes', ['rotated'])
+TOKENS_BLACKLISTED = Counter('auth_tokens_blacklisted_total', 'Refresh tokens added to the blacklist')
+EMAILS = Counter('auth_emails_total', 'Email delivery attempts by template', ['template', 'result'])
+TOKEN_VALIDATION_FAILURES = Counter(
+    'auth_token_validation_failures_total',
+    'Rejected access and refresh tokens',
+    ['token', 'reason'],
+)
+
+# Password hashing pool (accounts.hashing); the gauges are summed over live workers in multiprocess mode
+HASHING_TASKS = Counter('auth_password_hashing_tasks_total', 'Hashes submitted to the pool', ['result'])
+HASHING_IN_FLIGHT = Gauge(
+    'auth_password_hashing_in_flight', 'Hashes queued or running in the pool', multiprocess_mode='livesum',
+)
+HASHING_CAPACITY = Gauge(
+    'auth_password_hashing_capacity', 'Pool worker processes and queue slots', ['kind'], multiprocess_mode='livesum',
+)
+HASHING_SECONDS = Histogram(
+    'auth_password_hashing_seconds',
+    'Time from submitting a hash to the pool to its result',
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+
+class TokenTableCollector:
+    """VerifyEmailToken row counts by state, computed at scrape time and cached briefly"""
+
+    cache_key = 'metrics:verify_email_tokens'
+
+    def collect(self):
+        counts = cache.get(self.cache_key)
+        if counts is None:
+            try:
+                counts = self._count()
+            except Exception as e:
+                # Still serve the process metrics when the database is unavailable
+                logger.error(f"Token table metrics failed: {str(e)}")
+                return
+            cache.set(self.cache_key, counts, settings.METRICS_TABLE_STATS_TTL)
+
+        gauge = GaugeMetricFamily('auth_verify_email_tokens', 'VerifyEmailToken rows by state', labels=['state'])
+        for state, count in counts.items():
+            gauge.add_metric([state], count)
+        yield gauge
+
+    def _count(self):
+        from accounts.models import VerifyEmailToken
+
+        now = timezone.now()
+        return VerifyEmailToken.objects.aggregate(
+            active=Count('pk', filter=Q(is_used=False, expires_at__gte=now)),
+            expired=Count('pk', filter=Q(is_used=False, expires_at__lt=now)),
+            used=Count('pk', filter=Q(is_used=True)),
+        )
+
+
+_table_registry = CollectorRegistry(auto_describe=False)
+_table_registry.register(TokenTableCollector())
+
+
+def metrics_view(request):
+    """Expose metrics in the Prometheus text format"""
+    if not settings.METRICS_AUTH_TOKEN:
+        # Without a token the endpoint would be public, so it is only served in development
+        if not settings.DEBUG:
+            return HttpResponse(status=403)
+    elif request.headers.get('Authorization') != f'Bearer {settings.METRICS_AUTH_TOKEN}':
+        return HttpResponse(status=403)
+
+    if settings.PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    # Table sizes are the same from every worker, so they are collected once outside the aggregation
+    output = generate_latest(registry) + generate_latest(_table_registry)
+    return HttpResponse(output, content_type=CONTENT_TYPE_LATEST)
+
+
+class MetricsMiddleware:
+    """Observe request latency labelled by the resolved URL name"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self.observe(request, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.observe(request, response, time.perf_counter() - started)
+        return response
+
+    def observe(self, request, response, seconds):
+        match = request.resolver_match
+        view = match.url_name if match and match.url_name else 'unmatched'
+        REQUEST_LATENCY.labels(view, request.method, response.status_code).observe(seconds)
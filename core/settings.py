@@ -1,6 +1,7 @@
 from pathlib import Path
 from dotenv import load_dotenv
 from datetime import timedelta
+from django.core.exceptions import ImproperlyConfigured
 import os
 
 # Load environment variables from a .env file
@@ -57,6 +58,11 @@ CUSTOM_APPS = [
 INSTALLED_APPS += CUSTOM_APPS
 
 MIDDLEWARE = [
+    'core.timing.ServerTimingMiddleware',
+    'core.metrics.MetricsMiddleware',
+    'core.traffic.TrafficCaptureMiddleware',
+    'core.admission.AdmissionControlMiddleware',
+    'core.db.PrimaryPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -69,6 +75,27 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'core.urls'
 
+# Request instrumentation (core.timing) - Server-Timing header with db/hash/email/render durations,
+# and a warning when a request runs more queries than QUERY_BUDGET (0 = no budget)
+SERVER_TIMING_HEADER = os.getenv('SERVER_TIMING_HEADER', str(DEBUG)) == 'True'
+QUERY_BUDGET = int(os.getenv('QUERY_BUDGET', '0'))
+
+# Traffic capture (core.traffic) - fraction of requests under the prefixes written to TRAFFIC_CAPTURE_FILE
+# for `manage.py replay_traffic` (0 = off)
+TRAFFIC_CAPTURE_RATE = float(os.getenv('TRAFFIC_CAPTURE_RATE', '0'))
+TRAFFIC_CAPTURE_FILE = os.getenv('TRAFFIC_CAPTURE_FILE', str(BASE_DIR / 'traffic.jsonl'))
+TRAFFIC_CAPTURE_PREFIXES = ('/api/auth/',)
+
+# Prometheus metrics (core.metrics) at /metrics - PROMETHEUS_MULTIPROC_DIR aggregates gunicorn workers,
+# METRICS_AUTH_TOKEN must be sent as a Bearer token by the scraper; with DEBUG off the endpoint answers 403
+# until a token is set
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR', '')
+if not PROMETHEUS_MULTIPROC_DIR:
+    # prometheus_client switches to multiprocess mode whenever the variable exists, even if empty
+    os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+METRICS_AUTH_TOKEN = os.getenv('METRICS_AUTH_TOKEN', '')
+METRICS_TABLE_STATS_TTL = 60  # seconds the VerifyEmailToken row counts are cached between scrapes
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -88,13 +115,92 @@ WSGI_APPLICATION = 'core.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
+# SQLite by default; set DB_ENGINE (e.g. django.db.backends.postgresql) and the DB_* connection settings
+# for a database server. DB_REPLICAS lists read replicas, as host[:port] for a server or as database files
+# for SQLite; reads go to a replica unless the request has already written (see core.db)
+DB_ENGINE = os.getenv('DB_ENGINE', 'django.db.backends.sqlite3')
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', '60'))  # seconds a connection is kept open (0 = per request)
+# psycopg 3 connection pool (PostgreSQL only, needs psycopg[pool]); replaces persistent connections
+DB_POOL = os.getenv('DB_POOL', 'False') == 'True'
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '2'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+
+
+def database(name, host='', port=''):
+    config = {
+        'ENGINE': DB_ENGINE,
+        'NAME': name,
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': DB_CONN_MAX_AGE > 0,
+    }
+    if DB_ENGINE != 'django.db.backends.sqlite3':
+        config.update(
+            USER=os.getenv('DB_USER', ''),
+            PASSWORD=os.getenv('DB_PASSWORD', ''),
+            HOST=host,
+            PORT=port,
+        )
+        if DB_POOL:
+            config.update(CONN_MAX_AGE=0, CONN_HEALTH_CHECKS=False)
+            config['OPTIONS'] = {'pool': {'min_size': DB_POOL_MIN_SIZE, 'max_size': DB_POOL_MAX_SIZE}}
+    return config
+
+
 DATABASES = {
+    'default': database(
+        os.getenv('DB_NAME', str(BASE_DIR / 'db.sqlite3')),
+        os.getenv('DB_HOST', ''),
+        os.getenv('DB_PORT', ''),
+    ),
+}
+
+DATABASE_REPLICAS = []
+for index, replica in enumerate(filter(None, os.getenv('DB_REPLICAS', '').split(',')), start=1):
+    if DB_ENGINE == 'django.db.backends.sqlite3':
+        DATABASES[f'replica{index}'] = database(replica.strip())
+    else:
+        DATABASES[f'replica{index}'] = database(DATABASES['default']['NAME'], *replica.strip().split(':', 1))
+    # Tests read the replicas through the primary's test database
+    DATABASES[f'replica{index}']['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(f'replica{index}')
+
+DATABASE_ROUTERS = ['core.db.ReplicaRouter']
+
+# Seconds after a user's request writes during which that user's requests read from the primary, so a client
+# reads its own writes back on its next request (0 = only within the writing request). Uses the default cache
+DATABASE_PRIMARY_PIN_SECONDS = int(os.getenv('DB_PRIMARY_PIN_SECONDS', '5'))
+
+# Models always read from the primary: token state must not lag behind a logout or a redeemed link
+DATABASE_PRIMARY_MODELS = (
+    'accounts.verifyemailtoken',
+    'accounts.tokenfamily',
+    'accounts.emailoutbox',
+    'token_blacklist.outstandingtoken',
+    'token_blacklist.blacklistedtoken',
+)
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Use a shared backend (e.g. Redis) in production so invalidations reach every worker
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
     }
 }
 
+# Whether the default cache is shared between worker processes (entries written by one are seen by all)
+CACHE_IS_SHARED = CACHES['default']['BACKEND'] not in (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+# Per-process user cache used when JWT_AUTH_MODE=cached
+USER_CACHE_MAX_SIZE = int(os.getenv('USER_CACHE_MAX_SIZE', '10000'))
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', '300'))  # seconds
+USER_CACHE_ALIAS = 'default'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -113,6 +219,32 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashers - PASSWORD_HASHER (pbkdf2, argon2 or scrypt) hashes new passwords; the others stay
+# listed so existing hashes still verify and are upgraded on the next login.
+# Cost parameters are written by `python manage.py calibrate_hashers` (0 = Django's default)
+PASSWORD_HASHER = os.getenv('PASSWORD_HASHER', 'pbkdf2')
+PASSWORD_HASHER_CLASSES = {
+    'pbkdf2': 'accounts.hashers.CalibratedPBKDF2PasswordHasher',
+    'argon2': 'accounts.hashers.CalibratedArgon2PasswordHasher',  # requires argon2-cffi
+    'scrypt': 'accounts.hashers.CalibratedScryptPasswordHasher',
+}
+PASSWORD_HASHERS = [PASSWORD_HASHER_CLASSES[PASSWORD_HASHER]] + [
+    hasher for name, hasher in PASSWORD_HASHER_CLASSES.items() if name != PASSWORD_HASHER
+]
+PBKDF2_ITERATIONS = int(os.getenv('PBKDF2_ITERATIONS', '0'))
+ARGON2_TIME_COST = int(os.getenv('ARGON2_TIME_COST', '0'))
+ARGON2_MEMORY_COST = int(os.getenv('ARGON2_MEMORY_COST', '0'))  # KiB
+ARGON2_PARALLELISM = int(os.getenv('ARGON2_PARALLELISM', '0'))
+SCRYPT_WORK_FACTOR = int(os.getenv('SCRYPT_WORK_FACTOR', '0'))
+
+# Password hashing runs in a pool of worker processes so it doesn't hold the web worker's GIL
+# PASSWORD_HASHING_WORKERS=0 hashes inline on the request thread
+PASSWORD_HASHING_WORKERS = int(os.getenv('PASSWORD_HASHING_WORKERS', '0'))
+PASSWORD_HASHING_MAX_PENDING = int(os.getenv('PASSWORD_HASHING_MAX_PENDING', '64'))
+
+# Serve the account endpoints with the native async views (accounts.async_views) under ASGI
+ACCOUNTS_ASYNC_VIEWS = os.getenv('ACCOUNTS_ASYNC_VIEWS', 'False') == 'True'
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
 LANGUAGE_CODE = 'en-us'
@@ -134,15 +266,104 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Django REST Framework configuration
 # https://www.django-rest-framework.org/api-guide/settings/
 # https://django-rest-framework-simplejwt.readthedocs.io/en/latest/settings.html
+# JWT_AUTH_MODE: 'database' loads request.user from the database on every request,
+# 'cached' reads it through a per-process user cache invalidated on save/delete,
+# 'stateless' builds it from the token claims and only queries when other fields are used
+JWT_AUTH_MODE = os.getenv('JWT_AUTH_MODE', 'database')
+JWT_AUTHENTICATION_CLASSES = {
+    'database': 'accounts.authentication.JWTAuthentication',
+    'cached': 'accounts.authentication.CachedJWTAuthentication',
+    'stateless': 'accounts.authentication.StatelessJWTAuthentication',
+}
+
+# User fields embedded in tokens at login and refreshed on token refresh
+JWT_USER_CLAIMS = ('email', 'is_email_verified', 'is_active')
+
+# Tokens carry the user's token_version; refresh always rejects outdated versions, and so do requests that
+# change something (POST, PATCH, DELETE), checked against the primary database. Other requests are only
+# checked when JWT_CHECK_TOKEN_VERSION_ON_ACCESS is enabled (one cache lookup per request)
+JWT_CHECK_TOKEN_VERSION_ON_WRITE = True
+JWT_CHECK_TOKEN_VERSION_ON_ACCESS = os.getenv('JWT_CHECK_TOKEN_VERSION_ON_ACCESS', 'False') == 'True'
+# Seconds versions are cached for access checks (0 = read the database every time). A process-local cache
+# can't be invalidated from other workers, so versions are only cached in a shared one by default
+TOKEN_VERSION_CACHE_TTL = int(os.getenv('TOKEN_VERSION_CACHE_TTL', '300' if CACHE_IS_SHARED else '0'))
+
+# Refresh token rotation: 'blacklist' records every refresh token as an OutstandingToken and blacklists it
+# when rotated (three writes per refresh); 'family' records one TokenFamily row per session and rotates
+# with a single conditional UPDATE, revoking the session when an already-rotated token is presented again
+TOKEN_ROTATION = os.getenv('TOKEN_ROTATION', 'blacklist')
+# Seconds after a family rotation during which the token it replaced can still be refreshed once more, for
+# concurrent refreshes by the same client (0 = any reuse revokes the session)
+TOKEN_FAMILY_REUSE_GRACE = int(os.getenv('TOKEN_FAMILY_REUSE_GRACE', '10'))
+TOKEN_ROTATION_BACKENDS = {
+    'blacklist': 'accounts.rotation.BlacklistRotation',
+    'family': 'accounts.rotation.FamilyRotation',
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        JWT_AUTHENTICATION_CLASSES[JWT_AUTH_MODE],
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ),
+    # Only views with a rate in THROTTLE_RATES are throttled
+    'DEFAULT_THROTTLE_CLASSES': (
+        'accounts.throttling.IPRateThrottle',
+        'accounts.throttling.EmailRateThrottle',
+    ),
+    # Proxies in front of the app; the client IP used for throttling is read from X-Forwarded-For past them
+    'NUM_PROXIES': int(os.getenv('THROTTLE_NUM_PROXIES', '0')),
 }
 
+# Rate limits per URL name, keyed by client IP ("<name>.ip") and by the email address in the
+# request ("<name>.email"); counters live in the default cache, so use a shared one with several workers.
+THROTTLE_ENABLED = os.getenv('THROTTLE_ENABLED', 'True') == 'True'
+THROTTLE_RATES = {
+    'token_obtain_pair.ip': '60/minute',
+    'token_obtain_pair.email': '10/minute',
+    'register.ip': '20/hour',
+    'register.email': '5/hour',
+    'reset_password.ip': '20/hour',
+    'reset_password.email': '5/hour',
+    'reset_password_confirm.ip': '20/hour',
+    'change_email.ip': '20/hour',
+    'change_email.email': '5/hour',
+} if THROTTLE_ENABLED else {}
+
+# Requests to these views (URL name -> methods that hash or check a password) running at once per process;
+# more are shed with 503 and Retry-After instead of queueing (0 = no limit)
+ADMISSION_CONTROL_MAX_CONCURRENT = int(os.getenv('ADMISSION_CONTROL_MAX_CONCURRENT', str((os.cpu_count() or 1) * 2)))
+ADMISSION_CONTROL_VIEWS = {
+    'token_obtain_pair': ('POST',),
+    'register': ('POST',),
+    'reset_password_confirm': ('POST',),
+    'change_password': ('POST',),
+    'change_email': ('POST',),
+    # Only deleting the account checks the password
+    'profile': ('DELETE',),
+}
+ADMISSION_CONTROL_RETRY_AFTER = 1  # seconds
+
+# JWT signing - HS256 with SECRET_KEY by default. For RS256, ES256 or EdDSA (requires cryptography), put keys
+# made by `manage.py generate_jwt_key` in JWT_KEYS_DIR and set JWT_SIGNING_KEY_ID to the kid that signs new
+# tokens. Tokens are verified with any <kid>.pub in JWT_KEYS_DIR, all published at /.well-known/jwks.json
+JWT_ALGORITHM = os.getenv('JWT_ALGORITHM', 'HS256')
+JWT_KEYS_DIR = os.getenv('JWT_KEYS_DIR', str(BASE_DIR / 'keys'))
+JWT_SIGNING_KEY_ID = os.getenv('JWT_SIGNING_KEY_ID', '')
+JWKS_MAX_AGE = int(os.getenv('JWKS_MAX_AGE', '3600'))  # seconds clients may cache the JWKS
+
+if JWT_ALGORITHM.startswith('HS'):
+    JWT_SIGNING_KEY = SECRET_KEY
+elif not JWT_SIGNING_KEY_ID:
+    raise ImproperlyConfigured(f'JWT_ALGORITHM={JWT_ALGORITHM} requires JWT_SIGNING_KEY_ID')
+else:
+    try:
+        with open(os.path.join(JWT_KEYS_DIR, f'{JWT_SIGNING_KEY_ID}.key')) as key_file:
+            JWT_SIGNING_KEY = key_file.read()
+    except OSError as e:
+        raise ImproperlyConfigured(f'Cannot read the JWT signing key {JWT_SIGNING_KEY_ID}: {e}') from e
+
 SIMPLE_JWT = {
     # Token lifetimes
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=15),
@@ -151,16 +372,50 @@ SIMPLE_JWT = {
     # Rotation settings
     "ROTATE_REFRESH_TOKENS": True,
     "BLACKLIST_AFTER_ROTATION": True,
-    "UPDATE_LAST_LOGIN": True,
+    # last_login is written by accounts.activity instead (see ACTIVITY_FLUSH_INTERVAL)
+    "UPDATE_LAST_LOGIN": False,
 
     # Algorithm
-    "ALGORITHM": "HS256",
-    "SIGNING_KEY": SECRET_KEY,
+    "ALGORITHM": JWT_ALGORITHM,
+    "SIGNING_KEY": JWT_SIGNING_KEY,
+    "AUTH_TOKEN_CLASSES": ("accounts.tokens.AccessToken",),
 
     # Header
     "AUTH_HEADER_TYPES": ("Bearer",),
+
+    # Serializers
+    "TOKEN_OBTAIN_SERIALIZER": "accounts.serializers.CustomTokenObtainPairSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "accounts.serializers.CustomTokenRefreshSerializer",
 }
 
+# Verification emails: a request inside VERIFY_EMAIL_RESEND_INTERVAL seconds of the previous email for the same
+# user and purpose sends nothing (0 = always send), and unused tokens with at least
+# VERIFY_TOKEN_REUSE_MIN_REMAINING seconds left are sent again instead of creating new ones
+VERIFY_EMAIL_RESEND_INTERVAL = int(os.getenv('VERIFY_EMAIL_RESEND_INTERVAL', '60'))
+VERIFY_TOKEN_REUSE_MIN_REMAINING = 3600
+
+# VERIFY_TOKEN_MODE: 'database' stores verification, reset and email change tokens in VerifyEmailToken;
+# 'signed' puts a signed, expiring payload in the link instead, so issuing a token writes nothing and
+# redeeming one only reads the user. Redeemed signed tokens are remembered in the default cache until they
+# expire, so signed mode needs a cache shared by all workers
+VERIFY_TOKEN_MODE = os.getenv('VERIFY_TOKEN_MODE', 'database')
+if VERIFY_TOKEN_MODE == 'signed' and not CACHE_IS_SHARED:
+    # A per-process cache would let each worker redeem the same link once
+    raise ImproperlyConfigured('VERIFY_TOKEN_MODE=signed requires a shared CACHE_BACKEND')
+
+# Token blacklist index - Bloom filter of blacklisted refresh tokens kept in each process
+TOKEN_BLACKLIST_BLOOM_CAPACITY = int(os.getenv('TOKEN_BLACKLIST_BLOOM_CAPACITY', '1000000'))
+TOKEN_BLACKLIST_BLOOM_ERROR_RATE = 0.001
+# Seconds between pulls of tokens blacklisted by other processes (one indexed range query that only returns
+# rows not seen yet). Misses in between skip the database, so a token blacklisted by another worker can
+# still be accepted here for up to this long (0 = pull on every miss, one query per refresh)
+TOKEN_BLACKLIST_SYNC_INTERVAL = int(os.getenv('TOKEN_BLACKLIST_SYNC_INTERVAL', '2'))
+TOKEN_BLACKLIST_GAP_TIMEOUT = 60  # seconds skipped ids are re-checked for late commits, must exceed the longest transaction
+TOKEN_BLACKLIST_REBUILD_INTERVAL = 3600  # seconds between rebuilds that drop expired tokens
+
+# Batch token introspection (POST /api/auth/introspect/, staff users only)
+INTROSPECTION_MAX_TOKENS = int(os.getenv('INTROSPECTION_MAX_TOKENS', '500'))
+
 # Custom user model
 # https://learndjango.com/tutorials/django-custom-user-model
 AUTH_USER_MODEL = 'accounts.CustomUser'
@@ -174,6 +429,23 @@ else:
 # Required email settings
 DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL')
 
+# Email outbox - emails are queued in the database and sent after the request commits
+# Set EMAIL_OUTBOX_THREADS=0 to leave delivery to `manage.py process_email_outbox`
+EMAIL_OUTBOX_THREADS = int(os.getenv('EMAIL_OUTBOX_THREADS', '4'))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv('EMAIL_OUTBOX_MAX_ATTEMPTS', '5'))
+EMAIL_OUTBOX_RETRY_BACKOFF = int(os.getenv('EMAIL_OUTBOX_RETRY_BACKOFF', '30'))  # seconds, doubled per attempt
+EMAIL_OUTBOX_MAX_BACKOFF = int(os.getenv('EMAIL_OUTBOX_MAX_BACKOFF', '3600'))
+EMAIL_OUTBOX_LEASE_SECONDS = int(os.getenv('EMAIL_OUTBOX_LEASE_SECONDS', '300'))
+EMAIL_OUTBOX_RETENTION_DAYS = int(os.getenv('EMAIL_OUTBOX_RETENTION_DAYS', '7'))
+
+# User activity timestamps (last_login, and last_seen on every authenticated request when enabled) are
+# buffered per process and written as bulk UPDATEs every ACTIVITY_FLUSH_INTERVAL seconds, the most that a
+# crashed worker can lose (0 = write each timestamp immediately)
+ACTIVITY_FLUSH_INTERVAL = int(os.getenv('ACTIVITY_FLUSH_INTERVAL', '10'))
+ACTIVITY_TRACK_LAST_SEEN = os.getenv('ACTIVITY_TRACK_LAST_SEEN', 'False') == 'True'
+ACTIVITY_FLUSH_BATCH_SIZE = 500
+ACTIVITY_BUFFER_MAX_SIZE = 50000  # buffered timestamps that trigger an early flush
+
 # AWS SES - required for production
 AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID')
 AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
@@ -208,6 +480,11 @@ LOGGING = {
             'level': 'INFO' if DEBUG else 'WARNING',
             'propagate': False,
         },
+        'core': {
+            'handlers': ['console'],
+            'level': 'INFO' if DEBUG else 'WARNING',
+            'propagate': False,
+        },
         'accounts': {
             'handlers': ['console'],
             'level': 'INFO' if DEBUG else 'WARNING',
@@ -0,0 +1,157 @@
+"""
+Per-request performance instrumentation.
+
+ServerTimingMiddleware collects, for each request, the time spent in the
+database, password hashing, email and response rendering, plus the number
+of queries (transaction control statements are timed on their own). The
+totals are returned in a Server-Timing header and logged with structured
+fields. Code outside the middleware records time with `timed(name)`, which
+is a no-op outside a request.
+"""
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+_timings = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = {}
+        self.counts = {}
+
+    def add(self, name, seconds):
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    @property
+    def queries(self):
+        return self.counts.get('db', 0)
+
+    def header(self, total):
+        metrics = [
+            f'{name};dur={seconds * 1000:.1f};desc="{self.counts[name]}x"'
+            for name, seconds in self.durations.items()
+        ]
+        metrics.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(metrics)
+
+
+@contextmanager
+def timed(name):
+    """Add the time spent in the block to the current request's `name` timing"""
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started)
+
+
+def query_budget(queries):
+    """Warn when a request to the decorated view runs more than `queries` queries"""
+    def decorator(view):
+        view.query_budget = queries
+        return view
+    return decorator
+
+
+# Transaction control is timed apart from queries: SQLite sends BEGIN through the cursor while PostgreSQL
+# doesn't, and tests wrap every atomic block in a SAVEPOINT/RELEASE pair, so counting it as queries would
+# make the same view's query count differ between backends and between tests and production
+TRANSACTION_STATEMENTS = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE')
+
+
+def _time_query(execute, sql, params, many, context):
+    name = 'transaction' if sql.lstrip()[:10].upper().startswith(TRANSACTION_STATEMENTS) else 'db'
+    with timed(name):
+        return execute(sql, params, many, context)
+
+
+def _instrument_connection(sender, connection, **kwargs):
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+# Wrappers are installed per connection, so queries are counted in whichever thread runs them
+connection_created.connect(_instrument_connection)
+
+
+class ServerTimingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        for connection in connections.all(initialized_only=True):
+            _instrument_connection(None, connection)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        timings = RequestTimings()
+        token = _timings.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            _timings.reset(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _timings.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _timings.reset(token)
+        return self.finish(request, response, timings)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = getattr(view_func, 'query_budget', settings.QUERY_BUDGET)
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered right after this hook returns
+        timings = _timings.get()
+        if timings is not None:
+            started = time.perf_counter()
+            response.add_post_render_callback(lambda r: timings.add('render', time.perf_counter() - started))
+        return response
+
+    def finish(self, request, response, timings):
+        total = time.perf_counter() - timings.started
+
+        if settings.SERVER_TIMING_HEADER:
+            response['Server-Timing'] = timings.header(total)
+
+        view = request.resolver_match.view_name if request.resolver_match else request.path
+        fields = {
+            'view': view,
+            'status': response.status_code,
+            'duration_ms': round(total * 1000, 1),
+            'queries': timings.queries,
+            **{f'{name}_ms': round(seconds * 1000, 1) for name, seconds in timings.durations.items()},
+        }
+        logger.info(f"{request.method} {view} {response.status_code} in {fields['duration_ms']}ms, "
+                    f"{timings.queries} queries", extra={'timing': fields})
+
+        budget = getattr(request, 'query_budget', 0)
+        if budget and timings.queries > budget:
+            logger.warning(f"Query budget exceeded: {view} ran {timings.queries} queries (budget {budget})",
+                           extra={'timing': fields})
+
+        return response
@@ -0,0 +1,135 @@
+"""
+Sampled capture of API traffic for replay (see `manage.py replay_traffic`).
+
+TrafficCaptureMiddleware appends a sample of requests under
+TRAFFIC_CAPTURE_PREFIXES to TRAFFIC_CAPTURE_FILE as JSON lines, with the
+arrival time and original latency. Passwords and tokens are redacted, the
+Authorization header is never written, and every other string in the body
+or query string (emails, names, phone numbers) is replaced by a stable
+pseudonym keyed with SECRET_KEY, so the file can leave production.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import random
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+logger = logging.getLogger(__name__)
+
+REDACTED = '[redacted]'
+SECRET_FIELDS = {'password', 'old_password', 'new_password', 'token', 'tokens', 'refresh', 'access'}
+EMAIL_FIELDS = {'email', 'new_email'}
+MAX_BODY_SIZE = 64 * 1024
+
+_write_lock = threading.Lock()
+
+
+def _digest(value):
+    # Keyed, so pseudonyms of guessable values (phone numbers, names) can't be reversed by hashing candidates
+    return hmac.new(settings.SECRET_KEY.encode(), str(value).strip().lower().encode(), hashlib.sha256).hexdigest()
+
+
+def pseudonymize_email(email):
+    """Replace an address with a stable fake one, so repeat visitors stay recognisable"""
+    return f'user-{_digest(email)[:16]}@example.com'
+
+
+def pseudonymize(value):
+    """Replace a string with a stable pseudonym short enough for any of the API's fields"""
+    return f'anon-{_digest(value)[:12]}'
+
+
+def redact(data, field=None):
+    """Redact secrets and pseudonymize every other string, keeping the shape of the data for replay"""
+    if isinstance(data, dict):
+        return {key: redact(value, key) for key, value in data.items()}
+    if isinstance(data, list):
+        return [redact(value, field) for value in data]
+    if field in SECRET_FIELDS:
+        return REDACTED
+    if isinstance(data, str) and data:
+        return pseudonymize_email(data) if field in EMAIL_FIELDS else pseudonymize(data)
+    # Numbers, booleans and nulls carry no personal data in this API
+    return data
+
+
+def redact_query(query_string):
+    return urlencode([(key, redact(value, key)) for key, value in parse_qsl(query_string, keep_blank_values=True)])
+
+
+class TrafficCaptureMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if settings.TRAFFIC_CAPTURE_RATE <= 0:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        if not self.sampled(request):
+            return self.get_response(request)
+
+        body = self.read_body(request)
+        arrived = time.time()
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self.write(self.record(request, response, body, arrived, time.perf_counter() - started))
+        return response
+
+    async def __acall__(self, request):
+        if not self.sampled(request):
+            return await self.get_response(request)
+
+        body = self.read_body(request)
+        arrived = time.time()
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        record = self.record(request, response, body, arrived, time.perf_counter() - started)
+        await sync_to_async(self.write, thread_sensitive=False)(record)
+        return response
+
+    def sampled(self, request):
+        return request.path.startswith(settings.TRAFFIC_CAPTURE_PREFIXES) \
+            and random.random() < settings.TRAFFIC_CAPTURE_RATE
+
+    def read_body(self, request):
+        # Read the body before the view consumes the stream; Django keeps it for the view
+        if request.body and len(request.body) <= MAX_BODY_SIZE:
+            try:
+                return redact(json.loads(request.body))
+            except ValueError:
+                pass
+        return None
+
+    def record(self, request, response, body, arrived, duration):
+        return {
+            'ts': round(arrived, 6),
+            'method': request.method,
+            'path': request.path,
+            'query': redact_query(request.META.get('QUERY_STRING', '')),
+            'content_type': request.content_type,
+            'authenticated': 'HTTP_AUTHORIZATION' in request.META,
+            'body': body,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 3),
+        }
+
+    def write(self, record):
+        try:
+            line = json.dumps(record, default=str) + '\n'
+            with _write_lock, open(settings.TRAFFIC_CAPTURE_FILE, 'a') as f:
+                f.write(line)
+        except Exception as e:
+            logger.error(f"Traffic capture failed: {str(e)}")
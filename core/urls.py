@@ -1,14 +1,20 @@
+from django.conf import settings
 from django.contrib import admin
 from django.urls import include, path
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
 )
+from accounts.views import jwks_view
+from .metrics import metrics_view
+from .timing import query_budget
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
+    path('.well-known/jwks.json', jwks_view, name='jwks'),
     path('api-auth/', include('rest_framework.urls')),
-    path('api/auth/login/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
-    path('api/auth/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
-    path('api/auth/', include('accounts.urls')),
+    path('api/auth/login/', query_budget(3)(TokenObtainPairView.as_view()), name='token_obtain_pair'),
+    path('api/auth/refresh/', query_budget(9)(TokenRefreshView.as_view()), name='token_refresh'),
+    path('api/auth/', include('accounts.async_urls' if settings.ACCOUNTS_ASYNC_VIEWS else 'accounts.urls')),
 ]
\ No newline at end of file
@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 application = get_wsgi_application()
+
+# Build per-process indexes before serving, then close the connection in case the server forks workers
+from django.db import connections  # noqa: E402
+from accounts.blacklist import blacklist_index  # noqa: E402
+
+blacklist_index.warm()
+connections.close_all()